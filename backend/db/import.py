@@ -10,11 +10,19 @@ Usage:
 
 import argparse
 import csv
+import fcntl
+import hashlib
 import json
+import math
 import os
+import shutil
 import sqlite3
 import sys
+from datetime import datetime, timezone
 from pathlib import Path
+from typing import IO, Optional
+
+import numpy as np
 
 # Increase CSV field size limit for large description fields
 csv.field_size_limit(sys.maxsize)
@@ -23,6 +31,8 @@ csv.field_size_limit(sys.maxsize)
 DEFAULT_DATA_DIR = Path(__file__).parent.parent / "data"
 DEFAULT_DB_PATH = Path(__file__).parent.parent / "data" / "risingfruit.db"
 SCHEMA_PATH = Path(__file__).parent / "schema.sql"
+COMPACT_SCHEMA_PATH = Path(__file__).parent / "schema_compact.sql"
+INDEXES_PATH = Path(__file__).parent / "indexes.sql"
 
 # Localized name columns in types.csv
 LOCALIZED_COLUMNS = [
@@ -31,17 +41,108 @@ LOCALIZED_COLUMNS = [
     "tr_name", "uk_name", "vi_name", "zh_hans_name", "zh_hant_name"
 ]
 
+# Compact storage: fixed-point coordinate scale for the integer R-tree
+COORD_SCALE = 10_000_000
+
 # Batch size for memory-efficient processing
 BATCH_SIZE = 5000  # Smaller batches for lower memory usage
 
+# Location ids above this are reserved for POST /api/locations submissions
+# (must match src/writer.py); export rows in that range are skipped
+SUBMISSION_ID_BASE = 1_000_000_000
+
+# location_submissions columns copied into locations when carried forward
+SUBMISSION_COLUMNS = [
+    "lat", "lng", "unverified", "description", "season_start", "season_stop",
+    "no_season", "author", "access",
+]
+
+# Density grid pyramid: Web Mercator tiles from zoom 0 to DENSITY_MAX_ZOOM
+DENSITY_MAX_ZOOM = 12
+DENSITY_CATEGORIES = ["forager", "honeybee", "grafter", "freegan"]
+MAX_MERCATOR_LAT = 85.05112878
+
+# Change log: tile zoom for location_changes cells, and how many dataset
+# versions of history to carry forward into each new database
+CHANGE_CELL_ZOOM = DENSITY_MAX_ZOOM
+CHANGE_RETENTION_VERSIONS = 30
+
+# Location columns compared to detect updated rows between imports
+LOCATION_COMPARE_COLUMNS = [
+    "lat", "lng", "unverified", "description", "season_start", "season_stop",
+    "no_season", "author", "address", "access", "import_link", "original_ids",
+    "created_at", "updated_at",
+]
+
+# Zooms of the density pyramid that also store per-type counts (facets)
+FACET_ZOOMS = (0, 2, 4, 6, 8, 10, 12)
+
+# Near-duplicate detection: largest distance to a group's first location, and
+# meters per degree of latitude
+DUPLICATE_CELL_M = 5.0
+METERS_PER_DEGREE = 111_195.0
+
+# Columnar store: rows per block in the block min/max index
+COLUMNAR_BLOCK_SIZE = 1024
+COLUMNAR_FORMAT_VERSION = 1
+
+# Regional shards (--shard-zoom): one file per non-empty Web Mercator tile
+SHARD_FORMAT_VERSION = 1
+SHARD_LOCATION_TABLES = ["locations", "location_details", "location_types", "location_groups"]
+
 
 def log(msg: str) -> None:
     """Print log message with prefix."""
     print(f"[IMPORT] {msg}", flush=True)
 
 
-def create_database(db_path: Path) -> sqlite3.Connection:
-    """Create database and apply schema."""
+def lock_database(db_path: Path) -> IO:
+    """
+    Take the import lock next to the database; held until the returned file is closed.
+
+    The API's submission writer holds the same lock (`<db>.lock`) shared for
+    each batch and opens a fresh connection under it, so it never writes to
+    a database this import is moving aside. Waits for a batch in progress.
+    """
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    lock = open(db_path.with_name(db_path.name + ".lock"), "a")
+    fcntl.flock(lock, fcntl.LOCK_EX)
+    return lock
+
+
+def stash_previous_database(db_path: Path, shards_dir: Optional[Path] = None) -> Optional[Path]:
+    """
+    Move the existing database aside so the new import can be diffed against it.
+
+    The WAL is checkpointed first so the stashed file is self-contained. If
+    the previous import was sharded, its shards' location rows are folded back
+    into the stashed copy.
+    """
+    if not db_path.exists():
+        return None
+    
+    previous_path = db_path.with_name(db_path.name + ".prev")
+    log(f"Keeping previous database as {previous_path} for change detection")
+    conn = sqlite3.connect(str(db_path))
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+    
+    db_path.replace(previous_path)
+    for suffix in ("-wal", "-shm"):
+        leftover = db_path.with_name(db_path.name + suffix)
+        if leftover.exists():
+            leftover.unlink()
+    
+    # Fold shards into the stashed copy only, never the file the API may have open
+    if shards_dir is not None and (shards_dir / "manifest.json").exists():
+        conn = sqlite3.connect(str(previous_path))
+        merge_shards(conn, shards_dir)
+        conn.close()
+    return previous_path
+
+
+def create_database(db_path: Path, compact: bool = False) -> sqlite3.Connection:
+    """Create database and apply schema (plus the compact storage overrides if requested)."""
     log(f"Creating database at {db_path}")
     
     # Remove existing database
@@ -63,11 +164,22 @@ def create_database(db_path: Path) -> sqlite3.Connection:
     with open(SCHEMA_PATH, "r") as f:
         schema = f.read()
     conn.executescript(schema)
+    if compact:
+        with open(COMPACT_SCHEMA_PATH, "r") as f:
+            conn.executescript(f.read())
     conn.commit()
     
     return conn
 
 
+def create_indexes(conn: sqlite3.Connection) -> None:
+    """Build the secondary indexes (indexes.sql) once the location tables are loaded."""
+    log("Creating indexes...")
+    with open(INDEXES_PATH, "r") as f:
+        conn.executescript(f.read())
+    conn.commit()
+
+
 def parse_bool(value: str) -> int:
     """Parse boolean string to integer (0/1)."""
     if not value:
@@ -136,8 +248,13 @@ def import_types(conn: sqlite3.Connection, data_dir: Path) -> int:
     return count
 
 
-def import_locations(conn: sqlite3.Connection, data_dir: Path) -> int:
-    """Import locations.csv into database with memory-efficient chunked processing."""
+def import_locations(conn: sqlite3.Connection, data_dir: Path, compact: bool = False) -> int:
+    """
+    Import locations.csv into database with memory-efficient chunked processing.
+    
+    In compact mode the R-tree holds fixed-point coordinates (degrees x
+    COORD_SCALE) and address/import_link/original_ids go to location_details.
+    """
     locations_file = data_dir / "locations.csv"
     if not locations_file.exists():
         log(f"ERROR: {locations_file} not found")
@@ -145,25 +262,65 @@ def import_locations(conn: sqlite3.Connection, data_dir: Path) -> int:
     
     log(f"Importing locations from {locations_file}...")
     log(f"  Using batch size of {BATCH_SIZE} for memory efficiency")
+    if compact:
+        log("  Compact storage: integer R-tree, cold columns in location_details")
     
     # Disable triggers and foreign keys during bulk import for performance
     conn.execute("PRAGMA foreign_keys = OFF")
-    conn.execute("DROP TRIGGER IF EXISTS tr_locations_insert")
-    conn.execute("DROP TRIGGER IF EXISTS tr_locations_update")
-    conn.execute("DROP TRIGGER IF EXISTS tr_locations_delete")
+    triggers = conn.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'locations'"
+    ).fetchall()
+    for name, _ in triggers:
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+    
+    if compact:
+        locations_sql = """
+            INSERT INTO locations (
+                id, lat, lng, unverified, description, season_start, season_stop,
+                no_season, author, access, hidden, created_at, updated_at
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """
+    else:
+        locations_sql = """
+            INSERT INTO locations (
+                id, lat, lng, unverified, description, season_start, season_stop,
+                no_season, author, address, access, import_link, original_ids,
+                hidden, created_at, updated_at
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """
     
     cursor = conn.cursor()
     count = 0
     rtree_count = 0
     lt_count = 0
+    reserved_count = 0
+    
+    batch_locations = []
+    batch_details = []
+    batch_rtree = []
+    batch_lt = []
+    
+    def insert_batch() -> None:
+        """Write the current batches and commit."""
+        cursor.executemany(locations_sql, batch_locations)
+        if batch_details:
+            cursor.executemany(
+                "INSERT INTO location_details (location_id, address, import_link, original_ids) VALUES (?, ?, ?, ?)",
+                batch_details
+            )
+        cursor.executemany(
+            "INSERT INTO locations_rtree (id, min_lat, max_lat, min_lng, max_lng) VALUES (?, ?, ?, ?, ?)",
+            batch_rtree
+        )
+        cursor.executemany(
+            "INSERT OR IGNORE INTO location_types (location_id, type_id) VALUES (?, ?)",
+            batch_lt
+        )
+        conn.commit()
     
     with open(locations_file, "r", encoding="utf-8") as f:
         reader = csv.DictReader(f)
         
-        batch_locations = []
-        batch_rtree = []
-        batch_lt = []
-        
         for row in reader:
             try:
                 location_id = int(row["id"])
@@ -171,29 +328,60 @@ def import_locations(conn: sqlite3.Connection, data_dir: Path) -> int:
                 lng = float(row["lng"])
             except (ValueError, KeyError):
                 continue
+            if location_id > SUBMISSION_ID_BASE:
+                reserved_count += 1
+                continue
             
-            # Add to location batch
-            batch_locations.append((
-                location_id,
-                lat,
-                lng,
-                parse_bool(row.get("unverified", "")),
-                row.get("description") or None,
-                row.get("season_start") or None,
-                row.get("season_stop") or None,
-                parse_bool(row.get("no_season", "")),
-                row.get("author") or None,
-                row.get("address") or None,
-                row.get("access") or None,
-                row.get("import_link") or None,
-                row.get("original_ids") or None,
-                parse_bool(row.get("hidden", "")),
-                row.get("created_at") or None,
-                row.get("updated_at") or None
-            ))
+            address = row.get("address") or None
+            import_link = row.get("import_link") or None
+            original_ids = row.get("original_ids") or None
             
-            # Add to R-tree batch
-            batch_rtree.append((location_id, lat, lat, lng, lng))
+            # Add to location batch
+            if compact:
+                batch_locations.append((
+                    location_id,
+                    lat,
+                    lng,
+                    parse_bool(row.get("unverified", "")),
+                    row.get("description") or None,
+                    row.get("season_start") or None,
+                    row.get("season_stop") or None,
+                    parse_bool(row.get("no_season", "")),
+                    row.get("author") or None,
+                    row.get("access") or None,
+                    parse_bool(row.get("hidden", "")),
+                    row.get("created_at") or None,
+                    row.get("updated_at") or None
+                ))
+                # Only rows that have cold data get a details row
+                if address or import_link or original_ids:
+                    batch_details.append((location_id, address, import_link, original_ids))
+                
+                fixed_lat = round(lat * COORD_SCALE)
+                fixed_lng = round(lng * COORD_SCALE)
+                batch_rtree.append((location_id, fixed_lat, fixed_lat, fixed_lng, fixed_lng))
+            else:
+                batch_locations.append((
+                    location_id,
+                    lat,
+                    lng,
+                    parse_bool(row.get("unverified", "")),
+                    row.get("description") or None,
+                    row.get("season_start") or None,
+                    row.get("season_stop") or None,
+                    parse_bool(row.get("no_season", "")),
+                    row.get("author") or None,
+                    address,
+                    row.get("access") or None,
+                    import_link,
+                    original_ids,
+                    parse_bool(row.get("hidden", "")),
+                    row.get("created_at") or None,
+                    row.get("updated_at") or None
+                ))
+                
+                # Add to R-tree batch
+                batch_rtree.append((location_id, lat, lat, lng, lng))
             
             # Parse type_ids and add to location_types batch
             type_ids_str = row.get("type_ids", "").strip("[]")
@@ -208,106 +396,837 @@ def import_locations(conn: sqlite3.Connection, data_dir: Path) -> int:
             
             # Process batch when it reaches the batch size
             if len(batch_locations) >= BATCH_SIZE:
-                # Insert locations
-                cursor.executemany("""
-                    INSERT INTO locations (
-                        id, lat, lng, unverified, description, season_start, season_stop,
-                        no_season, author, address, access, import_link, original_ids,
-                        hidden, created_at, updated_at
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """, batch_locations)
-                
-                # Insert R-tree entries
-                cursor.executemany(
-                    "INSERT INTO locations_rtree (id, min_lat, max_lat, min_lng, max_lng) VALUES (?, ?, ?, ?, ?)",
-                    batch_rtree
-                )
-                
-                # Insert location_types
-                cursor.executemany(
-                    "INSERT OR IGNORE INTO location_types (location_id, type_id) VALUES (?, ?)",
-                    batch_lt
-                )
-                
-                # Commit and update counts
-                conn.commit()
+                insert_batch()
                 count += len(batch_locations)
                 rtree_count += len(batch_rtree)
                 lt_count += len(batch_lt)
                 
                 # Clear batches to free memory
-                batch_locations = []
-                batch_rtree = []
-                batch_lt = []
+                batch_locations.clear()
+                batch_details.clear()
+                batch_rtree.clear()
+                batch_lt.clear()
                 
                 if count % 100000 == 0:
                     log(f"  Imported {count:,} locations...")
         
         # Process remaining batch
         if batch_locations:
-            cursor.executemany("""
-                INSERT INTO locations (
-                    id, lat, lng, unverified, description, season_start, season_stop,
-                    no_season, author, address, access, import_link, original_ids,
-                    hidden, created_at, updated_at
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, batch_locations)
-            
-            cursor.executemany(
-                "INSERT INTO locations_rtree (id, min_lat, max_lat, min_lng, max_lng) VALUES (?, ?, ?, ?, ?)",
-                batch_rtree
-            )
-            
-            cursor.executemany(
-                "INSERT OR IGNORE INTO location_types (location_id, type_id) VALUES (?, ?)",
-                batch_lt
-            )
-            
-            conn.commit()
+            insert_batch()
             count += len(batch_locations)
             rtree_count += len(batch_rtree)
             lt_count += len(batch_lt)
     
     log(f"  Imported {count:,} locations")
+    if reserved_count:
+        log(f"  WARNING: skipped {reserved_count:,} locations with ids in the submission range")
     log(f"  Indexed {rtree_count:,} locations in R-tree")
     log(f"  Created {lt_count:,} location-type links")
     
-    # Recreate triggers and re-enable foreign keys
+    # Recreate triggers (as defined by the applied schema) and re-enable foreign keys
     log("  Recreating triggers...")
-    conn.executescript("""
-        CREATE TRIGGER IF NOT EXISTS tr_locations_insert
-        AFTER INSERT ON locations
-        BEGIN
-            INSERT INTO locations_rtree (id, min_lat, max_lat, min_lng, max_lng)
-            VALUES (NEW.id, NEW.lat, NEW.lat, NEW.lng, NEW.lng);
-        END;
-
-        CREATE TRIGGER IF NOT EXISTS tr_locations_update
-        AFTER UPDATE OF lat, lng ON locations
-        BEGIN
-            UPDATE locations_rtree 
-            SET min_lat = NEW.lat, max_lat = NEW.lat,
-                min_lng = NEW.lng, max_lng = NEW.lng
-            WHERE id = NEW.id;
-        END;
-
-        CREATE TRIGGER IF NOT EXISTS tr_locations_delete
-        AFTER DELETE ON locations
-        BEGIN
-            DELETE FROM locations_rtree WHERE id = OLD.id;
-        END;
-    """)
+    for _, sql in triggers:
+        conn.execute(sql)
     conn.execute("PRAGMA foreign_keys = ON")
     conn.commit()
     
     return count
 
 
+def carry_forward_submissions(
+    conn: sqlite3.Connection,
+    previous_path: Optional[Path],
+    compact: bool = False,
+) -> int:
+    """
+    Copy the previous database's location submissions into this one.
+
+    Submissions exist only in the served database, never in the export, so
+    each import re-adds them: location_submissions is copied as is, and
+    every submission is inserted into locations (the R-tree follows via the
+    triggers), location_details and location_types, linking only types the
+    new export still has. Run after import_locations and before anything
+    that reads locations, so change detection and derived tables see them.
+    """
+    if previous_path is None:
+        return 0
+    conn.execute("ATTACH DATABASE ? AS prev", (str(previous_path),))
+    try:
+        has_submissions = conn.execute(
+            "SELECT 1 FROM prev.sqlite_master WHERE type = 'table' AND name = 'location_submissions'"
+        ).fetchone()
+        if not has_submissions:
+            return 0
+        conn.execute("INSERT INTO location_submissions SELECT * FROM prev.location_submissions")
+        conn.execute(f"""
+            INSERT INTO locations (id, {", ".join(SUBMISSION_COLUMNS)}, {"" if compact else "address, "}created_at, updated_at)
+            SELECT location_id, {", ".join(SUBMISSION_COLUMNS)}, {"" if compact else "address, "}created_at, created_at
+            FROM location_submissions
+        """)
+        if compact:
+            conn.execute("""
+                INSERT INTO location_details (location_id, address)
+                SELECT location_id, address FROM location_submissions WHERE address IS NOT NULL
+            """)
+        conn.execute("""
+            INSERT OR IGNORE INTO location_types (location_id, type_id)
+            SELECT s.location_id, t.id
+            FROM location_submissions s, json_each(s.type_ids) j
+            JOIN types t ON t.id = j.value
+        """)
+        count = conn.execute("SELECT COUNT(*) FROM location_submissions").fetchone()[0]
+        conn.commit()
+    finally:
+        conn.execute("DETACH DATABASE prev")
+    log(f"Carried forward {count:,} location submissions")
+    return count
+
+
+def parse_category_mask(value: str) -> int:
+    """Parse a category_mask string ("forager, grafter") into a bitmask over DENSITY_CATEGORIES."""
+    mask = 0
+    if value:
+        for name in value.split(","):
+            name = name.strip()
+            if name in DENSITY_CATEGORIES:
+                mask |= 1 << DENSITY_CATEGORIES.index(name)
+    return mask
+
+
+def load_location_columns(conn: sqlite3.Connection) -> dict:
+    """
+    Load visible locations into NumPy columns, sorted by id.
+
+    Streams rows in batches into preallocated arrays so the full table never
+    exists as Python objects. Also loads the location-type links as parallel
+    arrays and resolves each location's category bitmask from its types.
+    """
+    total = conn.execute("SELECT COUNT(*) FROM locations WHERE hidden = 0").fetchone()[0]
+    ids = np.empty(total, dtype=np.int64)
+    lat = np.empty(total, dtype=np.float64)
+    lng = np.empty(total, dtype=np.float64)
+    unverified = np.empty(total, dtype=np.uint8)
+
+    cursor = conn.execute(
+        "SELECT id, lat, lng, unverified FROM locations WHERE hidden = 0 ORDER BY id"
+    )
+    pos = 0
+    while True:
+        rows = cursor.fetchmany(BATCH_SIZE)
+        if not rows:
+            break
+        chunk = np.array(rows, dtype=np.float64)
+        end = pos + len(rows)
+        ids[pos:end] = chunk[:, 0]
+        lat[pos:end] = chunk[:, 1]
+        lng[pos:end] = chunk[:, 2]
+        unverified[pos:end] = chunk[:, 3]
+        pos = end
+
+    # Location-type links as (row index, type id) pairs, in location id order
+    link_rows = []
+    link_types = []
+    cursor = conn.execute(
+        "SELECT location_id, type_id FROM location_types ORDER BY location_id, type_id"
+    )
+    while True:
+        rows = cursor.fetchmany(BATCH_SIZE * 10)
+        if not rows:
+            break
+        chunk = np.array(rows, dtype=np.int64)
+        idx = np.searchsorted(ids, chunk[:, 0])
+        idx[idx >= total] = 0
+        found = ids[idx] == chunk[:, 0]
+        link_rows.append(idx[found].astype(np.int32))
+        link_types.append(chunk[found, 1].astype(np.int32))
+    type_rows = np.concatenate(link_rows) if link_rows else np.empty(0, dtype=np.int32)
+    type_ids = np.concatenate(link_types) if link_types else np.empty(0, dtype=np.int32)
+
+    # Category bitmask per location from its types
+    type_masks = conn.execute("SELECT id, category_mask FROM types").fetchall()
+    max_type_id = max([row[0] for row in type_masks] + [int(type_ids.max(initial=0))])
+    type_mask = np.zeros(max_type_id + 1, dtype=np.uint8)
+    for type_id, category_mask in type_masks:
+        type_mask[type_id] = parse_category_mask(category_mask)
+    categories = np.zeros(total, dtype=np.uint8)
+    np.bitwise_or.at(categories, type_rows, type_mask[type_ids])
+
+    return {
+        "ids": ids,
+        "lat": lat,
+        "lng": lng,
+        "unverified": unverified,
+        "categories": categories,
+        "type_rows": type_rows,
+        "type_ids": type_ids,
+    }
+
+
+def tile_coords(lat: np.ndarray, lng: np.ndarray, zoom: int) -> tuple[np.ndarray, np.ndarray]:
+    """Vectorized Web Mercator tile x/y for coordinates at a zoom level."""
+    n = 1 << zoom
+    lat_rad = np.radians(np.clip(lat, -MAX_MERCATOR_LAT, MAX_MERCATOR_LAT))
+    x = np.floor((lng + 180.0) / 360.0 * n)
+    y = np.floor((1.0 - np.log(np.tan(lat_rad) + 1.0 / np.cos(lat_rad)) / np.pi) / 2.0 * n)
+    return (
+        np.clip(x, 0, n - 1).astype(np.int64),
+        np.clip(y, 0, n - 1).astype(np.int64),
+    )
+
+
+def build_density_grids(conn: sqlite3.Connection, columns: dict) -> int:
+    """
+    Build the density_cells quadkey pyramid.
+
+    Counts are aggregated once at DENSITY_MAX_ZOOM, then each coarser zoom is
+    derived from the finer one by merging 2x2 child tiles, so the full location
+    set is only binned a single time.
+    """
+    log("Building density grids...")
+    conn.execute("DELETE FROM density_cells")
+
+    # Per-location weights: verified, unverified, then one column per category
+    unverified = columns["unverified"].astype(bool)
+    weights = [~unverified, unverified]
+    for bit in range(len(DENSITY_CATEGORIES)):
+        weights.append((columns["categories"] & (1 << bit)) != 0)
+    weights = np.stack(weights, axis=1).astype(np.int32)
+
+    x, y = tile_coords(columns["lat"], columns["lng"], DENSITY_MAX_ZOOM)
+    total = 0
+    for zoom in range(DENSITY_MAX_ZOOM, -1, -1):
+        keys = (x << zoom) | y
+        keys, inverse = np.unique(keys, return_inverse=True)
+        counts = np.stack(
+            [np.bincount(inverse, weights=w, minlength=len(keys)) for w in weights.T],
+            axis=1,
+        ).astype(np.int64)
+
+        x = keys >> zoom
+        y = keys & ((1 << zoom) - 1)
+        conn.executemany(
+            f"""
+            INSERT INTO density_cells (
+                z, x, y, verified, unverified, {", ".join(DENSITY_CATEGORIES)}
+            ) VALUES (?, ?, ?, ?, ?, {", ".join("?" * len(DENSITY_CATEGORIES))})
+            """,
+            (
+                (zoom, int(cx), int(cy), *map(int, row))
+                for cx, cy, row in zip(x, y, counts)
+            ),
+        )
+        total += len(keys)
+        log(f"  Zoom {zoom:2d}: {len(keys):,} cells")
+
+        # Parent tiles for the next (coarser) zoom
+        x >>= 1
+        y >>= 1
+        weights = counts
+
+    conn.commit()
+    log(f"  Stored {total:,} density cells")
+    return total
+
+
+def build_facet_cells(conn: sqlite3.Connection, columns: dict) -> int:
+    """
+    Build density_type_cells: per-tile location counts for every type.
+
+    Uses the same tiles as density_cells. Like the density pyramid, links are
+    binned once at DENSITY_MAX_ZOOM and coarser zooms merge child tiles; only
+    FACET_ZOOMS are stored to keep the table small.
+    """
+    log("Building type facet cells...")
+    conn.execute("DELETE FROM density_type_cells")
+
+    type_rows = columns["type_rows"]
+    type_ids = columns["type_ids"].astype(np.int64)
+    type_span = int(type_ids.max(initial=0)) + 1
+
+    x, y = tile_coords(columns["lat"][type_rows], columns["lng"][type_rows], DENSITY_MAX_ZOOM)
+    weights = np.ones(len(type_ids), dtype=np.int64)
+    total = 0
+    for zoom in range(DENSITY_MAX_ZOOM, -1, -1):
+        keys = ((x << zoom) | y) * type_span + type_ids
+        keys, inverse = np.unique(keys, return_inverse=True)
+        counts = np.bincount(inverse, weights=weights, minlength=len(keys)).astype(np.int64)
+
+        cells = keys // type_span
+        type_ids = keys % type_span
+        x = cells >> zoom
+        y = cells & ((1 << zoom) - 1)
+        if zoom in FACET_ZOOMS:
+            conn.executemany(
+                "INSERT INTO density_type_cells (z, x, y, type_id, count) VALUES (?, ?, ?, ?, ?)",
+                (
+                    (zoom, int(cx), int(cy), int(tid), int(count))
+                    for cx, cy, tid, count in zip(x, y, type_ids, counts)
+                ),
+            )
+            total += len(keys)
+            log(f"  Zoom {zoom:2d}: {len(keys):,} cell-type counts")
+
+        x >>= 1
+        y >>= 1
+        weights = counts
+
+    conn.commit()
+    log(f"  Stored {total:,} cell-type counts")
+    return total
+
+
+def build_duplicate_groups(conn: sqlite3.Connection, columns: dict) -> int:
+    """
+    Build location_groups: visible locations stacked on nearly the same spot.
+
+    Locations are taken in id order. Each one joins the nearest earlier seed
+    closer than DUPLICATE_CELL_M that shares a type, or becomes a seed
+    itself. Seeds never join other groups, so membership does not chain:
+    every member lies within DUPLICATE_CELL_M of its group's seed, which is
+    its lowest id. Candidates come from four grids of 2 * DUPLICATE_CELL_M
+    cells offset by half a cell (a pair that close shares a cell, and type,
+    in one of them); only locations sharing a cell with another are visited
+    one by one.
+    """
+    log("Finding near-duplicate locations...")
+    conn.execute("DELETE FROM location_groups")
+
+    ids = columns["ids"]
+    type_rows = columns["type_rows"].astype(np.int64)
+    type_ids = columns["type_ids"].astype(np.int64)
+    # Local meters (longitude scaled by each location's latitude)
+    y = columns["lat"] * METERS_PER_DEGREE
+    x = columns["lng"] * METERS_PER_DEGREE * np.cos(np.radians(columns["lat"]))
+    cell_m = 2 * DUPLICATE_CELL_M
+
+    # (cell, type) bucket of every location-type link in each grid, and the
+    # locations sharing a bucket with another
+    buckets = []
+    crowded = np.zeros(len(ids), dtype=bool)
+    for y_shift, x_shift in ((0.0, 0.0), (0.0, 0.5), (0.5, 0.0), (0.5, 0.5)):
+        keys = np.stack([
+            np.floor(y / cell_m + y_shift)[type_rows],
+            np.floor(x / cell_m + x_shift)[type_rows],
+            type_ids,
+        ], axis=1).astype(np.int64)
+        _, inverse, counts = np.unique(keys, axis=0, return_inverse=True, return_counts=True)
+        inverse = inverse.ravel()
+        crowded[type_rows[counts[inverse] > 1]] = True
+        buckets.append(inverse.tolist())
+
+    # Links are in row order, so each location's links are one slice
+    link_starts = np.searchsorted(type_rows, np.arange(len(ids) + 1)).tolist()
+    x_list = x.tolist()
+    y_list = y.tolist()
+    seeds: dict[tuple[int, int], list[int]] = {}
+    seed_of: dict[int, int] = {}
+    for row in np.flatnonzero(crowded).tolist():
+        links = range(link_starts[row], link_starts[row + 1])
+        best, best_distance = -1, DUPLICATE_CELL_M
+        for link in links:
+            for grid, bucket in enumerate(buckets):
+                for seed in seeds.get((grid, bucket[link]), ()):
+                    distance = math.hypot(x_list[row] - x_list[seed], y_list[row] - y_list[seed])
+                    if distance < best_distance:
+                        best, best_distance = seed, distance
+        if best >= 0:
+            seed_of[row] = best
+        else:
+            for link in links:
+                for grid, bucket in enumerate(buckets):
+                    seeds.setdefault((grid, bucket[link]), []).append(row)
+
+    grouped = sorted(set(seed_of.values()) | set(seed_of))
+    conn.executemany(
+        "INSERT INTO location_groups (location_id, group_id) VALUES (?, ?)",
+        ((int(ids[row]), int(ids[seed_of.get(row, row)])) for row in grouped),
+    )
+    conn.commit()
+
+    groups = len(set(seed_of.values()))
+    log(f"  Stored {groups:,} groups covering {len(grouped):,} locations")
+    return groups
+
+
+def morton_codes(lat: np.ndarray, lng: np.ndarray) -> np.ndarray:
+    """Interleave 16-bit quantized lat/lng into 32-bit Z-order (Morton) codes."""
+    def spread(v: np.ndarray) -> np.ndarray:
+        v = v.astype(np.uint64)
+        v = (v | (v << np.uint64(8))) & np.uint64(0x00FF00FF)
+        v = (v | (v << np.uint64(4))) & np.uint64(0x0F0F0F0F)
+        v = (v | (v << np.uint64(2))) & np.uint64(0x33333333)
+        v = (v | (v << np.uint64(1))) & np.uint64(0x55555555)
+        return v
+
+    qlat = np.clip((lat + 90.0) / 180.0 * 65535.0, 0, 65535)
+    qlng = np.clip((lng + 180.0) / 360.0 * 65535.0, 0, 65535)
+    return (spread(qlat) << np.uint64(1)) | spread(qlng)
+
+
+def write_columnar_store(columns: dict, out_dir: Path, version: int) -> int:
+    """
+    Write visible locations as memory-mappable NumPy arrays for the API's columnar engine.
+
+    Rows are sorted by Morton code so nearby points share blocks, and each
+    block of COLUMNAR_BLOCK_SIZE rows gets a lat/lng min/max entry for pruning.
+    Types are stored as CSR (type_offsets/type_ids) plus a 64-bit hashed
+    bitset per row for a fast vectorized prefilter. The store is written to a
+    temporary directory and swapped in, so running servers keep their mapped
+    files until they reload.
+    """
+    log(f"Writing columnar store to {out_dir}...")
+    ids = columns["ids"]
+    total = len(ids)
+
+    # Types per location (CSR, in location id order like `ids`)
+    type_ids = columns["type_ids"]
+    counts = np.bincount(columns["type_rows"], minlength=total).astype(np.int64)
+    type_offsets = np.zeros(total + 1, dtype=np.int64)
+    np.cumsum(counts, out=type_offsets[1:])
+
+    # Reorder everything by Morton code
+    order = np.argsort(morton_codes(columns["lat"], columns["lng"]), kind="stable")
+    starts = type_offsets[:-1][order]
+    lengths = counts[order]
+    sorted_offsets = np.zeros(total + 1, dtype=np.int64)
+    np.cumsum(lengths, out=sorted_offsets[1:])
+    gather = np.repeat(starts - sorted_offsets[:-1], lengths) + np.arange(sorted_offsets[-1])
+    sorted_type_ids = type_ids[gather]
+
+    row_of_type = np.repeat(np.arange(total), lengths)
+    type_bits = np.zeros(total, dtype=np.uint64)
+    np.bitwise_or.at(
+        type_bits, row_of_type, np.left_shift(np.uint64(1), (sorted_type_ids & 63).astype(np.uint64))
+    )
+
+    lat = columns["lat"][order]
+    lng = columns["lng"][order]
+    flags = columns["unverified"][order].astype(np.uint8)
+
+    # Block min/max index
+    block_starts = np.arange(0, total, COLUMNAR_BLOCK_SIZE)
+    arrays = {
+        "ids": ids[order],
+        "lat": lat,
+        "lng": lng,
+        "flags": flags,
+        "type_bits": type_bits,
+        "type_offsets": sorted_offsets,
+        "type_ids": sorted_type_ids,
+        "block_min_lat": np.minimum.reduceat(lat, block_starts) if total else lat,
+        "block_max_lat": np.maximum.reduceat(lat, block_starts) if total else lat,
+        "block_min_lng": np.minimum.reduceat(lng, block_starts) if total else lng,
+        "block_max_lng": np.maximum.reduceat(lng, block_starts) if total else lng,
+    }
+
+    tmp_dir = out_dir.with_name(out_dir.name + ".tmp")
+    if tmp_dir.exists():
+        shutil.rmtree(tmp_dir)
+    tmp_dir.mkdir(parents=True)
+    for name, array in arrays.items():
+        np.save(tmp_dir / f"{name}.npy", array)
+    with open(tmp_dir / "meta.json", "w") as f:
+        json.dump({
+            "format_version": COLUMNAR_FORMAT_VERSION,
+            "count": total,
+            "block_size": COLUMNAR_BLOCK_SIZE,
+            "dataset_version": version,
+        }, f)
+
+    if out_dir.exists():
+        shutil.rmtree(out_dir)
+    tmp_dir.rename(out_dir)
+
+    log(f"  Wrote {total:,} rows in {len(block_starts):,} blocks")
+    return total
+
+
+def shard_quadkey(x: int, y: int, zoom: int) -> str:
+    """Quadkey string of a tile ("" at zoom 0)."""
+    digits = []
+    for i in range(zoom, 0, -1):
+        mask = 1 << (i - 1)
+        digits.append(str((1 if x & mask else 0) + (2 if y & mask else 0)))
+    return "".join(digits)
+
+
+def shard_checksum(conn: sqlite3.Connection, compact: bool) -> str:
+    """Digest of the location rows whose ids are in temp.shard_ids, in primary key order."""
+    digest = hashlib.sha256()
+    for table in SHARD_LOCATION_TABLES:
+        if table == "location_details" and not compact:
+            continue
+        key = "id" if table == "locations" else "location_id"
+        cursor = conn.execute(
+            f"SELECT * FROM main.{table} WHERE {key} IN temp.shard_ids ORDER BY {key}"
+            + (", type_id" if table == "location_types" else "")
+        )
+        for row in cursor:
+            digest.update(repr(row).encode())
+    return digest.hexdigest()
+
+
+def load_shard_manifest(shards_dir: Path) -> Optional[dict]:
+    """The manifest of a shard directory, or None if there is none."""
+    manifest_path = shards_dir / "manifest.json"
+    if not manifest_path.exists():
+        return None
+    with open(manifest_path, "r") as f:
+        return json.load(f)
+
+
+def write_shards(
+    conn: sqlite3.Connection,
+    db_path: Path,
+    out_dir: Path,
+    previous_dir: Optional[Path],
+    zoom: int,
+    version: int,
+    compact: bool = False,
+) -> int:
+    """
+    Partition locations into one SQLite file per quadkey tile at `zoom`.
+
+    Each shard has the full schema with only its location tables filled
+    (locations, location_types, location_groups, the R-tree and
+    location_details), so the API runs the same SQL against it. The manifest
+    lists every shard with the bounds of its locations for bbox routing and
+    a checksum of its rows. A shard whose rows match the one of the same
+    tile in `previous_dir` is hard-linked from there instead of rebuilt, so
+    only changed regions get new files (which the API reopens on reload).
+    Afterwards the location rows are removed from the main database, which
+    keeps types and the derived tables. `out_dir` is swapped in by
+    swap_directory once the import is complete.
+    """
+    log(f"Writing regional shards (zoom {zoom})...")
+    rows = np.array(conn.execute("SELECT id, lat, lng FROM locations").fetchall(), dtype=np.float64)
+    if len(rows) == 0:
+        rows = np.empty((0, 3), dtype=np.float64)
+    ids = rows[:, 0].astype(np.int64)
+    x, y = tile_coords(rows[:, 1], rows[:, 2], zoom)
+    tiles = (x << zoom) | y
+
+    if out_dir.exists():
+        shutil.rmtree(out_dir)
+    out_dir.mkdir(parents=True)
+
+    # Shards of the previous import that can be reused as they are
+    previous = load_shard_manifest(previous_dir) if previous_dir is not None else None
+    reusable: dict[str, dict] = {}
+    if (
+        previous is not None
+        and previous.get("format_version") == SHARD_FORMAT_VERSION
+        and previous.get("zoom") == zoom
+        and previous.get("compact") == compact
+    ):
+        reusable = {entry["quadkey"]: entry for entry in previous["shards"] if "checksum" in entry}
+
+    conn.execute("CREATE TEMP TABLE shard_ids (id INTEGER PRIMARY KEY)")
+    shards = []
+    reused = 0
+    for tile in np.unique(tiles):
+        in_tile = tiles == tile
+        quadkey = shard_quadkey(int(tile >> zoom), int(tile & ((1 << zoom) - 1)), zoom)
+        shard_path = out_dir / f"{quadkey or 'world'}.db"
+        lat = rows[in_tile, 1]
+        lng = rows[in_tile, 2]
+        entry = {
+            "quadkey": quadkey,
+            "file": shard_path.name,
+            "bounds": [float(lat.min()), float(lng.min()), float(lat.max()), float(lng.max())],
+            "count": int(in_tile.sum()),
+        }
+        shards.append(entry)
+
+        conn.execute("DELETE FROM temp.shard_ids")
+        conn.executemany("INSERT INTO temp.shard_ids (id) VALUES (?)", ((int(i),) for i in ids[in_tile]))
+        entry["checksum"] = shard_checksum(conn, compact)
+        old = reusable.get(quadkey)
+        if old is not None and old["checksum"] == entry["checksum"] and (previous_dir / old["file"]).exists():
+            # Same inode: a server with the old file open keeps reading identical pages
+            try:
+                os.link(previous_dir / old["file"], shard_path)
+            except OSError:
+                shutil.copy2(previous_dir / old["file"], shard_path)
+            reused += 1
+            log(f"  Shard {quadkey or 'world'}: {entry['count']:,} locations (unchanged)")
+            continue
+
+        shard = create_database(shard_path, compact=compact)
+        # location_types references types, which stay in the main database
+        shard.execute("PRAGMA foreign_keys = OFF")
+        shard.execute("ATTACH DATABASE ? AS src", (str(db_path),))
+        shard.execute("CREATE TEMP TABLE shard_ids (id INTEGER PRIMARY KEY)")
+        shard.executemany("INSERT INTO shard_ids (id) VALUES (?)", ((int(i),) for i in ids[in_tile]))
+        # The R-tree is filled by the locations insert trigger
+        shard.execute("INSERT INTO main.locations SELECT * FROM src.locations WHERE id IN temp.shard_ids")
+        if compact:
+            shard.execute(
+                "INSERT INTO main.location_details SELECT * FROM src.location_details "
+                "WHERE location_id IN temp.shard_ids"
+            )
+        shard.execute(
+            "INSERT INTO main.location_types SELECT * FROM src.location_types "
+            "WHERE location_id IN temp.shard_ids"
+        )
+        shard.execute(
+            "INSERT INTO main.location_groups SELECT * FROM src.location_groups "
+            "WHERE location_id IN temp.shard_ids"
+        )
+        shard.commit()
+        shard.execute("DETACH DATABASE src")
+        create_indexes(shard)
+        shard.execute("ANALYZE")
+        shard.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        shard.close()
+        log(f"  Shard {quadkey or 'world'}: {entry['count']:,} locations")
+    conn.execute("DROP TABLE temp.shard_ids")
+
+    with open(out_dir / "manifest.json", "w") as f:
+        json.dump({
+            "format_version": SHARD_FORMAT_VERSION,
+            "zoom": zoom,
+            "compact": compact,
+            "dataset_version": version,
+            "shards": shards,
+        }, f, indent=2)
+
+    # The main database keeps types and the derived tables only
+    triggers = conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'locations'"
+    ).fetchall()
+    for (name,) in triggers:
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+    conn.execute("DELETE FROM locations_rtree")
+    for table in reversed(SHARD_LOCATION_TABLES):
+        if table != "location_details" or compact:
+            conn.execute(f"DELETE FROM {table}")
+    conn.commit()
+    conn.execute("VACUUM")
+
+    log(f"  Wrote {len(shards) - reused} shards to {out_dir}, reused {reused} unchanged")
+    return len(shards)
+
+
+def swap_directory(new_dir: Path, target: Path) -> None:
+    """
+    Replace `target` with `new_dir`. The old directory is renamed aside
+    first, so `target` is either the old or the new one except for the
+    instant between two renames, and is never half-deleted.
+    """
+    old_dir = target.with_name(target.name + ".old")
+    if old_dir.exists():
+        shutil.rmtree(old_dir)
+    if target.exists():
+        target.rename(old_dir)
+    new_dir.rename(target)
+    if old_dir.exists():
+        shutil.rmtree(old_dir)
+
+
+def merge_shards(conn: sqlite3.Connection, shards_dir: Path) -> None:
+    """Copy the location rows of every shard in a manifest back into `conn`."""
+    with open(shards_dir / "manifest.json", "r") as f:
+        manifest = json.load(f)
+    tables = {
+        row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+    }
+    for shard in manifest["shards"]:
+        conn.execute("ATTACH DATABASE ? AS shard", (str(shards_dir / shard["file"]),))
+        for table in SHARD_LOCATION_TABLES:
+            if table in tables:
+                conn.execute(f"INSERT OR IGNORE INTO main.{table} SELECT * FROM shard.{table}")
+        conn.commit()
+        conn.execute("DETACH DATABASE shard")
+
+
+def record_dataset_version(
+    conn: sqlite3.Connection,
+    previous_path: Optional[Path],
+    locations_count: int,
+) -> int:
+    """
+    Assign this import a dataset version and log what changed since the previous one.
+
+    Diffs the new locations against the stashed previous database (attached
+    as `prev`) and writes inserted/updated/hidden/deleted ids with their tile
+    cell to location_changes, plus the cell they were in before (for moved
+    locations). The previous database's version history is carried forward
+    for the last CHANGE_RETENTION_VERSIONS versions.
+    """
+    log("Recording dataset version...")
+    version = 1
+    # (id, change, lat, lng, previous lat, previous lng)
+    changes: list[tuple[int, str, float, float, float, float]] = []
+    
+    if previous_path is not None:
+        conn.execute("ATTACH DATABASE ? AS prev", (str(previous_path),))
+        has_history = conn.execute(
+            "SELECT 1 FROM prev.sqlite_master WHERE type = 'table' AND name = 'dataset_versions'"
+        ).fetchone() is not None
+        
+        if has_history:
+            previous_version = conn.execute(
+                "SELECT MAX(version) FROM prev.dataset_versions"
+            ).fetchone()[0] or 0
+            version = previous_version + 1
+            oldest = version - CHANGE_RETENTION_VERSIONS
+            conn.execute(
+                "INSERT INTO dataset_versions SELECT * FROM prev.dataset_versions WHERE version > ?",
+                (oldest,)
+            )
+            # Logs written before old cells were recorded: the old cell is the cell
+            prev_change_columns = {
+                row[1] for row in conn.execute("PRAGMA prev.table_info(location_changes)")
+            }
+            old_cells = "old_cell_x, old_cell_y" if "old_cell_x" in prev_change_columns else "cell_x, cell_y"
+            conn.execute(
+                f"""
+                INSERT INTO location_changes
+                SELECT version, location_id, change, cell_x, cell_y, {old_cells}
+                FROM prev.location_changes WHERE version > ?
+                """,
+                (oldest,)
+            )
+        else:
+            # Previous database predates versioning; treat it as version 1
+            version = 2
+        
+        # Shown to clients before, and now either new or visible again
+        for row in conn.execute("""
+            SELECT n.id, n.lat, n.lng FROM main.locations n
+            LEFT JOIN prev.locations o ON o.id = n.id
+            WHERE n.hidden = 0 AND (o.id IS NULL OR o.hidden != 0)
+        """):
+            changes.append((row[0], "inserted", row[1], row[2], row[1], row[2]))
+        
+        for row in conn.execute("""
+            SELECT o.id, o.lat, o.lng FROM prev.locations o
+            LEFT JOIN main.locations n ON n.id = o.id
+            WHERE o.hidden = 0 AND n.id IS NULL
+        """):
+            changes.append((row[0], "deleted", row[1], row[2], row[1], row[2]))
+        
+        for row in conn.execute("""
+            SELECT n.id, o.lat, o.lng FROM main.locations n
+            JOIN prev.locations o ON o.id = n.id
+            WHERE n.hidden != 0 AND o.hidden = 0
+        """):
+            changes.append((row[0], "hidden", row[1], row[2], row[1], row[2]))
+        
+        # Compact databases keep some columns in location_details; compare the shared ones
+        main_columns = {row[1] for row in conn.execute("PRAGMA main.table_info(locations)")}
+        prev_columns = {row[1] for row in conn.execute("PRAGMA prev.table_info(locations)")}
+        differs = " OR ".join(
+            f"n.{col} IS NOT o.{col}"
+            for col in LOCATION_COMPARE_COLUMNS
+            if col in main_columns and col in prev_columns
+        )
+        for row in conn.execute(f"""
+            SELECT n.id, n.lat, n.lng, o.lat, o.lng FROM main.locations n
+            JOIN prev.locations o ON o.id = n.id
+            WHERE n.hidden = 0 AND o.hidden = 0
+              AND (({differs}) OR n.id IN (
+                  SELECT location_id FROM (
+                      SELECT location_id, type_id FROM main.location_types
+                      EXCEPT SELECT location_id, type_id FROM prev.location_types
+                  )
+                  UNION
+                  SELECT location_id FROM (
+                      SELECT location_id, type_id FROM prev.location_types
+                      EXCEPT SELECT location_id, type_id FROM main.location_types
+                  )
+              ))
+        """):
+            changes.append((row[0], "updated", row[1], row[2], row[3], row[4]))
+        
+        conn.commit()
+        conn.execute("DETACH DATABASE prev")
+    
+    if changes:
+        lat = np.array([change[2] for change in changes], dtype=np.float64)
+        lng = np.array([change[3] for change in changes], dtype=np.float64)
+        old_lat = np.array([change[4] for change in changes], dtype=np.float64)
+        old_lng = np.array([change[5] for change in changes], dtype=np.float64)
+        x, y = tile_coords(lat, lng, CHANGE_CELL_ZOOM)
+        old_x, old_y = tile_coords(old_lat, old_lng, CHANGE_CELL_ZOOM)
+        conn.executemany(
+            """
+            INSERT INTO location_changes (
+                version, location_id, change, cell_x, cell_y, old_cell_x, old_cell_y
+            ) VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            (
+                (version, change[0], change[1], int(cx), int(cy), int(ox), int(oy))
+                for change, cx, cy, ox, oy in zip(changes, x, y, old_x, old_y)
+            ),
+        )
+    
+    conn.execute(
+        "INSERT INTO dataset_versions (version, imported_at, locations_count, changes_recorded) VALUES (?, ?, ?, ?)",
+        (
+            version,
+            datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S UTC"),
+            locations_count,
+            1 if previous_path is not None else 0,
+        ),
+    )
+    conn.commit()
+    
+    log(f"  Dataset version {version}: {len(changes):,} changed locations")
+    return version
+
+
+def report_storage(conn: sqlite3.Connection, db_path: Path, columns: dict) -> None:
+    """
+    Log database size, per-table pages and the locations pages a dense bbox query touches.
+
+    Page counts come from the dbstat virtual table. Pages per query is
+    estimated for the densest zoom 12 density tile: locations rows are stored
+    in id order, so the distinct leaf pages are the distinct
+    (id rank // rows per page) among the locations in that tile.
+    """
+    log("Storage report:")
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    log(f"  Database size: {db_path.stat().st_size / (1024*1024):.1f} MB ({page_size} byte pages)")
+    
+    try:
+        tables = conn.execute("""
+            SELECT name, COUNT(*), SUM(pagetype = 'leaf') FROM dbstat
+            WHERE name IN ('locations', 'location_details', 'location_types', 'locations_rtree_node')
+            GROUP BY name ORDER BY name
+        """).fetchall()
+    except sqlite3.OperationalError:
+        log("  dbstat not available, skipping page statistics")
+        return
+    
+    leaf_pages = {}
+    for name, pages, leaves in tables:
+        leaf_pages[name] = leaves
+        log(f"  {name}: {pages:,} pages ({pages * page_size / (1024*1024):.1f} MB)")
+    
+    total_rows = conn.execute("SELECT COUNT(*) FROM locations").fetchone()[0]
+    if not total_rows or not len(columns["ids"]) or not leaf_pages.get("locations"):
+        return
+    rows_per_page = total_rows / leaf_pages["locations"]
+    
+    x, y = tile_coords(columns["lat"], columns["lng"], DENSITY_MAX_ZOOM)
+    keys, counts = np.unique((x << DENSITY_MAX_ZOOM) | y, return_counts=True)
+    densest = (x << DENSITY_MAX_ZOOM | y) == keys[np.argmax(counts)]
+    # columns["ids"] are the visible ids in id order, so their index approximates rank
+    pages = np.unique((np.flatnonzero(densest) / rows_per_page).astype(np.int64))
+    log(f"  Rows per locations page: {rows_per_page:.1f}")
+    log(f"  Pages per query (densest z{DENSITY_MAX_ZOOM} tile, {int(densest.sum()):,} rows): "
+        f"~{len(pages):,} locations pages")
+
+
 def optimize_database(conn: sqlite3.Connection) -> None:
     """Run optimization after import."""
     log("Optimizing database...")
     conn.execute("ANALYZE")
     log("  Analysis complete")
+    # Fold the WAL into the main file so the API can open it as an immutable URI
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
     # Skip VACUUM on low-memory systems - it requires significant temp space
     # conn.execute("VACUUM")
     conn.commit()
@@ -328,36 +1247,111 @@ def main():
         default=DEFAULT_DB_PATH,
         help=f"Output database path (default: {DEFAULT_DB_PATH})"
     )
+    parser.add_argument(
+        "--columnar",
+        action="store_true",
+        help="Also write the memory-mapped columnar store used by the API (COLUMNAR_DIR)"
+    )
+    parser.add_argument(
+        "--columnar-dir",
+        type=Path,
+        default=None,
+        help="Columnar store directory (default: <db-path>.columns)"
+    )
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="Compact storage: integer R-tree on fixed-point coordinates, cold columns in a side table"
+    )
+    parser.add_argument(
+        "--shard-zoom",
+        type=int,
+        default=None,
+        help="Partition locations into regional shard files, one per tile at this zoom (e.g. 2 = up to 16)"
+    )
+    parser.add_argument(
+        "--shards-dir",
+        type=Path,
+        default=None,
+        help="Shard directory (default: <db-path>.shards)"
+    )
     args = parser.parse_args()
+    shards_dir = args.shards_dir or args.db_path.with_name(args.db_path.name + ".shards")
     
     log("=" * 50)
     log("Falling Fruit Data Import (Memory-Optimized)")
     log("=" * 50)
     
-    # Create database
-    conn = create_database(args.db_path)
+    # Pause the API's submission writer until the new database is complete
+    import_lock = lock_database(args.db_path)
+    
+    # Create database, keeping the previous one for change detection
+    previous_path = stash_previous_database(args.db_path, shards_dir)
+    conn = create_database(args.db_path, compact=args.compact)
     
     try:
         # Import types first (for foreign key references)
         types_count = import_types(conn, args.data_dir)
         
         # Import locations
-        locations_count = import_locations(conn, args.data_dir)
+        locations_count = import_locations(conn, args.data_dir, compact=args.compact)
+        locations_count += carry_forward_submissions(conn, previous_path, compact=args.compact)
+        create_indexes(conn)
+        
+        # Version this import and log changes since the previous one
+        version = record_dataset_version(conn, previous_path, locations_count)
+        
+        # Precompute derived tables
+        columns = load_location_columns(conn)
+        build_density_grids(conn, columns)
+        build_facet_cells(conn, columns)
+        build_duplicate_groups(conn, columns)
+        # Write the columnar store, or drop one left by a previous import
+        columnar_dir = args.columnar_dir or args.db_path.with_name(args.db_path.name + ".columns")
+        if args.columnar:
+            write_columnar_store(columns, columnar_dir, version)
+        elif columnar_dir.exists():
+            shutil.rmtree(columnar_dir)
+        
+        # Move locations into regional shards, staged until the import is complete
+        shards_count = 0
+        staged_shards_dir = shards_dir.with_name(shards_dir.name + ".tmp")
+        if args.shard_zoom is not None:
+            shards_count = write_shards(
+                conn, args.db_path, staged_shards_dir, shards_dir, args.shard_zoom, version,
+                compact=args.compact,
+            )
         
         # Optimize
         optimize_database(conn)
+        report_storage(conn, args.db_path, columns)
+        del columns
+        
+        # Publish the new shards last: a new manifest tells the API to reload
+        if args.shard_zoom is not None:
+            swap_directory(staged_shards_dir, shards_dir)
+        elif shards_dir.exists():
+            shutil.rmtree(shards_dir)
         
         # Summary
         log("=" * 50)
         log("Import Summary:")
         log(f"  Types:     {types_count:,}")
         log(f"  Locations: {locations_count:,}")
+        log(f"  Version:   {version}")
+        if shards_count:
+            log(f"  Shards:    {shards_count} in {shards_dir}")
         log(f"  Database:  {args.db_path}")
         log(f"  Size:      {args.db_path.stat().st_size / (1024*1024):.1f} MB")
         log("=" * 50)
         
+        # Only drop the previous database once the new one is complete
+        if previous_path is not None:
+            previous_path.unlink()
+        
     finally:
         conn.close()
+        import_lock.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,38 @@
+-- Rising Fruit Secondary Indexes
+-- Applied by import.py after the bulk load (building an index once over
+-- sorted data is much cheaper than maintaining it row by row), and to each
+-- regional shard. Idempotent, so it can also be run against an older
+-- database to bring its indexes up to date.
+--
+-- Bbox queries are driven by the R-tree and join locations by primary key
+-- and location_types by its (location_id, type_id) primary key, so they
+-- need no secondary index. These cover the remaining query shapes in
+-- backend/src/database.py; backend/tests/test_query_plans.py pins the plans.
+
+-- Replaced by the indexes below: single-column flags are too unselective to
+-- be used, and location_types' primary key already leads with location_id
+DROP INDEX IF EXISTS idx_locations_hidden;
+DROP INDEX IF EXISTS idx_locations_unverified;
+DROP INDEX IF EXISTS idx_location_types_location_id;
+DROP INDEX IF EXISTS idx_location_types_type_id;
+
+-- ============================================
+-- Locations
+-- ============================================
+
+-- Visible locations only (hidden is kept as a column so the index covers
+-- `hidden = 0` itself). Serves the visible / verified counts without
+-- touching the table, and the per-row check of verified-only bbox counts.
+CREATE INDEX IF NOT EXISTS idx_locations_visible
+    ON locations(hidden, unverified) WHERE hidden = 0;
+
+CREATE INDEX IF NOT EXISTS idx_locations_author ON locations(author);
+
+-- ============================================
+-- Location-Types
+-- ============================================
+
+-- Covering index for type filters: per-type counts and type -> locations
+-- without a lookup into the table
+CREATE INDEX IF NOT EXISTS idx_location_types_type_location
+    ON location_types(type_id, location_id);
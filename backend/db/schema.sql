@@ -49,10 +49,7 @@ CREATE TABLE IF NOT EXISTS locations (
     updated_at TEXT
 );
 
--- Indexes for locations
-CREATE INDEX IF NOT EXISTS idx_locations_hidden ON locations(hidden);
-CREATE INDEX IF NOT EXISTS idx_locations_unverified ON locations(unverified);
-CREATE INDEX IF NOT EXISTS idx_locations_author ON locations(author);
+-- Secondary indexes are in indexes.sql, built after the bulk load
 
 -- ============================================
 -- Location-Types junction table (many-to-many)
@@ -63,9 +60,38 @@ CREATE TABLE IF NOT EXISTS location_types (
     PRIMARY KEY (location_id, type_id)
 );
 
--- Indexes for faster lookups
-CREATE INDEX IF NOT EXISTS idx_location_types_type_id ON location_types(type_id);
-CREATE INDEX IF NOT EXISTS idx_location_types_location_id ON location_types(location_id);
+-- ============================================
+-- Location submissions (POST /api/locations)
+-- ============================================
+-- Locations submitted to this server, kept apart from the Falling Fruit
+-- export so every import carries them forward (they are also in locations).
+-- Ids are above 1,000,000,000, a range export ids never reach.
+CREATE TABLE IF NOT EXISTS location_submissions (
+    location_id INTEGER PRIMARY KEY,
+    lat REAL NOT NULL,
+    lng REAL NOT NULL,
+    unverified INTEGER DEFAULT 0,
+    description TEXT,
+    season_start TEXT,
+    season_stop TEXT,
+    no_season INTEGER DEFAULT 0,
+    author TEXT,
+    address TEXT,
+    access TEXT,
+    type_ids TEXT NOT NULL,  -- JSON array
+    created_at TEXT
+);
+
+-- ============================================
+-- Near-duplicate location groups (precomputed at import time)
+-- ============================================
+-- Visible locations stacked within a few meters of each other that share a
+-- type. Only members of groups of two or more have a row; group_id is the
+-- lowest location id in the group, which is its representative.
+CREATE TABLE IF NOT EXISTS location_groups (
+    location_id INTEGER PRIMARY KEY,
+    group_id INTEGER NOT NULL
+) WITHOUT ROWID;
 
 -- ============================================
 -- R-tree spatial index for fast bounding box queries
@@ -76,6 +102,63 @@ CREATE VIRTUAL TABLE IF NOT EXISTS locations_rtree USING rtree(
     min_lng, max_lng  -- Longitude bounds (for point: min=max)
 );
 
+-- ============================================
+-- Density grid pyramid (precomputed at import time)
+-- ============================================
+-- One row per non-empty Web Mercator tile (z/x/y) for zooms 0..12,
+-- counting visible locations by verification status and category.
+CREATE TABLE IF NOT EXISTS density_cells (
+    z INTEGER NOT NULL,
+    x INTEGER NOT NULL,
+    y INTEGER NOT NULL,
+    verified INTEGER NOT NULL DEFAULT 0,
+    unverified INTEGER NOT NULL DEFAULT 0,
+    forager INTEGER NOT NULL DEFAULT 0,
+    honeybee INTEGER NOT NULL DEFAULT 0,
+    grafter INTEGER NOT NULL DEFAULT 0,
+    freegan INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (z, x, y)
+) WITHOUT ROWID;
+
+-- Per-type counts for the same tiles, stored for a subset of zooms
+-- (0, 2, 4, ... 12) and used for viewport type facets.
+CREATE TABLE IF NOT EXISTS density_type_cells (
+    z INTEGER NOT NULL,
+    x INTEGER NOT NULL,
+    y INTEGER NOT NULL,
+    type_id INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (z, x, y, type_id)
+) WITHOUT ROWID;
+
+-- ============================================
+-- Dataset versions and change log (for incremental client updates)
+-- ============================================
+-- One row per import. changes_recorded = 0 means the import had no previous
+-- database to diff against, so clients older than it must reload.
+CREATE TABLE IF NOT EXISTS dataset_versions (
+    version INTEGER PRIMARY KEY,
+    imported_at TEXT NOT NULL,
+    locations_count INTEGER NOT NULL DEFAULT 0,
+    changes_recorded INTEGER NOT NULL DEFAULT 0
+);
+
+-- Locations that changed between version - 1 and version, with the
+-- zoom 12 tile they are in (their last visible position for deletions).
+-- old_cell_x/old_cell_y is the tile before the change; it differs only for
+-- updated locations that moved, so clients watching either tile hear of it.
+-- change: 'inserted', 'updated', 'hidden' or 'deleted'
+CREATE TABLE IF NOT EXISTS location_changes (
+    version INTEGER NOT NULL,
+    location_id INTEGER NOT NULL,
+    change TEXT NOT NULL,
+    cell_x INTEGER NOT NULL,
+    cell_y INTEGER NOT NULL,
+    old_cell_x INTEGER NOT NULL,
+    old_cell_y INTEGER NOT NULL,
+    PRIMARY KEY (version, location_id)
+) WITHOUT ROWID;
+
 -- ============================================
 -- Views for common queries
 -- ============================================
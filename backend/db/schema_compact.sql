@@ -0,0 +1,87 @@
+-- Rising Fruit Compact Storage Overrides
+-- Applied after schema.sql by `import.py --compact`.
+--
+-- Keeps the rows that bbox queries scan small:
+--   * locations drops the rarely read address/import_link/original_ids
+--     columns, which move to location_details (only rows that have them)
+--   * locations_rtree is an rtree_i32 over fixed-point coordinates
+--     (degrees x 10,000,000), so bounds are exact integers
+-- The API detects this layout by the presence of location_details.
+
+DROP TRIGGER IF EXISTS tr_locations_insert;
+DROP TRIGGER IF EXISTS tr_locations_update;
+DROP TRIGGER IF EXISTS tr_locations_delete;
+DROP TABLE IF EXISTS locations_rtree;
+DROP TABLE IF EXISTS locations;
+
+-- ============================================
+-- Locations table - hot columns only
+-- ============================================
+CREATE TABLE locations (
+    id INTEGER PRIMARY KEY,
+    lat REAL NOT NULL,
+    lng REAL NOT NULL,
+    unverified INTEGER DEFAULT 0,
+    description TEXT,
+    season_start TEXT,
+    season_stop TEXT,
+    no_season INTEGER DEFAULT 0,
+    author TEXT,
+    access TEXT,
+    hidden INTEGER DEFAULT 0,
+    created_at TEXT,
+    updated_at TEXT
+);
+
+-- Secondary indexes are in indexes.sql, built after the bulk load
+
+-- ============================================
+-- Location details - cold columns, read only for single-location lookups
+-- ============================================
+CREATE TABLE location_details (
+    location_id INTEGER PRIMARY KEY REFERENCES locations(id) ON DELETE CASCADE,
+    address TEXT,
+    import_link TEXT,
+    original_ids TEXT
+);
+
+-- ============================================
+-- Integer R-tree on fixed-point coordinates
+-- ============================================
+CREATE VIRTUAL TABLE locations_rtree USING rtree_i32(
+    id,
+    min_lat, max_lat, -- Latitude x 10^7
+    min_lng, max_lng  -- Longitude x 10^7
+);
+
+-- ============================================
+-- Triggers to keep R-tree in sync
+-- ============================================
+
+CREATE TRIGGER tr_locations_insert
+AFTER INSERT ON locations
+BEGIN
+    INSERT INTO locations_rtree (id, min_lat, max_lat, min_lng, max_lng)
+    VALUES (
+        NEW.id,
+        CAST(round(NEW.lat * 10000000) AS INTEGER), CAST(round(NEW.lat * 10000000) AS INTEGER),
+        CAST(round(NEW.lng * 10000000) AS INTEGER), CAST(round(NEW.lng * 10000000) AS INTEGER)
+    );
+END;
+
+CREATE TRIGGER tr_locations_update
+AFTER UPDATE OF lat, lng ON locations
+BEGIN
+    UPDATE locations_rtree
+    SET min_lat = CAST(round(NEW.lat * 10000000) AS INTEGER),
+        max_lat = CAST(round(NEW.lat * 10000000) AS INTEGER),
+        min_lng = CAST(round(NEW.lng * 10000000) AS INTEGER),
+        max_lng = CAST(round(NEW.lng * 10000000) AS INTEGER)
+    WHERE id = NEW.id;
+END;
+
+CREATE TRIGGER tr_locations_delete
+AFTER DELETE ON locations
+BEGIN
+    DELETE FROM locations_rtree WHERE id = OLD.id;
+END;
@@ -0,0 +1,23 @@
+#!/usr/bin/env python3
+"""
+Write brotli/gzip variants next to the built frontend's text assets.
+
+Run once when the image is built, so API workers serve the prebuilt files
+instead of compressing at startup.
+
+Usage: python scripts/precompress_assets.py [dist-dir]   (default: frontend/dist)
+"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.static import precompress  # noqa: E402
+
+if __name__ == "__main__":
+    root = Path(sys.argv[1]) if len(sys.argv) > 1 else Path(__file__).resolve().parent.parent / "frontend" / "dist"
+    if not root.is_dir():
+        print(f"No built frontend at {root}, nothing to compress")
+        sys.exit(0)
+    print(f"Wrote {precompress(root)} compressed variants under {root}")
@@ -0,0 +1,155 @@
+"""
+Admission control for API requests.
+
+A pure ASGI middleware that bounds how many API requests run at once and how
+many may wait for a slot. Excess requests are shed immediately with 429, and
+requests that cannot start before their deadline get 503, so latency stays
+bounded under load instead of growing with the queue. Every admitted request
+carries a deadline (see database.query_deadline) that SQLite enforces through
+its progress handler, and is cancelled as soon as the client disconnects, so
+abandoned viewport queries stop holding the shared connection.
+"""
+
+import asyncio
+import json
+import os
+import time
+from typing import Any, Awaitable, Callable
+
+from .database import query_deadline
+
+Scope = dict[str, Any]
+Message = dict[str, Any]
+Receive = Callable[[], Awaitable[Message]]
+Send = Callable[[Message], Awaitable[None]]
+ASGIApp = Callable[[Scope, Receive, Send], Awaitable[None]]
+
+# Requests running at once, requests allowed to wait, and each request's time budget
+API_MAX_CONCURRENCY = int(os.getenv("API_MAX_CONCURRENCY", "16"))
+API_MAX_QUEUE = int(os.getenv("API_MAX_QUEUE", "64"))
+API_REQUEST_TIMEOUT = float(os.getenv("API_REQUEST_TIMEOUT_MS", "5000")) / 1000
+
+# Never shed these: health checks must answer under load, and submissions
+# already have their own bounded queue in the writer
+EXEMPT_ROUTES = {("GET", "/api/health"), ("POST", "/api/locations")}
+
+
+class AdmissionControl:
+    """Shared admission state: concurrency slots, queue bound, deadline and counters."""
+
+    def __init__(
+        self,
+        max_concurrency: int = API_MAX_CONCURRENCY,
+        max_queue: int = API_MAX_QUEUE,
+        timeout: float = API_REQUEST_TIMEOUT,
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.slots = asyncio.Semaphore(max_concurrency)
+        self.waiting = 0
+        self.active = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.disconnected = 0
+
+    @property
+    def stats(self) -> dict:
+        """Admission counters."""
+        return {
+            "active": self.active,
+            "waiting": self.waiting,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "disconnected": self.disconnected,
+        }
+
+
+class AdmissionMiddleware:
+    """Bounded admission queue, per-request deadlines and cancellation on disconnect."""
+
+    def __init__(self, app: ASGIApp, control: AdmissionControl):
+        self.app = app
+        self.control = control
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        path = scope.get("path", "")
+        if (
+            scope["type"] != "http"
+            or not path.startswith("/api/")
+            or (scope.get("method"), path) in EXEMPT_ROUTES
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        control = self.control
+        deadline = time.monotonic() + control.timeout
+        if control.active + control.waiting >= control.max_concurrency + control.max_queue:
+            control.rejected += 1
+            await _send_error(send, 429, "Server busy, try again shortly", retry_after=1)
+            return
+
+        control.waiting += 1
+        try:
+            await asyncio.wait_for(control.slots.acquire(), control.timeout)
+        except asyncio.TimeoutError:
+            control.timed_out += 1
+            await _send_error(send, 503, "Server busy, request timed out waiting", retry_after=1)
+            return
+        finally:
+            control.waiting -= 1
+
+        control.active += 1
+        try:
+            await self._run(scope, receive, send, deadline)
+        finally:
+            control.active -= 1
+            control.slots.release()
+
+    async def _run(self, scope: Scope, receive: Receive, send: Send, deadline: float) -> None:
+        """Run the app with a deadline, cancelling it if the client disconnects first."""
+        messages: asyncio.Queue = asyncio.Queue()
+        disconnected = False
+
+        token = query_deadline.set(deadline)
+        try:
+            app_task = asyncio.ensure_future(self.app(scope, messages.get, send))
+        finally:
+            query_deadline.reset(token)
+
+        async def listen() -> None:
+            nonlocal disconnected
+            while True:
+                message = await receive()
+                await messages.put(message)
+                if message["type"] == "http.disconnect":
+                    if not app_task.done():
+                        disconnected = True
+                        app_task.cancel()
+                    return
+
+        listener = asyncio.ensure_future(listen())
+        try:
+            await app_task
+        except asyncio.CancelledError:
+            if not disconnected:
+                raise
+            # Client is gone: nothing to respond to
+            self.control.disconnected += 1
+        finally:
+            listener.cancel()
+
+
+async def _send_error(send: Send, status: int, detail: str, retry_after: int) -> None:
+    """Send a small JSON error response without entering the app."""
+    body = json.dumps({"detail": detail}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(retry_after).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,229 @@
+"""
+Memory-mapped columnar spatial engine for Rising Fruit.
+
+Answers bbox + type lookups from NumPy arrays written by `db/import.py --columnar`
+instead of going through aiosqlite, the R-tree and per-row dicts. Arrays are
+opened with mmap, so every uvicorn worker shares the same pages through the OS
+page cache. SQLite remains the source for location details.
+"""
+
+import json
+import math
+from pathlib import Path
+from typing import Callable, Optional
+
+import numpy as np
+
+COLUMNAR_FORMAT_VERSION = 1
+
+# Flag bits in flags.npy
+FLAG_UNVERIFIED = 1
+
+# Multiplicative hash giving every location a stable 32-bit sampling rank
+SAMPLE_RANK_MULTIPLIER = 2654435761
+
+# Blocks scanned between calls to a lookup's `check` (its deadline check)
+CHECK_BLOCKS = 256
+
+ARRAY_NAMES = [
+    "ids", "lat", "lng", "flags", "type_bits", "type_offsets", "type_ids",
+    "block_min_lat", "block_max_lat", "block_min_lng", "block_max_lng",
+]
+
+
+def sample_cells(
+    lat: np.ndarray,
+    lng: np.ndarray,
+    grid: int,
+    sw_lat: float,
+    sw_lng: float,
+    ne_lat: float,
+    ne_lng: float,
+) -> np.ndarray:
+    """Cell (x + grid * y) of each point in a square sampling grid laid over the bbox."""
+    lat_scale = grid / max(ne_lat - sw_lat, 1e-9)
+    lng_scale = grid / max(ne_lng - sw_lng, 1e-9)
+    cx = np.clip(((lng - sw_lng) * lng_scale).astype(np.int64), 0, grid - 1)
+    cy = np.clip(((lat - sw_lat) * lat_scale).astype(np.int64), 0, grid - 1)
+    return cx + grid * cy
+
+
+class ColumnarIndex:
+    """Read-only columnar location store, sorted by Morton code with a block min/max index."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        with open(path / "meta.json", "r") as f:
+            meta = json.load(f)
+        if meta.get("format_version") != COLUMNAR_FORMAT_VERSION:
+            raise ValueError(f"Unsupported columnar store version in {path}")
+        self.count = meta["count"]
+        self.block_size = meta["block_size"]
+        # Import the arrays were written by (None for stores predating the field)
+        self.dataset_version = meta.get("dataset_version")
+        for name in ARRAY_NAMES:
+            setattr(self, name, np.load(path / f"{name}.npy", mmap_mode="r"))
+
+    @classmethod
+    def open(cls, path: Optional[Path]) -> Optional["ColumnarIndex"]:
+        """Open the store if it exists, otherwise return None."""
+        if path is None or not (path / "meta.json").exists():
+            return None
+        return cls(path)
+
+    def warmup(self) -> None:
+        """Read every array once so its pages are resident in the page cache."""
+        for name in ARRAY_NAMES:
+            np.asarray(getattr(self, name)).sum()
+
+    def _candidate_blocks(
+        self,
+        sw_lat: float,
+        sw_lng: float,
+        ne_lat: float,
+        ne_lng: float,
+    ) -> np.ndarray:
+        """Every block whose min/max box intersects the bbox."""
+        return np.flatnonzero(
+            (self.block_min_lat <= ne_lat) & (self.block_max_lat >= sw_lat)
+            & (self.block_min_lng <= ne_lng) & (self.block_max_lng >= sw_lng)
+        )
+
+    def _block_rows(self, blocks: np.ndarray) -> np.ndarray:
+        """Row indices of the given blocks."""
+        rows = (blocks[:, None] * self.block_size + np.arange(self.block_size)).ravel()
+        return rows[rows < self.count]
+
+    def _has_any_type(self, rows: np.ndarray, type_ids: list[int]) -> np.ndarray:
+        """Mask of rows that carry at least one of the given types."""
+        wanted = np.array(type_ids, dtype=np.int64)
+        bits = np.bitwise_or.reduce(
+            np.left_shift(np.uint64(1), (wanted & 63).astype(np.uint64))
+        )
+        # Hashed bitset prefilter, then exact check against the CSR type lists
+        mask = (self.type_bits[rows] & bits) != 0
+        candidates = rows[mask]
+        if len(candidates) == 0:
+            return mask
+
+        starts = self.type_offsets[candidates]
+        lengths = self.type_offsets[candidates + 1] - starts
+        local = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        flat = np.repeat(starts - local, lengths) + np.arange(lengths.sum())
+        hits = np.isin(self.type_ids[flat], wanted)
+        mask[mask] = np.add.reduceat(hits, local) > 0
+        return mask
+
+    def rows_in_bounds(
+        self,
+        sw_lat: float,
+        sw_lng: float,
+        ne_lat: float,
+        ne_lng: float,
+        type_ids: Optional[list[int]] = None,
+        include_unverified: bool = True,
+        check: Optional[Callable[[], None]] = None,
+    ) -> np.ndarray:
+        """
+        Row indices of locations matching the bbox and filters, in row order.
+
+        Candidate blocks are filtered CHECK_BLOCKS at a time, calling `check`
+        before each run; it may raise to stop a lookup past its deadline.
+        """
+        blocks = self._candidate_blocks(sw_lat, sw_lng, ne_lat, ne_lng)
+        matched = [np.empty(0, dtype=np.int64)]
+        for start in range(0, len(blocks), CHECK_BLOCKS):
+            if check is not None:
+                check()
+            rows = self._block_rows(blocks[start:start + CHECK_BLOCKS])
+            lat = self.lat[rows]
+            lng = self.lng[rows]
+            mask = (lat <= ne_lat) & (lat >= sw_lat) & (lng <= ne_lng) & (lng >= sw_lng)
+            if not include_unverified:
+                mask &= (self.flags[rows] & FLAG_UNVERIFIED) == 0
+            rows = rows[mask]
+            if type_ids and len(rows):
+                rows = rows[self._has_any_type(rows, type_ids)]
+            matched.append(rows)
+        return np.concatenate(matched)
+
+    def count_in_bounds(self, *args, **kwargs) -> int:
+        """Count locations matching the bbox and filters."""
+        return int(len(self.rows_in_bounds(*args, **kwargs)))
+
+    def ids_in_bounds(
+        self,
+        sw_lat: float,
+        sw_lng: float,
+        ne_lat: float,
+        ne_lng: float,
+        type_ids: Optional[list[int]] = None,
+        limit: int = 1000,
+        offset: int = 0,
+        include_unverified: bool = True,
+        center_lat: Optional[float] = None,
+        center_lng: Optional[float] = None,
+        check: Optional[Callable[[], None]] = None,
+    ) -> list[int]:
+        """
+        One page of matching location ids, ordered like get_locations_in_bounds.
+
+        Uses a partial selection for the first offset+limit rows, so only the
+        returned page is fully sorted.
+        """
+        rows = self.rows_in_bounds(sw_lat, sw_lng, ne_lat, ne_lng, type_ids, include_unverified, check)
+        ids = self.ids[rows]
+        if center_lat is not None and center_lng is not None:
+            keys = (self.lat[rows] - center_lat) ** 2 + (self.lng[rows] - center_lng) ** 2
+        else:
+            keys = ids
+
+        end = offset + limit
+        if end < len(keys):
+            top = np.argpartition(keys, end - 1)[:end]
+        else:
+            top = np.arange(len(keys))
+        top = top[np.lexsort((ids[top], keys[top]))]
+        return ids[top[offset:end]].tolist()
+
+    def sample_ids_in_bounds(
+        self,
+        sw_lat: float,
+        sw_lng: float,
+        ne_lat: float,
+        ne_lng: float,
+        type_ids: Optional[list[int]] = None,
+        include_unverified: bool = True,
+        threshold: int = 1 << 32,
+        cell_thresholds: Optional[tuple[int, ...]] = None,
+        check: Optional[Callable[[], None]] = None,
+    ) -> list[int]:
+        """
+        Ids of matching locations whose sampling rank is below the threshold,
+        and below their grid cell's entry of `cell_thresholds` if given
+        (cells x + grid * y of a square grid over the bbox), unordered.
+        """
+        rows = self.rows_in_bounds(sw_lat, sw_lng, ne_lat, ne_lng, type_ids, include_unverified, check)
+        ids = self.ids[rows]
+        ranks = (ids.astype(np.uint64) * np.uint64(SAMPLE_RANK_MULTIPLIER)) & np.uint64(0xFFFFFFFF)
+        keep = ranks < threshold
+        if cell_thresholds is not None:
+            cells = sample_cells(
+                self.lat[rows], self.lng[rows], math.isqrt(len(cell_thresholds)),
+                sw_lat, sw_lng, ne_lat, ne_lng,
+            )
+            keep &= ranks < np.array(cell_thresholds, dtype=np.uint64)[cells]
+        return ids[keep].tolist()
+
+    def points_in_boxes(
+        self,
+        boxes: list[tuple[float, float, float, float]],
+        type_ids: Optional[list[int]] = None,
+        include_unverified: bool = True,
+        check: Optional[Callable[[], None]] = None,
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Ids, latitudes and longitudes of matching locations in any of the boxes, each once."""
+        rows = np.unique(np.concatenate([
+            self.rows_in_bounds(*box, type_ids, include_unverified, check) for box in boxes
+        ] or [np.empty(0, dtype=np.int64)]))
+        return self.ids[rows], self.lat[rows], self.lng[rows]
@@ -4,44 +4,349 @@ Database connection utilities for Rising Fruit.
 Uses aiosqlite for async SQLite access with connection pooling.
 """
 
+import asyncio
 import json
+import math
 import os
+import sqlite3
+import time
 from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Any, AsyncGenerator, Optional
+from typing import Any, AsyncGenerator, Awaitable, Callable, Hashable, Optional
 
 import aiosqlite
+import numpy as np
+
+from .columnar import SAMPLE_RANK_MULTIPLIER, ColumnarIndex, sample_cells
+from .geometry import Shape
 
 # Database path from environment or default
 DB_PATH = Path(os.getenv("DATABASE_PATH", "/app/data/risingfruit.db"))
 
+# Optional memory-mapped columnar store written by `import.py --columnar`
+COLUMNAR_DIR = Path(os.environ["COLUMNAR_DIR"]) if os.getenv("COLUMNAR_DIR") else None
+
+# Regional shards written by `import.py --shard-zoom`; used when a manifest exists
+DB_SHARDS_DIR = (
+    Path(os.environ["DATABASE_SHARDS_DIR"]) if os.getenv("DATABASE_SHARDS_DIR")
+    else DB_PATH.with_name(DB_PATH.name + ".shards")
+)
+SHARD_FORMAT_VERSION = 1
+
+# Seconds between checks for a new shard manifest (0 disables reloading), and
+# how long replaced connections stay open for the requests still using them
+DB_RELOAD_INTERVAL = float(os.getenv("DATABASE_RELOAD_INTERVAL", "30"))
+DB_RELOAD_GRACE = 30.0
+
+# Multi-worker mode: open the database read-only as an immutable URI so every
+# uvicorn worker reads it through a shared mmap instead of a private cache.
+# DATABASE_IMMUTABLE=false keeps read-only workers WAL-aware instead, so they
+# see rows committed by a separate writer process (see docker-compose.yml)
+DB_READONLY = os.getenv("DATABASE_READONLY", "false").lower() == "true"
+DB_IMMUTABLE = DB_READONLY and os.getenv("DATABASE_IMMUTABLE", "true").lower() == "true"
+DB_CACHE_KB = int(os.getenv("DATABASE_CACHE_KB", "8000" if DB_READONLY else "64000"))
+
+# Density grid pyramid (must match db/import.py)
+DENSITY_MAX_ZOOM = 12
+DENSITY_CATEGORIES = ["forager", "honeybee", "grafter", "freegan"]
+DENSITY_FIELDS = ["x", "y", "verified", "unverified", *DENSITY_CATEGORIES]
+MAX_MERCATOR_LAT = 85.05112878
+
+# Compact storage (import.py --compact): integer R-tree scale (must match db/import.py)
+COORD_SCALE = 10_000_000
+
+# Tile zoom of location_changes cells (must match db/import.py)
+CHANGE_CELL_ZOOM = DENSITY_MAX_ZOOM
+CHANGE_FIELDS = ["version", "id", "change"]
+
+# Zooms that store per-type counts, and the most tiles a facet lookup may sum
+FACET_ZOOMS = (0, 2, 4, 6, 8, 10, 12)
+FACET_MAX_CELLS = 64
+
+# Query deadlines: SQLite VM steps between deadline checks in the progress handler
+QUERY_PROGRESS_STEPS = 1000
+
+# Monotonic deadline of the current request (set by the admission middleware)
+query_deadline: ContextVar[Optional[float]] = ContextVar("query_deadline", default=None)
+
+# Stratified sampling: rows drawn per returned location, the largest sampling
+# grid, and the most density tiles read to size each grid cell's share
+SAMPLE_OVERSAMPLE = 4
+SAMPLE_MAX_GRID = 32
+SAMPLE_MAX_DENSITY_TILES = 4096
+
+
+class QueryTimeout(Exception):
+    """Raised when a read is interrupted by its deadline or because every caller went away."""
+
+
+class QueryBudget:
+    """Deadline and cancellation state of one (possibly shared) read execution."""
+
+    __slots__ = ("deadline", "cancelled", "waiters")
+
+    def __init__(self, deadline: Optional[float]):
+        self.deadline = deadline
+        self.cancelled = False
+        self.waiters = 0
+
+    def exceeded(self) -> bool:
+        """True once the execution should stop."""
+        return self.cancelled or (self.deadline is not None and time.monotonic() > self.deadline)
+
+
+# Budget of the execution a coalesced task runs (copied into the task's context)
+_execution_budget: ContextVar[Optional[QueryBudget]] = ContextVar("execution_budget", default=None)
+
+
+# aiosqlite exposes no public way to run a function against its sqlite3
+# connection on the connection's own thread, which batches, progress handlers
+# and the writer need. Connection._execute and Connection._conn are internals
+# of the aiosqlite version pinned in requirements.txt (0.20.0); every use goes
+# through run_on_connection, and this check fails loudly if an upgrade drops them.
+if not (callable(getattr(aiosqlite.Connection, "_execute", None)) and hasattr(aiosqlite.Connection, "_conn")):
+    raise ImportError(
+        f"aiosqlite {aiosqlite.__version__} lacks Connection._execute/_conn; "
+        "run_on_connection needs updating for this version (pinned: 0.20.0)"
+    )
+
+
+def run_on_connection(connection: aiosqlite.Connection, work: Callable[..., Any], *args: Any) -> Awaitable[Any]:
+    """Run `work(conn, *args)` on the connection's thread, `conn` being its sqlite3 connection."""
+    return connection._execute(lambda: work(connection._conn, *args))
+
+
+@dataclass
+class Shard:
+    """One regional shard: a database holding the locations of one quadkey tile."""
+    quadkey: str
+    min_lat: float
+    min_lng: float
+    max_lat: float
+    max_lng: float
+    count: int
+    db: "Database"
+    # Digest of the shard's rows (None for manifests predating it)
+    checksum: Optional[str] = None
+
+    def overlaps(self, sw_lat: float, sw_lng: float, ne_lat: float, ne_lng: float) -> bool:
+        """Whether any of the shard's locations can fall in the bbox."""
+        return (
+            self.min_lat <= ne_lat and self.max_lat >= sw_lat
+            and self.min_lng <= ne_lng and self.max_lng >= sw_lng
+        )
+
 
 class Database:
     """Async SQLite database wrapper."""
     
-    def __init__(self, db_path: Path = DB_PATH):
+    def __init__(
+        self,
+        db_path: Path = DB_PATH,
+        columnar_dir: Optional[Path] = COLUMNAR_DIR,
+        readonly: bool = DB_READONLY,
+        shards_dir: Optional[Path] = DB_SHARDS_DIR,
+        immutable: Optional[bool] = None,
+    ):
         self.db_path = db_path
+        self.columnar_dir = columnar_dir
+        self.readonly = readonly
+        # Read-only connections are immutable unless configured otherwise
+        self.immutable = readonly and (DB_IMMUTABLE if immutable is None else immutable)
+        self.shards_dir = shards_dir
+        # Regional shards hold the location tables; empty when unsharded
+        self.shards: list[Shard] = []
+        # Dataset version of the shard manifest in use
+        self.shards_version: Optional[int] = None
+        self.warmed_up: Optional[bool] = None
+        # Compact storage layout: integer R-tree, cold columns in location_details
+        self.compact = False
+        self.columns: Optional[ColumnarIndex] = None
         self._connection: Optional[aiosqlite.Connection] = None
+        # Singleflight: identical reads in flight share one execution
+        self._inflight: dict[Hashable, tuple[asyncio.Task, QueryBudget]] = {}
+        self.coalesce_hits = 0
+        self.coalesce_misses = 0
+        # Budget of the statement running on the connection thread, checked by the progress handler
+        self._budget: Optional[QueryBudget] = None
+        self.interrupted = 0
+        # Connections replaced by reload(), and the tasks that close them
+        self._retired: list[aiosqlite.Connection] = []
+        self._closing: list[asyncio.Task] = []
     
     async def connect(self) -> None:
         """Open database connection."""
         if self._connection is None:
-            self._connection = await aiosqlite.connect(
-                str(self.db_path),
-                check_same_thread=False
-            )
+            if self.immutable:
+                # Immutable: no locking or WAL checks; the file must not change while open
+                self._connection = await aiosqlite.connect(
+                    f"file:{self.db_path}?mode=ro&immutable=1",
+                    uri=True,
+                    check_same_thread=False
+                )
+            elif self.readonly:
+                # Read-only but WAL-aware: sees what another process's writer commits
+                self._connection = await aiosqlite.connect(
+                    f"file:{self.db_path}?mode=ro",
+                    uri=True,
+                    check_same_thread=False
+                )
+            else:
+                self._connection = await aiosqlite.connect(
+                    str(self.db_path),
+                    check_same_thread=False
+                )
             # Enable row factory for dict-like access
             self._connection.row_factory = aiosqlite.Row
             # Performance settings
-            await self._connection.execute("PRAGMA journal_mode=WAL")
-            await self._connection.execute("PRAGMA synchronous=NORMAL")
-            await self._connection.execute("PRAGMA cache_size=-64000")
+            if not self.readonly:
+                await self._connection.execute("PRAGMA journal_mode=WAL")
+                await self._connection.execute("PRAGMA synchronous=NORMAL")
+            await self._connection.execute(f"PRAGMA cache_size=-{DB_CACHE_KB}")
+            # Map the whole file (plus room to grow) so reads share the OS page cache
+            mmap_size = self.db_path.stat().st_size + (0 if self.immutable else 256 * 1024 * 1024)
+            await self._connection.execute(f"PRAGMA mmap_size={mmap_size}")
+            # Long statements stop at their deadline instead of holding the shared connection
+            await run_on_connection(
+                self._connection,
+                sqlite3.Connection.set_progress_handler,
+                self._check_budget,
+                QUERY_PROGRESS_STEPS,
+            )
+            # Bbox lookups use the columnar store when one is configured
+            self.columns = ColumnarIndex.open(self.columnar_dir)
+            # A store from another import would join stale ids to this database
+            if self.columns is not None and self.columns.dataset_version != await get_dataset_version(self):
+                raise ValueError(
+                    f"Columnar store in {self.columnar_dir} does not match the database's dataset version; "
+                    "re-run the import with --columnar or unset COLUMNAR_DIR"
+                )
+            self.compact = await self.table_exists("location_details")
+            manifest = self._read_manifest()
+            if manifest is not None:
+                self.shards = await self._open_shards(manifest)
+                self.shards_version = manifest.get("dataset_version")
+    
+    def _read_manifest(self) -> Optional[dict]:
+        """The shard manifest, or None if the database is not sharded."""
+        manifest_path = self.shards_dir / "manifest.json" if self.shards_dir else None
+        if manifest_path is None or not manifest_path.exists():
+            return None
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+        if manifest.get("format_version") != SHARD_FORMAT_VERSION:
+            raise ValueError(f"Unsupported shard manifest version in {self.shards_dir}")
+        return manifest
+    
+    async def _open_shards(self, manifest: dict, current: Optional[list[Shard]] = None) -> list[Shard]:
+        """
+        Connect to every shard in the manifest. Shards of `current` whose file
+        and checksum are unchanged keep their open connection.
+        """
+        reusable = {
+            (shard.db.db_path.name, shard.checksum): shard.db
+            for shard in current or [] if shard.checksum is not None
+        }
+        shards = []
+        opened = []
+        for entry in manifest["shards"]:
+            checksum = entry.get("checksum")
+            shard_db = reusable.get((entry["file"], checksum))
+            if shard_db is None:
+                shard_db = Database(self.shards_dir / entry["file"], None, self.readonly, None, self.immutable)
+                opened.append(shard_db)
+            shards.append(Shard(entry["quadkey"], *entry["bounds"], entry["count"], shard_db, checksum))
+        await asyncio.gather(*(shard_db.connect() for shard_db in opened))
+        return shards
+    
+    async def reload(self) -> bool:
+        """
+        Switch to a newer import of a sharded database once its manifest appears.
+        
+        The import publishes the manifest last, so by then the main database
+        (types and derived tables) and every shard file are complete. The main
+        database and columnar store are reopened, as are shards whose file
+        changed; unchanged shards keep their connection. Replaced connections
+        close after DB_RELOAD_GRACE so requests already using them can finish.
+        Returns whether a new import was loaded.
+        """
+        if self._connection is None or not self.shards:
+            return False
+        manifest = self._read_manifest()
+        if manifest is None or manifest.get("dataset_version") == self.shards_version:
+            return False
+        
+        fresh = Database(self.db_path, self.columnar_dir, self.readonly, None, self.immutable)
+        await fresh.connect()
+        if await get_dataset_version(fresh) != manifest.get("dataset_version"):
+            # The manifest belongs to a different import than the main database
+            await fresh.disconnect()
+            return False
+        shards = await self._open_shards(manifest, self.shards)
+        
+        # Statements on the new connection run under this instance's budgets
+        await run_on_connection(
+            fresh._connection, sqlite3.Connection.set_progress_handler, self._check_budget, QUERY_PROGRESS_STEPS,
+        )
+        kept = {id(shard.db) for shard in shards}
+        retired = [self._connection] + [
+            shard.db._connection for shard in self.shards if id(shard.db) not in kept
+        ]
+        self._connection = fresh._connection
+        self.columns = fresh.columns
+        self.compact = fresh.compact
+        self.shards = shards
+        self.shards_version = manifest.get("dataset_version")
+        
+        self._retired.extend(connection for connection in retired if connection is not None)
+        self._closing = [task for task in self._closing if not task.done()]
+        self._closing.append(asyncio.create_task(self._close_retired(list(self._retired))))
+        return True
+    
+    async def _close_retired(self, connections: list[aiosqlite.Connection], delay: float = DB_RELOAD_GRACE) -> None:
+        """Close connections replaced by reload() once in-flight requests are done with them."""
+        await asyncio.sleep(delay)
+        for connection in connections:
+            if connection in self._retired:
+                self._retired.remove(connection)
+                await connection.close()
+    
+    def location_stores(
+        self,
+        bounds: Optional[tuple[float, float, float, float]] = None,
+    ) -> list["Database"]:
+        """
+        Databases holding the location tables: this one when unsharded,
+        otherwise the shards overlapping `bounds` (all shards without bounds).
+        """
+        if not self.shards:
+            return [self]
+        return [
+            shard.db for shard in self.shards
+            if bounds is None or shard.overlaps(*bounds)
+        ]
     
     async def disconnect(self) -> None:
         """Close database connection."""
+        if self.shards:
+            await asyncio.gather(*(shard.db.disconnect() for shard in self.shards))
+            self.shards = []
+        for task in self._closing:
+            task.cancel()
+        self._closing = []
+        await self._close_retired(list(self._retired), delay=0)
+        # Let shared executions finish before the connection goes away
+        if self._inflight:
+            await asyncio.gather(
+                *(task for task, _ in self._inflight.values()), return_exceptions=True
+            )
+        self._inflight.clear()
         if self._connection is not None:
             await self._connection.close()
             self._connection = None
+        self.columns = None
     
     @property
     def connection(self) -> aiosqlite.Connection:
@@ -50,31 +355,202 @@ class Database:
             raise RuntimeError("Database not connected. Call connect() first.")
         return self._connection
     
+    async def warmup(self) -> None:
+        """
+        Pre-touch the pages bbox queries hit, so the first requests after a
+        restart don't pay for cold reads.
+        
+        Reads the R-tree nodes, the hot columns of every locations page, the
+        location-type links, duplicate groups and density tables, plus the columnar arrays
+        when configured. Pages land in the OS page cache shared by all workers.
+        """
+        self.warmed_up = False
+        try:
+            await self.fetch_value("SELECT SUM(length(data)) FROM locations_rtree_node")
+            await self.fetch_value("SELECT SUM(lat + lng + hidden + unverified) FROM locations")
+            await self.fetch_value("SELECT SUM(type_id) FROM location_types")
+            if await self.table_exists("location_groups"):
+                await self.fetch_value("SELECT SUM(group_id) FROM location_groups")
+            for table in ("density_cells", "density_type_cells"):
+                if await self.table_exists(table):
+                    await self.fetch_value(f"SELECT SUM(x) FROM {table}")
+            if self.columns is not None:
+                await asyncio.to_thread(self.columns.warmup)
+            await asyncio.gather(*(shard.db.warmup() for shard in self.shards))
+        finally:
+            # Best effort: a failed warmup must not keep the service unhealthy
+            self.warmed_up = True
+    
+    @property
+    def coalesce_stats(self) -> dict:
+        """Singleflight counters: hits share an in-flight execution, misses start one."""
+        return {
+            "hits": self.coalesce_hits,
+            "misses": self.coalesce_misses,
+            "in_flight": len(self._inflight),
+        }
+    
+    async def coalesce(self, key: Hashable, run: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Run `run()` once for concurrent callers with the same key.
+        
+        The execution is a separate task, so a caller that is cancelled (e.g.
+        client disconnect) does not cancel it for the others. It runs under
+        the deadline of the request that started it, and is interrupted once
+        every caller has gone away. Callers must not mutate the shared result.
+        """
+        entry = self._inflight.get(key)
+        if entry is not None:
+            self.coalesce_hits += 1
+            task, budget = entry
+        else:
+            self.coalesce_misses += 1
+            budget = QueryBudget(query_deadline.get())
+            token = _execution_budget.set(budget)
+            try:
+                task = asyncio.ensure_future(run())
+            finally:
+                _execution_budget.reset(token)
+            self._inflight[key] = (task, budget)
+            task.add_done_callback(lambda t: self._finish_inflight(key, t))
+        
+        budget.waiters += 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            budget.waiters -= 1
+            if budget.waiters == 0:
+                budget.cancelled = True
+            raise
+    
+    def _finish_inflight(self, key: Hashable, task: asyncio.Task) -> None:
+        """Forget a finished shared execution."""
+        entry = self._inflight.get(key)
+        if entry is not None and entry[0] is task:
+            del self._inflight[key]
+        # Mark the exception retrieved even if every caller went away
+        if not task.cancelled():
+            task.exception()
+    
+    def _check_budget(self) -> int:
+        """SQLite progress handler: a non-zero return interrupts the running statement."""
+        budget = self._budget
+        return 1 if budget is not None and budget.exceeded() else 0
+    
+    def _run_budgeted(
+        self,
+        conn: sqlite3.Connection,
+        budget: Optional[QueryBudget],
+        work: Callable[[sqlite3.Connection], Any],
+    ) -> Any:
+        """Run `work(conn)` on the connection thread under a budget (checked before and during it)."""
+        if budget is not None and budget.exceeded():
+            raise QueryTimeout("Query deadline exceeded before it started")
+        self._budget = budget
+        try:
+            return work(conn)
+        except sqlite3.OperationalError as e:
+            if budget is not None and budget.exceeded():
+                self.interrupted += 1
+                raise QueryTimeout("Query interrupted by its deadline") from e
+            raise
+        finally:
+            self._budget = None
+    
+    async def _fetch_rows(self, query: str, params: tuple, one: bool) -> Any:
+        """Fetch raw rows for a read, coalesced on normalized SQL and parameters."""
+        key = ("one" if one else "all", " ".join(query.split()), params)
+        
+        def read(conn: sqlite3.Connection) -> Any:
+            cursor = conn.execute(query, params)
+            return cursor.fetchone() if one else cursor.fetchall()
+        
+        async def run() -> Any:
+            budget = _execution_budget.get()
+            return await run_on_connection(self.connection, self._run_budgeted, budget, read)
+        
+        return await self.coalesce(key, run)
+    
+    async def batch(
+        self,
+        work: Callable[..., Any],
+        *args: Any,
+        key: Optional[Hashable] = None,
+    ) -> Any:
+        """
+        Run `work(conn, *args)` on the connection's thread in a single hop.
+        
+        `work` receives the underlying sqlite3 connection and may run any
+        number of reads, including ones that depend on earlier results. They
+        share one read transaction, so they see a consistent snapshot. Use
+        `tuple_cursor` for plain tuples instead of rows. With a key,
+        concurrent identical batches share one execution.
+        """
+        def run_in_thread(conn: sqlite3.Connection) -> Any:
+            own_transaction = not conn.in_transaction
+            if own_transaction:
+                conn.execute("BEGIN")
+            try:
+                return work(conn, *args)
+            finally:
+                # An interrupted statement may already have ended the transaction
+                if own_transaction and conn.in_transaction:
+                    conn.execute("COMMIT")
+        
+        async def run() -> Any:
+            budget = _execution_budget.get() or QueryBudget(query_deadline.get())
+            return await run_on_connection(self.connection, self._run_budgeted, budget, run_in_thread)
+        
+        if key is None:
+            return await run()
+        return await self.coalesce(("batch", key), run)
+    
+    async def compute(self, work: Callable[..., Any], *args: Any) -> Any:
+        """
+        Run `work(*args, check=check)` in a worker thread under the read's
+        budget, for lookups outside SQLite (the columnar store, geometry).
+        `work` calls `check()` between steps; it raises QueryTimeout once the
+        deadline passes or every caller has gone away.
+        """
+        budget = _execution_budget.get() or QueryBudget(query_deadline.get())
+        
+        def check() -> None:
+            if budget.exceeded():
+                self.interrupted += 1
+                raise QueryTimeout("Query interrupted by its deadline")
+        
+        return await asyncio.to_thread(work, *args, check=check)
+    
     async def execute(self, query: str, params: tuple = ()) -> aiosqlite.Cursor:
         """Execute a query."""
         return await self.connection.execute(query, params)
     
     async def fetch_one(self, query: str, params: tuple = ()) -> Optional[dict]:
         """Fetch a single row as dict."""
-        cursor = await self.execute(query, params)
-        row = await cursor.fetchone()
+        row = await self._fetch_rows(query, params, one=True)
         if row is None:
             return None
         return dict(row)
     
     async def fetch_all(self, query: str, params: tuple = ()) -> list[dict]:
         """Fetch all rows as list of dicts."""
-        cursor = await self.execute(query, params)
-        rows = await cursor.fetchall()
+        rows = await self._fetch_rows(query, params, one=False)
         return [dict(row) for row in rows]
     
     async def fetch_value(self, query: str, params: tuple = ()) -> Any:
         """Fetch a single value."""
-        cursor = await self.execute(query, params)
-        row = await cursor.fetchone()
+        row = await self._fetch_rows(query, params, one=True)
         if row is None:
             return None
         return row[0]
+    
+    async def table_exists(self, name: str) -> bool:
+        """Check whether a table exists (derived tables may predate an import)."""
+        found = await self.fetch_value(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+            (name,)
+        )
+        return found is not None
 
 
 # Global database instance
@@ -91,6 +567,62 @@ async def get_db() -> AsyncGenerator[Database, None]:
 # Query helpers
 # ============================================
 
+def tuple_cursor(conn: sqlite3.Connection) -> sqlite3.Cursor:
+    """Cursor returning plain tuples, for use inside Database.batch."""
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    return cursor
+
+
+def _parse_type_ids(rows: list[dict]) -> None:
+    """Parse GROUP_CONCAT type_ids strings into lists of ints in place."""
+    for row in rows:
+        if row.get("type_ids"):
+            row["type_ids"] = [int(tid) for tid in row["type_ids"].split(",")]
+        else:
+            row["type_ids"] = []
+
+
+def _merge_duplicate_groups(groups: list[dict]) -> list[dict]:
+    """Merge the rows of a duplicate group found in several shards (groups can straddle a shard edge)."""
+    merged: dict[int, dict] = {}
+    for group in groups:
+        current = merged.get(group["group_id"])
+        if current is None:
+            merged[group["group_id"]] = group
+        else:
+            member_count = current["member_count"] + group["member_count"]
+            if group["id"] < current["id"]:
+                merged[group["group_id"]] = current = group
+            current["member_count"] = member_count
+    return list(merged.values())
+
+
+def _rtree_bounds(db: Database, sw_lat: float, sw_lng: float, ne_lat: float, ne_lng: float) -> list:
+    """
+    Parameters for the `r.min_lat <= ? AND r.max_lat >= ? AND r.min_lng <= ? AND r.max_lng >= ?` filter.
+    
+    Compact databases store fixed-point integers, so the bbox is scaled and
+    rounded inward to the nearest representable coordinates (with a small
+    tolerance so values like 37.77 * 10^7 don't lose a unit to float error).
+    """
+    if db.compact:
+        return [
+            math.floor(ne_lat * COORD_SCALE + 1e-6), math.ceil(sw_lat * COORD_SCALE - 1e-6),
+            math.floor(ne_lng * COORD_SCALE + 1e-6), math.ceil(sw_lng * COORD_SCALE - 1e-6),
+        ]
+    return [ne_lat, sw_lat, ne_lng, sw_lng]
+
+
+def tile_for_point(lat: float, lng: float, zoom: int) -> tuple[int, int]:
+    """Web Mercator tile x/y containing a point at the given zoom."""
+    n = 1 << zoom
+    lat_rad = math.radians(max(-MAX_MERCATOR_LAT, min(MAX_MERCATOR_LAT, lat)))
+    x = int((lng + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(lat_rad)) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
 async def get_locations_in_bounds(
     db: Database,
     sw_lat: float,
@@ -103,6 +635,9 @@ async def get_locations_in_bounds(
     include_unverified: bool = True,
     center_lat: Optional[float] = None,
     center_lng: Optional[float] = None,
+    sample: Optional[str] = None,
+    total: Optional[int] = None,
+    collapse_duplicates: bool = False,
 ) -> list[dict]:
     """
     Get locations within a bounding box using R-tree index.
@@ -118,10 +653,34 @@ async def get_locations_in_bounds(
         include_unverified: Include unverified locations
         center_lat: Optional center latitude for distance-based ordering
         center_lng: Optional center longitude for distance-based ordering
+        sample: "stratified" to spread up to `limit` results evenly over the
+            viewport instead of returning the first page (ignores offset and center)
+        total: Known count of matching locations, saves a count when sampling
+        collapse_duplicates: One row per near-duplicate group (needs the
+            location_groups table), with its member_count
 
     Returns:
         List of location dicts
     """
+    if sample == "stratified":
+        return await _sample_locations_in_bounds(
+            db, sw_lat, sw_lng, ne_lat, ne_lng, type_ids, limit, include_unverified, total,
+            collapse_duplicates,
+        )
+
+    # The columnar store has no duplicate groups, so this always reads SQLite
+    if collapse_duplicates:
+        return await _get_collapsed_locations_in_bounds(
+            db, sw_lat, sw_lng, ne_lat, ne_lng, type_ids, limit, offset,
+            include_unverified, center_lat, center_lng,
+        )
+
+    if db.columns is not None:
+        return await _get_locations_in_bounds_columnar(
+            db, sw_lat, sw_lng, ne_lat, ne_lng, type_ids, limit, offset,
+            include_unverified, center_lat, center_lng,
+        )
+
     # Base query using R-tree for spatial filtering
     query = """
         SELECT
@@ -136,7 +695,7 @@ async def get_locations_in_bounds(
           AND r.min_lng <= ? AND r.max_lng >= ?
           AND l.hidden = 0
     """
-    params: list = [ne_lat, sw_lat, ne_lng, sw_lng]
+    params: list = _rtree_bounds(db, sw_lat, sw_lng, ne_lat, ne_lng)
 
     if not include_unverified:
         query += " AND l.unverified = 0"
@@ -154,21 +713,476 @@ async def get_locations_in_bounds(
         params.extend([center_lat, center_lat, center_lng, center_lng])
     else:
         query += " ORDER BY l.id"
-    query += " LIMIT ? OFFSET ?"
-    params.extend([limit, offset])
     
-    rows = await db.fetch_all(query, tuple(params))
+    stores = db.location_stores((sw_lat, sw_lng, ne_lat, ne_lng))
+    if len(stores) == 1:
+        query += " LIMIT ? OFFSET ?"
+        params.extend([limit, offset])
+        rows = await stores[0].fetch_all(query, tuple(params))
+    else:
+        # Every shard returns its own first offset+limit rows; merge and page them here
+        query += " LIMIT ?"
+        params.append(offset + limit)
+        results = await asyncio.gather(*(store.fetch_all(query, tuple(params)) for store in stores))
+        if center_lat is not None and center_lng is not None:
+            def order_key(row: dict) -> tuple:
+                return ((row["lat"] - center_lat) ** 2 + (row["lng"] - center_lng) ** 2, row["id"])
+        else:
+            def order_key(row: dict) -> tuple:
+                return (row["id"],)
+        rows = sorted((row for shard_rows in results for row in shard_rows), key=order_key)
+        rows = rows[offset:offset + limit]
 
     # Parse type_ids string to list
-    for row in rows:
-        if row.get("type_ids"):
-            row["type_ids"] = [int(tid) for tid in row["type_ids"].split(",")]
+    _parse_type_ids(rows)
+
+    return rows
+
+
+async def _get_locations_in_bounds_columnar(
+    db: Database,
+    sw_lat: float,
+    sw_lng: float,
+    ne_lat: float,
+    ne_lng: float,
+    type_ids: Optional[list[int]],
+    limit: int,
+    offset: int,
+    include_unverified: bool,
+    center_lat: Optional[float],
+    center_lng: Optional[float],
+) -> list[dict]:
+    """Columnar variant of get_locations_in_bounds: ids from the mmap store, details from SQLite."""
+    args = (
+        sw_lat, sw_lng, ne_lat, ne_lng, tuple(type_ids or ()), limit, offset,
+        include_unverified, center_lat, center_lng,
+    )
+    ids = await db.coalesce(
+        ("columnar_ids", args),
+        lambda: db.compute(db.columns.ids_in_bounds, *args),
+    )
+    rows = await _get_location_summaries(db, ids, type_ids, (sw_lat, sw_lng, ne_lat, ne_lng))
+
+    # Restore the engine's ordering
+    by_id = {row["id"]: row for row in rows}
+    return [by_id[location_id] for location_id in ids if location_id in by_id]
+
+
+async def _get_collapsed_locations_in_bounds(
+    db: Database,
+    sw_lat: float,
+    sw_lng: float,
+    ne_lat: float,
+    ne_lng: float,
+    type_ids: Optional[list[int]],
+    limit: int,
+    offset: int,
+    include_unverified: bool,
+    center_lat: Optional[float],
+    center_lng: Optional[float],
+    threshold: Optional[int] = None,
+    cell_thresholds: Optional[list[int]] = None,
+) -> list[dict]:
+    """
+    Collapsed variant of get_locations_in_bounds: one row per duplicate group.
+
+    Groups are formed from the matching locations only, so a group is
+    represented by its lowest matching id and member_count counts its
+    matching members. A lean grouped query over the R-tree picks the page
+    (or, with a sampling `threshold`, every group whose id ranks below it,
+    and below its grid cell's entry of `cell_thresholds` if given), and the
+    full rows of those representatives are fetched afterwards.
+    """
+    cell_join, params = "", []
+    if cell_thresholds is not None:
+        cell_join, params = _cell_thresholds_join(cell_thresholds, sw_lat, sw_lng, ne_lat, ne_lng)
+    query = f"""
+        SELECT
+            MIN(l.id) AS id, l.lat, l.lng, COUNT(*) AS member_count,
+            COALESCE(g.group_id, l.id) AS group_id
+        FROM locations l
+        INNER JOIN locations_rtree r ON l.id = r.id
+        LEFT JOIN location_groups g ON g.location_id = l.id
+        {cell_join}
+        WHERE r.min_lat <= ? AND r.max_lat >= ?
+          AND r.min_lng <= ? AND r.max_lng >= ?
+          AND l.hidden = 0
+    """
+    params.extend(_rtree_bounds(db, sw_lat, sw_lng, ne_lat, ne_lng))
+
+    if not include_unverified:
+        query += " AND l.unverified = 0"
+
+    if type_ids:
+        # EXISTS keeps one row per location, so COUNT(*) counts members
+        placeholders = ",".join("?" * len(type_ids))
+        query += f"""
+          AND EXISTS (
+              SELECT 1 FROM location_types lt
+              WHERE lt.location_id = l.id AND lt.type_id IN ({placeholders})
+          )
+        """
+        params.extend(type_ids)
+
+    if threshold is not None and threshold < 1 << 32:
+        query += " AND ((COALESCE(g.group_id, l.id) * ?) & 4294967295) < ?"
+        params.extend([SAMPLE_RANK_MULTIPLIER, threshold])
+
+    # lat/lng (and c.threshold) are bare columns, taken from the row MIN() picked
+    query += " GROUP BY COALESCE(g.group_id, l.id)"
+    if cell_thresholds is not None:
+        # After grouping, so a group is kept or dropped whole
+        query += " HAVING ((COALESCE(g.group_id, l.id) * ?) & 4294967295) < c.threshold"
+        params.append(SAMPLE_RANK_MULTIPLIER)
+    centered = center_lat is not None and center_lng is not None
+    if threshold is None:
+        if centered:
+            query += " ORDER BY ((l.lat - ?) * (l.lat - ?) + (l.lng - ?) * (l.lng - ?)), id"
+            params.extend([center_lat, center_lat, center_lng, center_lng])
         else:
-            row["type_ids"] = []
+            query += " ORDER BY id"
+
+    bounds = (sw_lat, sw_lng, ne_lat, ne_lng)
+    stores = db.location_stores(bounds)
+    if len(stores) == 1 and threshold is None:
+        query += " LIMIT ? OFFSET ?"
+        params.extend([limit, offset])
+        groups = await stores[0].fetch_all(query, tuple(params))
+    else:
+        if threshold is None:
+            query += " LIMIT ?"
+            params.append(offset + limit)
+        results = await asyncio.gather(*(store.fetch_all(query, tuple(params)) for store in stores))
+        groups = _merge_duplicate_groups([group for shard_groups in results for group in shard_groups])
+        if threshold is None:
+            if centered:
+                def order_key(group: dict) -> tuple:
+                    return ((group["lat"] - center_lat) ** 2 + (group["lng"] - center_lng) ** 2, group["id"])
+            else:
+                def order_key(group: dict) -> tuple:
+                    return (group["id"],)
+            groups = sorted(groups, key=order_key)[offset:offset + limit]
+
+    rows = await _get_location_summaries(db, [group["id"] for group in groups], type_ids, bounds)
+    by_id = {row["id"]: row for row in rows}
+    collapsed = []
+    for group in groups:
+        row = by_id.get(group["id"])
+        if row is not None:
+            row["member_count"] = group["member_count"]
+            collapsed.append(row)
+    return collapsed
 
+
+async def _get_location_summaries(
+    db: Database,
+    ids: list[int],
+    type_ids: Optional[list[int]],
+    bounds: tuple[float, float, float, float],
+) -> list[dict]:
+    """Summary rows for known location ids inside `bounds`, in no particular order."""
+    if not ids:
+        return []
+
+    query = """
+        SELECT
+            l.id, l.lat, l.lng, l.description, l.access,
+            l.season_start, l.season_stop, l.author,
+            l.unverified, l.created_at, l.updated_at,
+            GROUP_CONCAT(DISTINCT lt.type_id) as type_ids
+        FROM locations l
+        LEFT JOIN location_types lt ON l.id = lt.location_id
+        WHERE l.id IN (SELECT value FROM json_each(?))
+    """
+    params: list = [json.dumps(ids)]
+
+    # Match the R-tree query, which only reports the filtered types
+    if type_ids:
+        placeholders = ",".join("?" * len(type_ids))
+        query += f" AND lt.type_id IN ({placeholders})"
+        params.extend(type_ids)
+    query += " GROUP BY l.id"
+
+    stores = db.location_stores(bounds)
+    results = await asyncio.gather(*(store.fetch_all(query, tuple(params)) for store in stores))
+    rows = [row for shard_rows in results for row in shard_rows]
+    _parse_type_ids(rows)
     return rows
 
 
+def sample_rank(location_id: int) -> int:
+    """Stable pseudo-random 32-bit rank of a location (multiplicative hash of its id)."""
+    return (location_id * SAMPLE_RANK_MULTIPLIER) & 0xFFFFFFFF
+
+
+async def _sample_locations_in_bounds(
+    db: Database,
+    sw_lat: float,
+    sw_lng: float,
+    ne_lat: float,
+    ne_lng: float,
+    type_ids: Optional[list[int]],
+    limit: int,
+    include_unverified: bool,
+    total: Optional[int],
+    collapse_duplicates: bool = False,
+) -> list[dict]:
+    """
+    Up to `limit` locations spread evenly over a grid laid across the bbox.
+
+    Every location has a fixed pseudo-random rank, so a rank threshold picks
+    a sample of about SAMPLE_OVERSAMPLE * limit rows straight off the R-tree
+    scan, without grouping or sorting the whole bbox. The threshold is set per
+    grid cell from the density grid: the budget is shared out so sparse cells
+    keep all their rows and dense cells split the rest evenly, so every cell
+    with locations is represented when the budget allows (cell sizes are
+    estimates, so a cell may get slightly fewer rows than its share). The sample is then
+    dealt round-robin from the grid cells, lowest rank first. Without a
+    density grid one threshold applies to the whole bbox (a uniform sample).
+    Results are stable between requests. With collapse_duplicates, whole
+    groups are sampled by the rank of their group id and `total` counts groups.
+    """
+    if total is None:
+        total = await get_locations_count_in_bounds(
+            db, sw_lat, sw_lng, ne_lat, ne_lng, type_ids, include_unverified, collapse_duplicates,
+        )
+    if total <= limit:
+        return await get_locations_in_bounds(
+            db, sw_lat, sw_lng, ne_lat, ne_lng, type_ids, limit,
+            include_unverified=include_unverified, collapse_duplicates=collapse_duplicates,
+        )
+
+    grid = _sample_grid(limit)
+    cell_thresholds = await _get_cell_thresholds(
+        db, sw_lat, sw_lng, ne_lat, ne_lng, grid, type_ids, include_unverified,
+        limit * SAMPLE_OVERSAMPLE,
+    )
+    if cell_thresholds is None:
+        fraction = min(1.0, limit * SAMPLE_OVERSAMPLE / total)
+        threshold = int(fraction * (1 << 32))
+    else:
+        # Rank pre-filter ahead of the per-cell lookup; only applied when some
+        # rows can be dropped everywhere, i.e. no cell keeps all of its rows
+        threshold = max(cell_thresholds)
+
+    if collapse_duplicates:
+        rows = await _get_collapsed_locations_in_bounds(
+            db, sw_lat, sw_lng, ne_lat, ne_lng, type_ids, limit, 0,
+            include_unverified, None, None, threshold, cell_thresholds,
+        )
+    elif db.columns is not None:
+        args = (
+            sw_lat, sw_lng, ne_lat, ne_lng, tuple(type_ids or ()), include_unverified, threshold,
+            tuple(cell_thresholds) if cell_thresholds is not None else None,
+        )
+        ids = await db.coalesce(
+            ("columnar_sample", args),
+            lambda: db.compute(db.columns.sample_ids_in_bounds, *args),
+        )
+        rows = await _get_location_summaries(db, ids, type_ids, (sw_lat, sw_lng, ne_lat, ne_lng))
+    else:
+        cell_join, params = "", []
+        if cell_thresholds is not None:
+            cell_join, params = _cell_thresholds_join(cell_thresholds, sw_lat, sw_lng, ne_lat, ne_lng)
+        query = f"""
+            SELECT
+                l.id, l.lat, l.lng, l.description, l.access,
+                l.season_start, l.season_stop, l.author,
+                l.unverified, l.created_at, l.updated_at,
+                GROUP_CONCAT(DISTINCT lt.type_id) as type_ids
+            FROM locations l
+            INNER JOIN locations_rtree r ON l.id = r.id
+            LEFT JOIN location_types lt ON l.id = lt.location_id
+            {cell_join}
+            WHERE r.min_lat <= ? AND r.max_lat >= ?
+              AND r.min_lng <= ? AND r.max_lng >= ?
+              AND l.hidden = 0
+        """
+        params.extend(_rtree_bounds(db, sw_lat, sw_lng, ne_lat, ne_lng))
+
+        if threshold < 1 << 32:
+            query += " AND ((l.id * ?) & 4294967295) < ?"
+            params.extend([SAMPLE_RANK_MULTIPLIER, threshold])
+
+        if not include_unverified:
+            query += " AND l.unverified = 0"
+
+        if type_ids:
+            placeholders = ",".join("?" * len(type_ids))
+            query += f" AND lt.type_id IN ({placeholders})"
+            params.extend(type_ids)
+
+        if cell_thresholds is not None:
+            query += " AND ((l.id * ?) & 4294967295) < c.threshold"
+            params.append(SAMPLE_RANK_MULTIPLIER)
+
+        query += " GROUP BY l.id"
+        stores = db.location_stores((sw_lat, sw_lng, ne_lat, ne_lng))
+        results = await asyncio.gather(*(store.fetch_all(query, tuple(params)) for store in stores))
+        rows = [row for shard_rows in results for row in shard_rows]
+        _parse_type_ids(rows)
+
+    return _stratify(rows, sw_lat, sw_lng, ne_lat, ne_lng, limit)
+
+
+def _sample_grid(limit: int) -> int:
+    """Cells per side of the sampling grid: aim for a few picks per cell."""
+    return max(1, min(SAMPLE_MAX_GRID, math.isqrt(max(limit // 4, 1))))
+
+
+def _cell_thresholds_join(
+    cell_thresholds: list[int],
+    sw_lat: float,
+    sw_lng: float,
+    ne_lat: float,
+    ne_lng: float,
+) -> tuple[str, list]:
+    """
+    Join clause giving each location row its grid cell's threshold as c.threshold.
+
+    The thresholds are materialized once per query (LIMIT -1 keeps SQLite
+    from flattening the subquery) and each row finds its cell through an
+    automatic index; CROSS JOIN keeps the lookup after the R-tree scan.
+    """
+    grid = math.isqrt(len(cell_thresholds))
+    lat_scale = grid / max(ne_lat - sw_lat, 1e-9)
+    lng_scale = grid / max(ne_lng - sw_lng, 1e-9)
+    # Same cell as sample_cells: truncate, then clamp to the grid
+    join = """
+        CROSS JOIN (SELECT key AS cell, value AS threshold FROM json_each(?) LIMIT -1) c
+            ON c.cell = MIN(MAX(CAST((l.lng - ?) * ? AS INTEGER), 0), ?)
+                + ? * MIN(MAX(CAST((l.lat - ?) * ? AS INTEGER), 0), ?)
+    """
+    params = [
+        json.dumps(cell_thresholds),
+        sw_lng, lng_scale, grid - 1, grid, sw_lat, lat_scale, grid - 1,
+    ]
+    return join, params
+
+
+def _tile_lat(y: np.ndarray, zoom: int) -> np.ndarray:
+    """Latitude of the north edge of Web Mercator tile rows."""
+    return np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * y / (1 << zoom)))))
+
+
+async def _get_cell_thresholds(
+    db: Database,
+    sw_lat: float,
+    sw_lng: float,
+    ne_lat: float,
+    ne_lng: float,
+    grid: int,
+    type_ids: Optional[list[int]],
+    include_unverified: bool,
+    budget: int,
+) -> Optional[list[int]]:
+    """
+    Sampling rank threshold of each grid cell (x + grid * y), or None without a density grid.
+
+    Cell sizes are estimated from the finest density tiles (per-type tiles
+    with a type filter) of which the bbox spans at most
+    SAMPLE_MAX_DENSITY_TILES, each tile's count spread over the cells it
+    overlaps. The budget is then water-filled: cells smaller than the fair
+    share keep every row, and the larger ones are cut to the same share.
+    """
+    table = "density_type_cells" if type_ids else "density_cells"
+    if not await db.table_exists(table):
+        return None
+
+    zooms = FACET_ZOOMS if type_ids else range(DENSITY_MAX_ZOOM + 1)
+    zoom = zooms[0]
+    for candidate in zooms:
+        min_x, min_y = tile_for_point(ne_lat, sw_lng, candidate)
+        max_x, max_y = tile_for_point(sw_lat, ne_lng, candidate)
+        if (max_x - min_x + 1) * (max_y - min_y + 1) > SAMPLE_MAX_DENSITY_TILES:
+            break
+        zoom = candidate
+    min_x, min_y = tile_for_point(ne_lat, sw_lng, zoom)
+    max_x, max_y = tile_for_point(sw_lat, ne_lng, zoom)
+
+    if type_ids:
+        placeholders = ",".join("?" * len(type_ids))
+        count = "SUM(count)"
+        type_filter = f"AND type_id IN ({placeholders})"
+    else:
+        count = "verified + unverified" if include_unverified else "verified"
+        type_filter = ""
+    cursor = await db.execute(f"""
+        SELECT x, y, {count} FROM {table}
+        WHERE z = ? AND x BETWEEN ? AND ? AND y BETWEEN ? AND ? {type_filter}
+        {"GROUP BY x, y" if type_ids else ""}
+    """, (zoom, min_x, max_x, min_y, max_y, *(type_ids or ())))
+    tiles = np.array(await cursor.fetchall(), dtype=np.float64).reshape(-1, 3)
+
+    # Fraction of each tile's extent falling in each grid column / row
+    n = 1 << zoom
+    tile_lng0 = tiles[:, 0] / n * 360.0 - 180.0
+    tile_lng1 = tile_lng0 + 360.0 / n
+    tile_lat1 = _tile_lat(tiles[:, 1], zoom)
+    tile_lat0 = _tile_lat(tiles[:, 1] + 1, zoom)
+    edges_lng = np.linspace(sw_lng, ne_lng, grid + 1)
+    edges_lat = np.linspace(sw_lat, ne_lat, grid + 1)
+    share_x = np.clip(
+        np.minimum(tile_lng1[:, None], edges_lng[None, 1:]) - np.maximum(tile_lng0[:, None], edges_lng[None, :-1]),
+        0.0, None,
+    ) / (tile_lng1 - tile_lng0)[:, None]
+    share_y = np.clip(
+        np.minimum(tile_lat1[:, None], edges_lat[None, 1:]) - np.maximum(tile_lat0[:, None], edges_lat[None, :-1]),
+        0.0, None,
+    ) / np.maximum(tile_lat1 - tile_lat0, 1e-12)[:, None]
+    # counts[y, x], flattened to x + grid * y
+    counts = np.einsum("t,ty,tx->yx", tiles[:, 2], share_y, share_x).ravel()
+
+    # Water-filling: the largest share every cell can get within the budget
+    share = np.inf
+    ordered = np.sort(counts)
+    remaining = float(budget)
+    for index, cell_count in enumerate(ordered):
+        fair = remaining / (len(ordered) - index)
+        if cell_count > fair:
+            share = fair
+            break
+        remaining -= cell_count
+    with np.errstate(divide="ignore", invalid="ignore"):
+        fraction = np.where(counts > share, share / counts, 1.0)
+    return [int(value) for value in np.minimum(fraction * (1 << 32), 1 << 32)]
+
+
+def _stratify(
+    rows: list[dict],
+    sw_lat: float,
+    sw_lng: float,
+    ne_lat: float,
+    ne_lng: float,
+    limit: int,
+) -> list[dict]:
+    """Deal rows round-robin from a grid of bbox cells (lowest rank first) until `limit`."""
+    grid = _sample_grid(limit)
+    rows = sorted(rows, key=lambda row: sample_rank(row["id"]))
+    row_cells = sample_cells(
+        np.array([row["lat"] for row in rows], dtype=np.float64),
+        np.array([row["lng"] for row in rows], dtype=np.float64),
+        grid, sw_lat, sw_lng, ne_lat, ne_lng,
+    )
+
+    cells: dict[int, list[dict]] = {}
+    for row, cell in zip(rows, row_cells.tolist()):
+        cells.setdefault(cell, []).append(row)
+
+    picked: list[dict] = []
+    buckets = list(cells.values())
+    depth = 0
+    while buckets and len(picked) < limit:
+        for bucket in buckets:
+            if depth < len(bucket):
+                picked.append(bucket[depth])
+                if len(picked) == limit:
+                    break
+        depth += 1
+        buckets = [bucket for bucket in buckets if depth < len(bucket)]
+    return picked
+
+
 async def get_locations_count_in_bounds(
     db: Database,
     sw_lat: float,
@@ -177,6 +1191,7 @@ async def get_locations_count_in_bounds(
     ne_lng: float,
     type_ids: Optional[list[int]] = None,
     include_unverified: bool = True,
+    collapse_duplicates: bool = False,
 ) -> int:
     """
     Count locations within a bounding box using R-tree index.
@@ -188,12 +1203,32 @@ async def get_locations_count_in_bounds(
         ne_lng: Northeast longitude
         type_ids: Optional filter by type IDs
         include_unverified: Include unverified locations
+        collapse_duplicates: Count each near-duplicate group once (per shard,
+            so the rare group straddling a shard edge counts in each)
 
     Returns:
         Total count of matching locations
     """
+    if db.columns is not None and not collapse_duplicates:
+        args = (sw_lat, sw_lng, ne_lat, ne_lng, tuple(type_ids or ()), include_unverified)
+        return await db.coalesce(
+            ("columnar_count", args),
+            lambda: db.compute(db.columns.count_in_bounds, *args),
+        )
+
     # Count query using R-tree for spatial filtering
-    if type_ids:
+    if collapse_duplicates:
+        # Ungrouped locations count one each, grouped ones once per group
+        query = """
+            SELECT COUNT(*) - COUNT(g.group_id) + COUNT(DISTINCT g.group_id)
+            FROM locations l
+            INNER JOIN locations_rtree r ON l.id = r.id
+            LEFT JOIN location_groups g ON g.location_id = l.id
+            WHERE r.min_lat <= ? AND r.max_lat >= ?
+              AND r.min_lng <= ? AND r.max_lng >= ?
+              AND l.hidden = 0
+        """
+    elif type_ids:
         # Need to join with location_types to filter by type
         query = """
             SELECT COUNT(DISTINCT l.id)
@@ -214,48 +1249,208 @@ async def get_locations_count_in_bounds(
               AND r.min_lng <= ? AND r.max_lng >= ?
               AND l.hidden = 0
         """
-    params: list = [ne_lat, sw_lat, ne_lng, sw_lng]
+    params: list = _rtree_bounds(db, sw_lat, sw_lng, ne_lat, ne_lng)
 
     if not include_unverified:
         query += " AND l.unverified = 0"
 
     if type_ids:
         placeholders = ",".join("?" * len(type_ids))
-        query += f" AND lt.type_id IN ({placeholders})"
+        if collapse_duplicates:
+            query += f"""
+              AND EXISTS (
+                  SELECT 1 FROM location_types lt
+                  WHERE lt.location_id = l.id AND lt.type_id IN ({placeholders})
+              )
+            """
+        else:
+            query += f" AND lt.type_id IN ({placeholders})"
         params.extend(type_ids)
 
-    count = await db.fetch_value(query, tuple(params))
+    stores = db.location_stores((sw_lat, sw_lng, ne_lat, ne_lng))
+    counts = await asyncio.gather(*(store.fetch_value(query, tuple(params)) for store in stores))
+    count = sum(shard_count or 0 for shard_count in counts)
     return count or 0
 
 
+def _read_points_in_boxes(conn: sqlite3.Connection, query: str, box_params: list[list]) -> list[tuple]:
+    """Batch: (id, lat, lng) of the locations matching `query` in any of the boxes, each once."""
+    points: dict[int, tuple] = {}
+    cursor = tuple_cursor(conn)
+    for params in box_params:
+        for row in cursor.execute(query, params):
+            points[row[0]] = row
+    return list(points.values())
+
+
+async def get_locations_within(
+    db: Database,
+    shape: Shape,
+    type_ids: Optional[list[int]] = None,
+    limit: int = 1000,
+    offset: int = 0,
+    include_unverified: bool = True,
+) -> dict:
+    """
+    Get locations inside a polygon or within a route corridor.
+
+    The shape is probed as a set of small boxes (R-tree or columnar store),
+    which return only (id, lat, lng); the exact geometric test runs on those
+    arrays, and summary rows are read for the returned page only.
+
+    Args:
+        shape: Polygon or Corridor from geometry.parse_shape
+        type_ids: Optional filter by type IDs
+        limit: Max results
+        offset: Pagination offset
+        include_unverified: Include unverified locations
+
+    Returns:
+        Dict with total (all matches) and locations: polygon matches by id,
+        corridor matches nearest first with distance_m
+    """
+    boxes = shape.probe_boxes()
+    if db.columns is not None:
+        ids, lat, lng = await db.compute(
+            db.columns.points_in_boxes, boxes, type_ids, include_unverified,
+        )
+    else:
+        query = """
+            SELECT l.id, l.lat, l.lng
+            FROM locations l
+            INNER JOIN locations_rtree r ON l.id = r.id
+            WHERE r.min_lat <= ? AND r.max_lat >= ?
+              AND r.min_lng <= ? AND r.max_lng >= ?
+              AND l.hidden = 0
+        """
+        if not include_unverified:
+            query += " AND l.unverified = 0"
+        if type_ids:
+            placeholders = ",".join("?" * len(type_ids))
+            query += f"""
+              AND EXISTS (
+                  SELECT 1 FROM location_types lt
+                  WHERE lt.location_id = l.id AND lt.type_id IN ({placeholders})
+              )
+            """
+
+        stores = db.location_stores(shape.bounds)
+        results = await asyncio.gather(*(
+            store.batch(
+                _read_points_in_boxes, query,
+                [_rtree_bounds(store, *box) + list(type_ids or ()) for box in boxes],
+            )
+            for store in stores
+        ))
+        points = np.array(
+            [row for shard_rows in results for row in shard_rows], dtype=np.float64,
+        ).reshape(-1, 3)
+        ids, lat, lng = points[:, 0].astype(np.int64), points[:, 1], points[:, 2]
+
+    def select_page(check: Callable[[], None]) -> tuple[int, list[int], Optional[list[float]]]:
+        check()
+        mask, distance = shape.match(lat, lng)
+        matched = np.flatnonzero(mask)
+        if distance is not None:
+            order = matched[np.lexsort((ids[matched], distance[matched]))]
+        else:
+            order = matched[np.argsort(ids[matched], kind="stable")]
+        page = order[offset:offset + limit]
+        distances = distance[page].tolist() if distance is not None else None
+        return len(matched), ids[page].tolist(), distances
+
+    total, page_ids, distances = await db.compute(select_page)
+    rows = await _get_location_summaries(db, page_ids, type_ids, shape.bounds)
+
+    # Restore the geometric ordering
+    by_id = {row["id"]: row for row in rows}
+    locations = []
+    for i, location_id in enumerate(page_ids):
+        row = by_id.get(location_id)
+        if row is None:
+            continue
+        if distances is not None:
+            row["distance_m"] = round(distances[i], 1)
+        locations.append(row)
+    return {"total": total, "locations": locations}
+
+
+def _read_location(
+    conn: sqlite3.Connection,
+    location_id: int,
+    compact: bool,
+    with_types: bool = True,
+) -> Optional[tuple]:
+    """Batch: location row with its column names, plus its type rows (if `with_types`)."""
+    if compact:
+        # Cold columns live in the side table
+        query = """
+            SELECT 
+                l.*,
+                d.address, d.import_link, d.original_ids,
+                GROUP_CONCAT(DISTINCT lt.type_id) as type_ids
+            FROM locations l
+            LEFT JOIN location_details d ON l.id = d.location_id
+            LEFT JOIN location_types lt ON l.id = lt.location_id
+            WHERE l.id = ? AND l.hidden = 0
+            GROUP BY l.id
+        """
+    else:
+        query = """
+            SELECT 
+                l.*,
+                GROUP_CONCAT(DISTINCT lt.type_id) as type_ids
+            FROM locations l
+            LEFT JOIN location_types lt ON l.id = lt.location_id
+            WHERE l.id = ? AND l.hidden = 0
+            GROUP BY l.id
+        """
+    cursor = tuple_cursor(conn).execute(query, (location_id,))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    columns = [column[0] for column in cursor.description]
+    
+    types: list[tuple] = []
+    type_ids = row[columns.index("type_ids")]
+    if type_ids and with_types:
+        types = _read_types(conn, [int(tid) for tid in type_ids.split(",")])
+    return columns, row, types
+
+
+def _read_types(conn: sqlite3.Connection, type_ids: list[int]) -> list[tuple]:
+    """Batch: summary rows of the given types."""
+    placeholders = ",".join("?" * len(type_ids))
+    return tuple_cursor(conn).execute(f"""
+        SELECT id, en_name, scientific_name, category_mask
+        FROM types WHERE id IN ({placeholders})
+    """, type_ids).fetchall()
+
+
 async def get_location_by_id(db: Database, location_id: int) -> Optional[dict]:
     """Get a single location with its type details."""
-    location = await db.fetch_one("""
-        SELECT 
-            l.*,
-            GROUP_CONCAT(DISTINCT lt.type_id) as type_ids
-        FROM locations l
-        LEFT JOIN location_types lt ON l.id = lt.location_id
-        WHERE l.id = ? AND l.hidden = 0
-        GROUP BY l.id
-    """, (location_id,))
-    
-    if location is None:
+    # Sharded: the location's shard is unknown, so probe them all (primary key lookups)
+    sharded = bool(db.shards)
+    results = await asyncio.gather(*(
+        store.batch(_read_location, location_id, store.compact, not sharded, key=("location", location_id))
+        for store in db.location_stores()
+    ))
+    result = next((result for result in results if result is not None), None)
+    if result is None:
         return None
+    columns, row, types = result
+    location = dict(zip(columns, row))
     
-    # Parse type_ids and get type details
+    # Parse type_ids and attach type details
     if location.get("type_ids"):
-        type_ids = [int(tid) for tid in location["type_ids"].split(",")]
-        location["type_ids"] = type_ids
-        
-        # Get type details
-        if type_ids:
-            placeholders = ",".join("?" * len(type_ids))
-            types = await db.fetch_all(f"""
-                SELECT id, en_name, scientific_name, category_mask
-                FROM types WHERE id IN ({placeholders})
-            """, tuple(type_ids))
-            location["types"] = types
+        location["type_ids"] = [int(tid) for tid in location["type_ids"].split(",")]
+        if sharded:
+            # Types live in the shared database
+            types = await db.batch(_read_types, location["type_ids"])
+        location["types"] = [
+            dict(zip(("id", "en_name", "scientific_name", "category_mask"), type_row))
+            for type_row in types
+        ]
     else:
         location["type_ids"] = []
         location["types"] = []
@@ -306,9 +1501,9 @@ async def get_all_types(
     return rows
 
 
-async def get_type_by_id(db: Database, type_id: int) -> Optional[dict]:
-    """Get a single type with full details."""
-    type_data = await db.fetch_one("""
+def _read_type(conn: sqlite3.Connection, type_id: int) -> Optional[tuple]:
+    """Batch: type row with its column names, its child rows and its location count."""
+    cursor = tuple_cursor(conn).execute("""
         SELECT 
             t.*,
             p.en_name as parent_name
@@ -316,9 +1511,37 @@ async def get_type_by_id(db: Database, type_id: int) -> Optional[dict]:
         LEFT JOIN types p ON t.parent_id = p.id
         WHERE t.id = ? AND t.pending = 0
     """, (type_id,))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    columns = [column[0] for column in cursor.description]
+    
+    children = tuple_cursor(conn).execute("""
+        SELECT id, en_name, scientific_name
+        FROM types WHERE parent_id = ? AND pending = 0
+        ORDER BY en_name
+    """, (type_id,)).fetchall()
     
-    if type_data is None:
+    (count,) = tuple_cursor(conn).execute("""
+        SELECT COUNT(*) FROM location_types WHERE type_id = ?
+    """, (type_id,)).fetchone()
+    return columns, row, children, count
+
+
+async def get_type_by_id(db: Database, type_id: int) -> Optional[dict]:
+    """Get a single type with full details."""
+    result = await db.batch(_read_type, type_id, key=("type", type_id))
+    if result is None:
         return None
+    columns, row, children, count = result
+    if db.shards:
+        # Location links live in the shards
+        counts = await asyncio.gather(*(
+            store.fetch_value("SELECT COUNT(*) FROM location_types WHERE type_id = ?", (type_id,))
+            for store in db.location_stores()
+        ))
+        count = sum(shard_count or 0 for shard_count in counts)
+    type_data = dict(zip(columns, row))
     
     # Parse localized_names JSON
     if type_data.get("localized_names"):
@@ -329,34 +1552,242 @@ async def get_type_by_id(db: Database, type_id: int) -> Optional[dict]:
     else:
         type_data["localized_names"] = {}
     
-    # Get child types
-    children = await db.fetch_all("""
-        SELECT id, en_name, scientific_name
-        FROM types WHERE parent_id = ? AND pending = 0
-        ORDER BY en_name
-    """, (type_id,))
-    type_data["children"] = children
-    
-    # Get location count for this type
-    count = await db.fetch_value("""
-        SELECT COUNT(*) FROM location_types WHERE type_id = ?
-    """, (type_id,))
+    type_data["children"] = [
+        dict(zip(("id", "en_name", "scientific_name"), child)) for child in children
+    ]
     type_data["location_count"] = count or 0
     
     return type_data
 
 
+async def get_type_names(db: Database) -> list[dict]:
+    """Every non-pending type's names, synonyms and parsed localized names (for the suggest index)."""
+    rows = await db.fetch_all("""
+        SELECT id, en_name, en_synonyms, scientific_name, scientific_synonyms, localized_names
+        FROM types WHERE pending = 0
+    """)
+    for row in rows:
+        try:
+            row["localized_names"] = json.loads(row["localized_names"] or "{}")
+        except json.JSONDecodeError:
+            row["localized_names"] = {}
+    return rows
+
+
+async def get_type_location_counts(db: Database) -> dict[int, int]:
+    """Visible locations per type, from the zoom 0 facet tiles when available."""
+    if await db.table_exists("density_type_cells"):
+        rows = await db.fetch_all("""
+            SELECT type_id, SUM(count) AS count FROM density_type_cells
+            WHERE z = 0 GROUP BY type_id
+        """)
+        if rows:
+            return {row["type_id"]: row["count"] for row in rows}
+    
+    counts: dict[int, int] = {}
+    query = """
+        SELECT lt.type_id, COUNT(*) AS count
+        FROM location_types lt
+        JOIN locations l ON l.id = lt.location_id
+        WHERE l.hidden = 0
+        GROUP BY lt.type_id
+    """
+    results = await asyncio.gather(*(store.fetch_all(query) for store in db.location_stores()))
+    for rows in results:
+        for row in rows:
+            counts[row["type_id"]] = counts.get(row["type_id"], 0) + row["count"]
+    return counts
+
+
 async def get_stats(db: Database) -> dict:
     """Get database statistics."""
-    locations_count = await db.fetch_value("SELECT COUNT(*) FROM locations WHERE hidden = 0")
+    stores = db.location_stores()
+    locations_counts = await asyncio.gather(*(
+        store.fetch_value("SELECT COUNT(*) FROM locations WHERE hidden = 0") for store in stores
+    ))
     types_count = await db.fetch_value("SELECT COUNT(*) FROM types WHERE pending = 0")
-    verified_count = await db.fetch_value("SELECT COUNT(*) FROM locations WHERE hidden = 0 AND unverified = 0")
+    verified_counts = await asyncio.gather(*(
+        store.fetch_value("SELECT COUNT(*) FROM locations WHERE hidden = 0 AND unverified = 0")
+        for store in stores
+    ))
+    locations_count = sum(count or 0 for count in locations_counts)
+    verified_count = sum(count or 0 for count in verified_counts)
     
     return {
         "locations_total": locations_count or 0,
         "locations_verified": verified_count or 0,
-        "types_total": types_count or 0
+        "types_total": types_count or 0,
+        "dataset_version": await get_dataset_version(db),
+    }
+
+
+async def get_dataset_version(db: Database) -> Optional[int]:
+    """Get the current dataset version, or None if the import predates versioning."""
+    if not await db.table_exists("dataset_versions"):
+        return None
+    return await db.fetch_value("SELECT MAX(version) FROM dataset_versions")
+
+
+async def get_density_cells(
+    db: Database,
+    zoom: int,
+    sw_lat: float,
+    sw_lng: float,
+    ne_lat: float,
+    ne_lng: float,
+) -> Optional[list[tuple]]:
+    """
+    Get precomputed density grid cells covering a bounding box.
+
+    Reads the density_cells pyramid built by import.py, so the cost depends on
+    the number of tiles in view rather than the number of locations.
+
+    Args:
+        zoom: Grid zoom level (0..DENSITY_MAX_ZOOM)
+        sw_lat: Southwest latitude
+        sw_lng: Southwest longitude
+        ne_lat: Northeast latitude
+        ne_lng: Northeast longitude
+
+    Returns:
+        List of tuples ordered as DENSITY_FIELDS, or None if the database
+        has no density grid
+    """
+    if not await db.table_exists("density_cells"):
+        return None
+
+    # Tile y grows southward, so the NE corner gives the minimum y
+    min_x, min_y = tile_for_point(ne_lat, sw_lng, zoom)
+    max_x, max_y = tile_for_point(sw_lat, ne_lng, zoom)
+
+    cursor = await db.execute(f"""
+        SELECT {", ".join(DENSITY_FIELDS)}
+        FROM density_cells
+        WHERE z = ? AND x BETWEEN ? AND ? AND y BETWEEN ? AND ?
+    """, (zoom, min_x, max_x, min_y, max_y))
+    rows = await cursor.fetchall()
+    return [tuple(row) for row in rows]
+
+
+async def get_location_facets(
+    db: Database,
+    sw_lat: float,
+    sw_lng: float,
+    ne_lat: float,
+    ne_lng: float,
+) -> Optional[dict]:
+    """
+    Get per-type and per-category location counts for a bounding box.
+
+    Sums the precomputed density_type_cells/density_cells tiles at the finest
+    facet zoom where the bbox spans at most FACET_MAX_CELLS tiles, so the cost
+    is independent of how many locations are in view. Counts are tile-granular:
+    locations in edge tiles just outside the bbox are included.
+
+    Returns:
+        Dict with zoom, total, categories and types (sorted by count), or None
+        if the database has no facet tables
+    """
+    if not await db.table_exists("density_type_cells"):
+        return None
+
+    for zoom in reversed(FACET_ZOOMS):
+        min_x, min_y = tile_for_point(ne_lat, sw_lng, zoom)
+        max_x, max_y = tile_for_point(sw_lat, ne_lng, zoom)
+        if (max_x - min_x + 1) * (max_y - min_y + 1) <= FACET_MAX_CELLS:
+            break
+    params = (zoom, min_x, max_x, min_y, max_y)
+
+    types = await db.fetch_all("""
+        SELECT type_id, SUM(count) as count
+        FROM density_type_cells
+        WHERE z = ? AND x BETWEEN ? AND ? AND y BETWEEN ? AND ?
+        GROUP BY type_id
+        ORDER BY count DESC, type_id
+    """, params)
+
+    sums = ", ".join(f"SUM({name}) as {name}" for name in DENSITY_CATEGORIES)
+    totals = await db.fetch_one(f"""
+        SELECT SUM(verified + unverified) as total, {sums}
+        FROM density_cells
+        WHERE z = ? AND x BETWEEN ? AND ? AND y BETWEEN ? AND ?
+    """, params)
+
+    return {
+        "z": zoom,
+        "total": totals["total"] or 0,
+        "categories": {name: totals[name] or 0 for name in DENSITY_CATEGORIES},
+        "types": types,
     }
 
 
+async def get_changes_since(
+    db: Database,
+    since: int,
+    sw_lat: Optional[float] = None,
+    sw_lng: Optional[float] = None,
+    ne_lat: Optional[float] = None,
+    ne_lng: Optional[float] = None,
+    limit: int = 1000,
+    after: Optional[tuple[int, int]] = None,
+) -> Optional[dict]:
+    """
+    Get location changes recorded after a dataset version.
+
+    Changes are keyset-paged in (version, location id) order. With a bbox,
+    only changes in the zoom 12 tiles covering it are returned; a location
+    that moved matches by its old tile as well as its new one.
+
+    Args:
+        since: Dataset version the client already has
+        sw_lat: Optional southwest latitude
+        sw_lng: Optional southwest longitude
+        ne_lat: Optional northeast latitude
+        ne_lng: Optional northeast longitude
+        limit: Max changes per page
+        after: (version, location_id) of the last change on the previous page
+
+    Returns:
+        Dict with version, available, changes (tuples ordered as CHANGE_FIELDS)
+        and next (cursor tuple or None); None if the database has no change log.
+        available is False when the log no longer covers every version after
+        `since`, and the client must reload instead.
+    """
+    version = await get_dataset_version(db)
+    if version is None:
+        return None
+
+    # Every version after `since` must still be retained with its changes logged
+    logged = await db.fetch_value("""
+        SELECT COUNT(*) FROM dataset_versions
+        WHERE version > ? AND changes_recorded = 1
+    """, (since,))
+    if since > version or logged != version - since:
+        return {"version": version, "available": False, "changes": [], "next": None}
+
+    after_version, after_id = after or (since, 0)
+    query = """
+        SELECT version, location_id, change
+        FROM location_changes
+        WHERE version > ? AND (version, location_id) > (?, ?)
+    """
+    params: list = [since, after_version, after_id]
+
+    if None not in (sw_lat, sw_lng, ne_lat, ne_lng):
+        min_x, min_y = tile_for_point(ne_lat, sw_lng, CHANGE_CELL_ZOOM)
+        max_x, max_y = tile_for_point(sw_lat, ne_lng, CHANGE_CELL_ZOOM)
+        query += """
+            AND ((cell_x BETWEEN ? AND ? AND cell_y BETWEEN ? AND ?)
+              OR (old_cell_x BETWEEN ? AND ? AND old_cell_y BETWEEN ? AND ?))
+        """
+        params.extend([min_x, max_x, min_y, max_y] * 2)
+
+    # One extra row tells whether there is another page
+    query += " ORDER BY version, location_id LIMIT ?"
+    params.append(limit + 1)
+
+    rows = await db.fetch_all(query, tuple(params))
+    changes = [(row["version"], row["location_id"], row["change"]) for row in rows[:limit]]
+    next_after = changes[-1][:2] if len(rows) > limit else None
 
+    return {"version": version, "available": True, "changes": changes, "next": next_after}
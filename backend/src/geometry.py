@@ -0,0 +1,299 @@
+"""
+Polygon and route-corridor shapes for spatial queries.
+
+A shape is turned into a handful of bounding boxes for R-tree probes (latitude
+bands of a polygon, short buffered pieces of a route), and the candidates
+those probes return are filtered exactly with vectorized NumPy: even-odd
+point-in-polygon, or distance to the route on a local equirectangular
+projection. Both filters only compare a point with the edges or segments of
+the probe it falls in, so cost stays proportional to candidates, not to
+candidates x vertices. Coordinates follow GeoJSON: [lng, lat] positions.
+"""
+
+import math
+from dataclasses import dataclass
+from typing import Optional, Union
+
+import numpy as np
+
+# Most vertices a shape may have, and the widest corridor
+MAX_VERTICES = 5000
+MAX_BUFFER_M = 5000.0
+
+# Latitude bands a polygon is split into for probing
+POLYGON_BANDS = 16
+
+# Most probe boxes along a route (long routes get longer pieces)
+CORRIDOR_MAX_PROBES = 256
+
+EARTH_RADIUS_M = 6371008.8
+METERS_PER_DEGREE = EARTH_RADIUS_M * math.pi / 180
+
+# Point chunk size x edges per broadcast in the polygon test
+_BROADCAST_CELLS = 1 << 20
+
+Box = tuple[float, float, float, float]
+
+
+def _positions(coordinates: list, name: str) -> np.ndarray:
+    """GeoJSON positions as an (n, 2) array of [lng, lat], validated."""
+    try:
+        points = np.array([position[:2] for position in coordinates], dtype=np.float64)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} positions must be [lng, lat] pairs")
+    if points.ndim != 2 or points.shape[1] != 2 or not np.isfinite(points).all():
+        raise ValueError(f"{name} positions must be [lng, lat] pairs")
+    if (np.abs(points[:, 0]) > 180).any() or (np.abs(points[:, 1]) > 90).any():
+        raise ValueError(f"{name} positions must be within lng -180..180 and lat -90..90")
+    return points
+
+
+def _bounds_of(points: np.ndarray, pad_lat: float = 0.0, pad_lng: float = 0.0) -> Box:
+    """(sw_lat, sw_lng, ne_lat, ne_lng) of [lng, lat] points, optionally padded."""
+    return (
+        max(float(points[:, 1].min()) - pad_lat, -90.0),
+        max(float(points[:, 0].min()) - pad_lng, -180.0),
+        min(float(points[:, 1].max()) + pad_lat, 90.0),
+        min(float(points[:, 0].max()) + pad_lng, 180.0),
+    )
+
+
+def _lat_slices(lat_sorted: np.ndarray, boxes: list[Box]) -> list[slice]:
+    """For each box, the slice of lat-sorted points within its latitude range."""
+    lo = np.searchsorted(lat_sorted, [box[0] for box in boxes], side="left")
+    hi = np.searchsorted(lat_sorted, [box[2] for box in boxes], side="right")
+    return [slice(int(a), int(b)) for a, b in zip(lo, hi)]
+
+
+@dataclass
+class Polygon:
+    """A GeoJSON polygon: an outer ring and optional holes, each an (n, 2) [lng, lat] array."""
+    rings: list[np.ndarray]
+
+    @property
+    def bounds(self) -> Box:
+        return _bounds_of(self.rings[0])
+
+    def _edges(self) -> np.ndarray:
+        """Every ring edge as rows of (lng0, lat0, lng1, lat1)."""
+        return np.concatenate([np.hstack([ring[:-1], ring[1:]]) for ring in self.rings])
+
+    def probe_boxes(self) -> list[Box]:
+        """
+        Equal latitude bands over the polygon, each narrowed to the longitude
+        span of the edges crossing it, so concave and diagonal shapes probe
+        far less empty area than their bounding box.
+        """
+        sw_lat, _, ne_lat, _ = self.bounds
+        edges = self._edges()
+        lat0, lat1 = np.minimum(edges[:, 1], edges[:, 3]), np.maximum(edges[:, 1], edges[:, 3])
+        step = (ne_lat - sw_lat) / POLYGON_BANDS
+        boxes = []
+        for band in range(POLYGON_BANDS):
+            low = sw_lat + band * step
+            high = ne_lat if band == POLYGON_BANDS - 1 else low + step
+            crossing = edges[(lat0 <= high) & (lat1 >= low)]
+            if len(crossing) == 0:
+                continue
+            # Clip each edge to the band and take the longitude range of what
+            # remains: where edges cross the band limits, plus vertices inside it
+            dlat = crossing[:, 3] - crossing[:, 1]
+            slope = np.divide(
+                crossing[:, 2] - crossing[:, 0], dlat,
+                out=np.zeros_like(dlat), where=dlat != 0,
+            )
+            ends = []
+            for limit in (low, high):
+                clipped = np.clip(limit, np.minimum(crossing[:, 1], crossing[:, 3]),
+                                  np.maximum(crossing[:, 1], crossing[:, 3]))
+                ends.append(crossing[:, 0] + (clipped - crossing[:, 1]) * slope)
+            for vertex in (crossing[:, 0:2], crossing[:, 2:4]):
+                ends.append(vertex[(vertex[:, 1] >= low) & (vertex[:, 1] <= high), 0])
+            lng = np.concatenate(ends)
+            boxes.append((low, float(lng.min()), high, float(lng.max())))
+        return boxes
+
+    def match(self, lat: np.ndarray, lng: np.ndarray) -> tuple[np.ndarray, Optional[np.ndarray]]:
+        """Mask of points inside the polygon (holes excluded); no distances."""
+        inside = np.zeros(len(lat), dtype=bool)
+        if len(lat) == 0:
+            return inside, None
+        order = np.argsort(lat, kind="stable")
+        lat_sorted = lat[order]
+        edges = self._edges()
+        edge_lat0 = np.minimum(edges[:, 1], edges[:, 3])
+        edge_lat1 = np.maximum(edges[:, 1], edges[:, 3])
+
+        boxes = self.probe_boxes()
+        for box, rows in zip(boxes, _lat_slices(lat_sorted, boxes)):
+            # Points on a band boundary are tested by both bands with the same result
+            band_edges = edges[(edge_lat0 <= box[2]) & (edge_lat1 >= box[0])]
+            index = order[rows]
+            index = index[(lng[index] >= box[1]) & (lng[index] <= box[3])]
+            if len(index) == 0 or len(band_edges) == 0:
+                continue
+            inside[index] = self._even_odd(lat[index], lng[index], band_edges)
+        return inside, None
+
+    @staticmethod
+    def _even_odd(lat: np.ndarray, lng: np.ndarray, edges: np.ndarray) -> np.ndarray:
+        """Ray casting: a point is inside if a ray to the east crosses an odd number of edges."""
+        x0, y0, x1, y1 = (edges[:, i] for i in range(4))
+        chunk = max(1, _BROADCAST_CELLS // len(edges))
+        result = np.empty(len(lat), dtype=bool)
+        for start in range(0, len(lat), chunk):
+            py = lat[start:start + chunk, None]
+            px = lng[start:start + chunk, None]
+            spans = (y0 > py) != (y1 > py)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                cross_x = x0 + (py - y0) * (x1 - x0) / (y1 - y0)
+            crossings = np.count_nonzero(spans & (px < cross_x), axis=1)
+            result[start:start + chunk] = crossings % 2 == 1
+        return result
+
+
+@dataclass
+class Corridor:
+    """Everything within `buffer_m` meters of a GeoJSON LineString ((n, 2) [lng, lat])."""
+    line: np.ndarray
+    buffer_m: float
+
+    def _pad(self, lat: float) -> tuple[float, float]:
+        """Buffer in degrees of latitude and of longitude at `lat`."""
+        pad_lat = self.buffer_m / METERS_PER_DEGREE
+        cos_lat = max(math.cos(math.radians(min(abs(lat) + pad_lat, 89.9))), 1e-6)
+        return pad_lat, pad_lat / cos_lat
+
+    @property
+    def bounds(self) -> Box:
+        pad_lat, pad_lng = self._pad(float(np.abs(self.line[:, 1]).max()))
+        return _bounds_of(self.line, pad_lat, pad_lng)
+
+    def _pieces(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Segments split into pieces no longer than a few buffer widths, as rows
+        of (lng0, lat0, lng1, lat1), and the probe each piece belongs to.
+
+        Consecutive pieces share a probe until the route has run `piece_m`
+        past the probe's start, so short segments of a dense route are merged
+        and there are never more than CORRIDOR_MAX_PROBES probes.
+        """
+        starts, ends = self.line[:-1], self.line[1:]
+        mid_lat = np.radians((starts[:, 1] + ends[:, 1]) / 2)
+        lengths = np.hypot(
+            (ends[:, 0] - starts[:, 0]) * np.cos(mid_lat), ends[:, 1] - starts[:, 1],
+        ) * METERS_PER_DEGREE
+        piece_m = max(4 * self.buffer_m, lengths.sum() / CORRIDOR_MAX_PROBES, 1.0)
+        counts = np.maximum(np.ceil(lengths / piece_m).astype(np.int64), 1)
+
+        segment = np.repeat(np.arange(len(starts)), counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        t0 = (offsets / np.repeat(counts, counts))[:, None]
+        t1 = ((offsets + 1) / np.repeat(counts, counts))[:, None]
+        delta = ends[segment] - starts[segment]
+        pieces = np.hstack([starts[segment] + delta * t0, starts[segment] + delta * t1])
+
+        # Route distance at each piece's midpoint decides its probe
+        piece_lengths = lengths[segment] / counts[segment]
+        midpoints = np.cumsum(piece_lengths) - piece_lengths / 2
+        probe = np.minimum(midpoints // piece_m, CORRIDOR_MAX_PROBES - 1).astype(np.int64)
+        # Renumber without gaps (probes no piece fell into)
+        _, probe = np.unique(probe, return_inverse=True)
+        return pieces, probe
+
+    def _probes(self) -> list[np.ndarray]:
+        """The pieces of each probe, in route order."""
+        pieces, probe = self._pieces()
+        splits = np.flatnonzero(np.diff(probe)) + 1
+        return np.split(pieces, splits)
+
+    def probe_boxes(self) -> list[Box]:
+        """One buffered box per run of route pieces."""
+        boxes = []
+        for pieces in self._probes():
+            lat = pieces[:, [1, 3]]
+            lng = pieces[:, [0, 2]]
+            pad_lat, pad_lng = self._pad(float(np.abs(lat).max()))
+            boxes.append((
+                max(float(lat.min()) - pad_lat, -90.0), max(float(lng.min()) - pad_lng, -180.0),
+                min(float(lat.max()) + pad_lat, 90.0), min(float(lng.max()) + pad_lng, 180.0),
+            ))
+        return boxes
+
+    def match(self, lat: np.ndarray, lng: np.ndarray) -> tuple[np.ndarray, Optional[np.ndarray]]:
+        """Mask of points within the buffer, and every point's distance to the route in meters."""
+        distance = np.full(len(lat), np.inf)
+        if len(lat) == 0:
+            return distance <= self.buffer_m, distance
+        order = np.argsort(lat, kind="stable")
+        lat_sorted = lat[order]
+
+        probes = self._probes()
+        boxes = self.probe_boxes()
+        for pieces, box, rows in zip(probes, boxes, _lat_slices(lat_sorted, boxes)):
+            index = order[rows]
+            index = index[(lng[index] >= box[1]) & (lng[index] <= box[3])]
+            if len(index) == 0:
+                continue
+            np.minimum.at(distance, index, self._distance(lat[index], lng[index], pieces, box))
+        return distance <= self.buffer_m, distance
+
+    @staticmethod
+    def _distance(lat: np.ndarray, lng: np.ndarray, pieces: np.ndarray, box: Box) -> np.ndarray:
+        """Distance in meters from each point to the nearest of `pieces`."""
+        # Local equirectangular projection around the probe, in meters
+        scale_x = math.cos(math.radians((box[0] + box[2]) / 2)) * METERS_PER_DEGREE
+        ax, ay = pieces[:, 0] * scale_x, pieces[:, 1] * METERS_PER_DEGREE
+        dx, dy = pieces[:, 2] * scale_x - ax, pieces[:, 3] * METERS_PER_DEGREE - ay
+        length_sq = dx * dx + dy * dy
+        safe_length_sq = np.where(length_sq > 0, length_sq, 1.0)
+        chunk = max(1, _BROADCAST_CELLS // len(pieces))
+        result = np.empty(len(lat))
+        for start in range(0, len(lat), chunk):
+            px = lng[start:start + chunk, None] * scale_x - ax
+            py = lat[start:start + chunk, None] * METERS_PER_DEGREE - ay
+            t = np.clip((px * dx + py * dy) / safe_length_sq, 0.0, 1.0)
+            result[start:start + chunk] = np.hypot(px - t * dx, py - t * dy).min(axis=1)
+        return result
+
+
+Shape = Union[Polygon, Corridor]
+
+
+def parse_shape(geometry_type: str, coordinates: list, buffer_m: Optional[float] = None) -> Shape:
+    """
+    Build a shape from a GeoJSON Polygon, or a LineString with a buffer.
+
+    Raises ValueError for malformed or oversized geometries.
+    """
+    if geometry_type == "Polygon":
+        if buffer_m is not None:
+            raise ValueError("buffer_m only applies to LineString geometries")
+        if not coordinates:
+            raise ValueError("Polygon needs at least one ring")
+        rings = []
+        for ring in coordinates:
+            points = _positions(ring, "Polygon")
+            if len(points) and (points[0] != points[-1]).any():
+                # Close rings that repeat no end point
+                points = np.vstack([points, points[:1]])
+            if len(points) < 4:
+                raise ValueError("Polygon rings need at least three distinct positions")
+            rings.append(points)
+        if sum(len(ring) for ring in rings) > MAX_VERTICES:
+            raise ValueError(f"Geometry has more than {MAX_VERTICES} positions")
+        return Polygon(rings)
+
+    if geometry_type == "LineString":
+        if buffer_m is None:
+            raise ValueError("LineString geometries need buffer_m")
+        if not 0 < buffer_m <= MAX_BUFFER_M:
+            raise ValueError(f"buffer_m must be between 0 and {MAX_BUFFER_M:g}")
+        line = _positions(coordinates, "LineString")
+        if len(line) < 2:
+            raise ValueError("LineString needs at least two positions")
+        if len(line) > MAX_VERTICES:
+            raise ValueError(f"Geometry has more than {MAX_VERTICES} positions")
+        return Corridor(line, float(buffer_m))
+
+    raise ValueError("Geometry must be a Polygon or LineString")
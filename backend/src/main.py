@@ -5,26 +5,46 @@ FastAPI application providing REST endpoints for the Falling Fruit data.
 Also serves the frontend static files when available.
 """
 
+import asyncio
 import os
+import sqlite3
+import sys
 from contextlib import asynccontextmanager
 from pathlib import Path
-from typing import Optional
+from typing import Literal, Optional, Union
 
 from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel, Field
 
 from .database import (
     db,
     get_locations_in_bounds,
     get_locations_count_in_bounds,
+    get_locations_within,
     get_location_by_id,
     get_all_types,
     get_type_by_id,
     get_stats,
+    get_density_cells,
+    get_location_facets,
+    get_changes_since,
+    QueryTimeout,
+    CHANGE_FIELDS,
+    tile_for_point,
+    DENSITY_FIELDS,
+    DENSITY_MAX_ZOOM,
+    DB_RELOAD_INTERVAL,
 )
+from .admission import AdmissionControl, AdmissionMiddleware
+from .geometry import MAX_BUFFER_M, parse_shape
+from .static import StaticAssets
+from .suggest import SUGGEST_MAX_LIMIT, TypeSuggester
+from .writer import ImportInProgress, InvalidSubmission, LocationWriter, WriteQueueFull
+
+# Largest number of density tiles a single request may cover
+DENSITY_MAX_CELLS = 65536
 
 
 # ============================================
@@ -44,6 +64,11 @@ class LocationSummary(BaseModel):
     unverified: bool = False
 
 
+class LocationGroupSummary(LocationSummary):
+    """Location in a bbox list; with collapse_duplicates, the representative of its group."""
+    member_count: Optional[int] = None
+
+
 class LocationDetail(LocationSummary):
     """Full location details."""
     author: Optional[str] = None
@@ -74,11 +99,81 @@ class TypeDetail(TypeSummary):
     location_count: int = 0
 
 
+class LocationCreate(BaseModel):
+    """New location submission."""
+    lat: float = Field(..., ge=-90, le=90)
+    lng: float = Field(..., ge=-180, le=180)
+    type_ids: list[int] = Field(..., min_length=1, max_length=50)
+    description: Optional[str] = Field(None, max_length=5000)
+    access: Optional[str] = Field(None, max_length=200)
+    season_start: Optional[str] = Field(None, max_length=50)
+    season_stop: Optional[str] = Field(None, max_length=50)
+    no_season: bool = False
+    author: Optional[str] = Field(None, max_length=200)
+    address: Optional[str] = Field(None, max_length=500)
+
+
+class LocationCreated(BaseModel):
+    """Response for a stored location submission."""
+    id: int
+
+
+class PolygonGeometry(BaseModel):
+    """GeoJSON Polygon: an outer ring and optional holes of [lng, lat] positions."""
+    type: Literal["Polygon"]
+    coordinates: list[list[list[float]]] = Field(..., min_length=1)
+
+
+class LineStringGeometry(BaseModel):
+    """GeoJSON LineString of [lng, lat] positions."""
+    type: Literal["LineString"]
+    coordinates: list[list[float]] = Field(..., min_length=2)
+
+
+class LocationsWithinQuery(BaseModel):
+    """Shape query: a polygon, or a route with a corridor width."""
+    geometry: Union[PolygonGeometry, LineStringGeometry] = Field(..., discriminator="type")
+    buffer_m: Optional[float] = Field(None, description="Corridor half-width in meters (LineString only)", gt=0, le=MAX_BUFFER_M)
+    types: Optional[list[int]] = Field(None, description="Type IDs to filter", max_length=100)
+    limit: int = Field(1000, description="Max results", ge=1, le=5000)
+    offset: int = Field(0, description="Pagination offset", ge=0)
+    verified_only: bool = Field(False, description="Only return verified locations")
+
+
+class LocationWithin(LocationSummary):
+    """Location matched by a shape query, with its distance to the route for corridors."""
+    distance_m: Optional[float] = None
+
+
+class LocationsWithinResponse(BaseModel):
+    """Response for shape queries."""
+    count: int
+    total: int
+    locations: list[LocationWithin]
+
+
+class TypeSuggestion(BaseModel):
+    """Autocomplete match: the type and the name that matched."""
+    id: int
+    name: str
+    lang: str
+    en_name: Optional[str] = None
+    scientific_name: Optional[str] = None
+    location_count: int = 0
+
+
+class TypeSuggestResponse(BaseModel):
+    """Response for type autocomplete."""
+    query: str
+    count: int
+    suggestions: list[TypeSuggestion]
+
+
 class LocationsResponse(BaseModel):
     """Response for locations list endpoint."""
     count: int
     total: int
-    locations: list[LocationSummary]
+    locations: list[LocationGroupSummary]
 
 
 class TypesResponse(BaseModel):
@@ -87,30 +182,107 @@ class TypesResponse(BaseModel):
     types: list[TypeSummary]
 
 
+class DensityResponse(BaseModel):
+    """Response for density grid endpoint (cells are rows ordered as `fields`)."""
+    z: int
+    fields: list[str]
+    cells: list[list[int]]
+
+
+class TypeFacet(BaseModel):
+    """Location count for one type."""
+    type_id: int
+    count: int
+
+
+class FacetsResponse(BaseModel):
+    """Response for viewport facet counts (tile-granular at zoom `z`)."""
+    z: int
+    total: int
+    categories: dict[str, int]
+    types: list[TypeFacet]
+
+
+class ChangesResponse(BaseModel):
+    """Response for changes feed (changes are rows ordered as `fields`)."""
+    version: int
+    since: int
+    fields: list[str]
+    changes: list[list[Union[int, str]]]
+    next_cursor: Optional[str] = None
+
+
 class StatsResponse(BaseModel):
     """Response for stats endpoint."""
     locations_total: int
     locations_verified: int
     types_total: int
+    dataset_version: Optional[int] = None
 
 
 class HealthResponse(BaseModel):
     """Response for health check."""
     status: str
     database: str
+    query_coalescing: dict = {}
+    writer: Optional[dict] = None
+    admission: dict = {}
 
 
 # ============================================
 # Application Setup
 # ============================================
 
+# Optional page-cache warmup at startup; health reports "warming" until done
+DB_WARMUP = os.getenv("DATABASE_WARMUP", "false").lower() == "true"
+
+# Location submissions go through a single writer; none in read-only mode. Run
+# the writer in one process only (the compose file's `writer` service) and keep
+# multi-worker readers read-only, so workers don't each start their own
+writer: Optional[LocationWriter] = None if db.readonly else LocationWriter(db.db_path)
+
+# Type name autocomplete index, built at startup
+type_suggester: Optional[TypeSuggester] = None
+
+
+async def reload_sharded_database() -> None:
+    """Poll for a new shard manifest and switch to that import (types included)."""
+    global type_suggester
+    while True:
+        await asyncio.sleep(DB_RELOAD_INTERVAL)
+        try:
+            if await db.reload():
+                type_suggester = await TypeSuggester.load(db)
+        except (OSError, ValueError, sqlite3.Error) as exc:
+            # Keep serving the current import; the next poll retries
+            print(f"Database reload failed: {exc}", file=sys.stderr)
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Application lifespan handler."""
+    global writer, type_suggester
     # Startup
     await db.connect()
+    type_suggester = await TypeSuggester.load(db)
+    if db.shards or not await db.table_exists("location_submissions"):
+        # Submissions write the main database's location tables, which sharding
+        # empties, and need the table imports carry them forward from
+        writer = None
+    if writer is not None:
+        await writer.start()
+    warmup_task = asyncio.create_task(db.warmup()) if DB_WARMUP else None
+    reload_task = (
+        asyncio.create_task(reload_sharded_database()) if db.shards and DB_RELOAD_INTERVAL > 0 else None
+    )
     yield
     # Shutdown
+    if warmup_task is not None:
+        warmup_task.cancel()
+    if reload_task is not None:
+        reload_task.cancel()
+    if writer is not None:
+        await writer.stop()
     await db.disconnect()
 
 
@@ -121,6 +293,10 @@ app = FastAPI(
     lifespan=lifespan,
 )
 
+# Load shedding: bounded admission queue, request deadlines, cancellation on disconnect
+admission = AdmissionControl()
+app.add_middleware(AdmissionMiddleware, control=admission)
+
 # CORS configuration
 app.add_middleware(
     CORSMiddleware,
@@ -131,6 +307,15 @@ app.add_middleware(
 )
 
 
+@app.exception_handler(QueryTimeout)
+async def query_timeout_handler(request: Request, exc: QueryTimeout):
+    """A read ran past its deadline: fail fast instead of holding the connection."""
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Query took too long; try a smaller area or more filters"},
+    )
+
+
 # ============================================
 # Endpoints
 # ============================================
@@ -145,12 +330,33 @@ async def health_check():
     except Exception as e:
         db_status = f"error: {str(e)}"
     
+    if db_status == "connected" and db.warmed_up is False:
+        # Not ready yet: fail the container health check until the cache is warm
+        return JSONResponse(
+            status_code=503,
+            content=HealthResponse(
+                status="warming",
+                database=db_status,
+                query_coalescing=db.coalesce_stats,
+                writer=writer.stats if writer is not None else None,
+                admission=_admission_stats(),
+            ).model_dump(),
+        )
+    
     return HealthResponse(
         status="healthy" if db_status == "connected" else "degraded",
-        database=db_status
+        database=db_status,
+        query_coalescing=db.coalesce_stats,
+        writer=writer.stats if writer is not None else None,
+        admission=_admission_stats(),
     )
 
 
+def _admission_stats() -> dict:
+    """Admission counters plus reads stopped by their deadline."""
+    return {**admission.stats, "queries_interrupted": db.interrupted}
+
+
 @app.get("/api/stats", response_model=StatsResponse, tags=["System"])
 async def get_statistics():
     """Get database statistics."""
@@ -170,12 +376,19 @@ async def list_locations(
     verified_only: bool = Query(False, description="Only return verified locations"),
     center_lat: Optional[float] = Query(None, description="Center latitude for distance-based ordering", ge=-90, le=90),
     center_lng: Optional[float] = Query(None, description="Center longitude for distance-based ordering", ge=-180, le=180),
+    sample: Optional[Literal["stratified"]] = Query(None, description="'stratified' spreads results evenly over the viewport instead of paging"),
+    collapse_duplicates: bool = Query(False, description="Return one location per group of near-duplicates, with its member_count"),
 ):
     """
     Get locations within a bounding box.
 
     Uses R-tree spatial index for efficient queries.
     Optionally orders results by distance from a center point.
+    With sample=stratified, returns up to `limit` locations spread over the
+    bounding box (stable between requests; offset and center are ignored).
+    With collapse_duplicates=true, locations stacked on nearly the same spot
+    with a shared type (grouped at import) are returned as one location, the
+    lowest id among the group's matches, with member_count; total counts groups.
     """
     # Parse type IDs if provided
     type_ids = None
@@ -187,7 +400,23 @@ async def list_locations(
 
     include_unverified = not verified_only
 
-    # Get locations and total count in parallel
+    if collapse_duplicates and not await db.table_exists("location_groups"):
+        raise HTTPException(status_code=503, detail="Duplicate groups not available")
+
+    # Sampling needs the total up front to size the sample
+    total = None
+    if sample:
+        total = await get_locations_count_in_bounds(
+            db,
+            sw_lat=sw_lat,
+            sw_lng=sw_lng,
+            ne_lat=ne_lat,
+            ne_lng=ne_lng,
+            type_ids=type_ids,
+            include_unverified=include_unverified,
+            collapse_duplicates=collapse_duplicates,
+        )
+
     locations = await get_locations_in_bounds(
         db,
         sw_lat=sw_lat,
@@ -200,22 +429,200 @@ async def list_locations(
         include_unverified=include_unverified,
         center_lat=center_lat,
         center_lng=center_lng,
+        sample=sample,
+        total=total,
+        collapse_duplicates=collapse_duplicates,
+    )
+
+    if total is None:
+        total = await get_locations_count_in_bounds(
+            db,
+            sw_lat=sw_lat,
+            sw_lng=sw_lng,
+            ne_lat=ne_lat,
+            ne_lng=ne_lng,
+            type_ids=type_ids,
+            include_unverified=include_unverified,
+            collapse_duplicates=collapse_duplicates,
+        )
+
+    return LocationsResponse(
+        count=len(locations),
+        total=total,
+        locations=[LocationGroupSummary(**loc) for loc in locations]
     )
 
-    total = await get_locations_count_in_bounds(
+
+@app.post("/api/locations", response_model=LocationCreated, status_code=201, tags=["Locations"])
+async def create_location(location: LocationCreate):
+    """
+    Submit a new location.
+
+    Submissions are queued to a single writer that commits them in small
+    batches; the response arrives once the location is stored. Map reads are
+    never blocked by writes. The density and facet counts are updated in the
+    same transaction (the optional columnar store catches up on the next import,
+    which keeps every submission).
+    """
+    if writer is None:
+        raise HTTPException(status_code=503, detail="Submissions are disabled on this read-only, sharded or outdated database")
+    try:
+        location_id = await writer.submit(location.model_dump())
+    except WriteQueueFull:
+        raise HTTPException(status_code=503, detail="Too many pending submissions, try again shortly")
+    except ImportInProgress:
+        raise HTTPException(status_code=503, detail="A data import is in progress, try again later")
+    except InvalidSubmission as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return LocationCreated(id=location_id)
+
+
+@app.post("/api/locations/within", response_model=LocationsWithinResponse, tags=["Locations"])
+async def locations_within(body: LocationsWithinQuery):
+    """
+    Get locations inside a GeoJSON polygon, or within buffer_m meters of a
+    GeoJSON LineString (e.g. a walking route).
+
+    The shape is probed through the spatial index in small boxes and matched
+    exactly on the server, so only locations in the shape are returned.
+    Polygon matches are ordered by id, corridor matches nearest first.
+    """
+    try:
+        shape = parse_shape(body.geometry.type, body.geometry.coordinates, body.buffer_m)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    result = await get_locations_within(
+        db,
+        shape,
+        type_ids=body.types or None,
+        limit=body.limit,
+        offset=body.offset,
+        include_unverified=not body.verified_only,
+    )
+    return LocationsWithinResponse(
+        count=len(result["locations"]),
+        total=result["total"],
+        locations=[LocationWithin(**loc) for loc in result["locations"]],
+    )
+
+
+@app.get("/api/density", response_model=DensityResponse, tags=["Locations"])
+async def get_density(
+    z: int = Query(..., description="Grid zoom level (clamped to the finest precomputed zoom)", ge=0, le=22),
+    sw_lat: float = Query(..., description="Southwest latitude", ge=-90, le=90),
+    sw_lng: float = Query(..., description="Southwest longitude", ge=-180, le=180),
+    ne_lat: float = Query(..., description="Northeast latitude", ge=-90, le=90),
+    ne_lng: float = Query(..., description="Northeast longitude", ge=-180, le=180),
+):
+    """
+    Get location counts per map tile for heatmaps and low-zoom views.
+
+    Served from the precomputed density pyramid, so response time does not
+    depend on how many locations fall inside the bounding box.
+    """
+    zoom = min(z, DENSITY_MAX_ZOOM)
+
+    min_x, min_y = tile_for_point(ne_lat, sw_lng, zoom)
+    max_x, max_y = tile_for_point(sw_lat, ne_lng, zoom)
+    if (max_x - min_x + 1) * (max_y - min_y + 1) > DENSITY_MAX_CELLS:
+        raise HTTPException(status_code=400, detail="Bounding box covers too many cells for this zoom")
+
+    cells = await get_density_cells(
         db,
+        zoom=zoom,
         sw_lat=sw_lat,
         sw_lng=sw_lng,
         ne_lat=ne_lat,
         ne_lng=ne_lng,
-        type_ids=type_ids,
-        include_unverified=include_unverified,
     )
+    if cells is None:
+        raise HTTPException(status_code=503, detail="Density grid not available")
 
-    return LocationsResponse(
-        count=len(locations),
-        total=total,
-        locations=[LocationSummary(**loc) for loc in locations]
+    return DensityResponse(
+        z=zoom,
+        fields=DENSITY_FIELDS,
+        cells=[list(cell) for cell in cells]
+    )
+
+
+@app.get("/api/locations/facets", response_model=FacetsResponse, tags=["Locations"])
+async def location_facets(
+    sw_lat: float = Query(..., description="Southwest latitude", ge=-90, le=90),
+    sw_lng: float = Query(..., description="Southwest longitude", ge=-180, le=180),
+    ne_lat: float = Query(..., description="Northeast latitude", ge=-90, le=90),
+    ne_lng: float = Query(..., description="Northeast longitude", ge=-180, le=180),
+):
+    """
+    Get per-type and per-category location counts for a viewport.
+
+    Summed from precomputed tile x type counts, so it stays fast for
+    metro-sized or larger views. Tiles on the edge are counted whole.
+    """
+    facets = await get_location_facets(
+        db,
+        sw_lat=sw_lat,
+        sw_lng=sw_lng,
+        ne_lat=ne_lat,
+        ne_lng=ne_lng,
+    )
+    if facets is None:
+        raise HTTPException(status_code=503, detail="Facet counts not available")
+
+    return FacetsResponse(**facets)
+
+
+@app.get("/api/changes", response_model=ChangesResponse, tags=["Locations"])
+async def list_changes(
+    since: int = Query(..., description="Dataset version the client already has", ge=0),
+    sw_lat: Optional[float] = Query(None, description="Southwest latitude", ge=-90, le=90),
+    sw_lng: Optional[float] = Query(None, description="Southwest longitude", ge=-180, le=180),
+    ne_lat: Optional[float] = Query(None, description="Northeast latitude", ge=-90, le=90),
+    ne_lng: Optional[float] = Query(None, description="Northeast longitude", ge=-180, le=180),
+    limit: int = Query(1000, description="Max changes per page", ge=1, le=5000),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+):
+    """
+    Get locations inserted, updated, hidden or deleted since a dataset version.
+
+    Lets clients patch cached viewport data after a nightly import instead of
+    re-downloading it. Returns 410 when the change log no longer reaches back
+    to `since`; the client should then reload and adopt the current version.
+    """
+    bbox = (sw_lat, sw_lng, ne_lat, ne_lng)
+    if any(v is None for v in bbox) and any(v is not None for v in bbox):
+        raise HTTPException(status_code=400, detail="Bounding box requires sw_lat, sw_lng, ne_lat and ne_lng")
+
+    after = None
+    if cursor:
+        try:
+            after_version, after_id = (int(part) for part in cursor.split(":"))
+            after = (after_version, after_id)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor format")
+
+    result = await get_changes_since(
+        db,
+        since=since,
+        sw_lat=sw_lat,
+        sw_lng=sw_lng,
+        ne_lat=ne_lat,
+        ne_lng=ne_lng,
+        limit=limit,
+        after=after,
+    )
+    if result is None:
+        raise HTTPException(status_code=503, detail="Change log not available")
+    if not result["available"]:
+        raise HTTPException(status_code=410, detail=f"Changes since version {since} not available; reload at version {result['version']}")
+
+    next_after = result["next"]
+    return ChangesResponse(
+        version=result["version"],
+        since=since,
+        fields=CHANGE_FIELDS,
+        changes=[list(change) for change in result["changes"]],
+        next_cursor=f"{next_after[0]}:{next_after[1]}" if next_after else None,
     )
 
 
@@ -248,6 +655,28 @@ async def list_types(
     )
 
 
+@app.get("/api/types/suggest", response_model=TypeSuggestResponse, tags=["Types"])
+async def suggest_types(
+    q: str = Query(..., description="Name prefix (any word; accents and case are ignored)", min_length=1, max_length=100),
+    lang: Optional[str] = Query(None, description="Language code (e.g. de, zh_hans) to search besides English and scientific names; all languages if omitted", pattern=r"^[a-z]{2}(_[a-z]+)?$"),
+    limit: int = Query(10, description="Max suggestions", ge=1, le=SUGGEST_MAX_LIMIT),
+):
+    """
+    Autocomplete plant types by name.
+
+    Matches English and scientific names, their synonyms and localized names
+    from an in-memory prefix index, most common types first.
+    """
+    if type_suggester is None:
+        raise HTTPException(status_code=503, detail="Type index not ready")
+    suggestions = type_suggester.suggest(q, lang=lang, limit=limit)
+    return TypeSuggestResponse(
+        query=q,
+        count=len(suggestions),
+        suggestions=[TypeSuggestion(**suggestion) for suggestion in suggestions],
+    )
+
+
 @app.get("/api/types/{type_id}", response_model=TypeDetail, tags=["Types"])
 async def get_type(type_id: int):
     """Get details for a specific plant type."""
@@ -267,47 +696,27 @@ async def get_type(type_id: int):
 FRONTEND_DIR = Path(__file__).parent.parent / "frontend" / "dist"
 
 if FRONTEND_DIR.exists():
-    # Serve static assets (JS, CSS, etc.)
-    app.mount("/assets", StaticFiles(directory=FRONTEND_DIR / "assets"), name="assets")
-    
-    # Serve other static files (icons, manifest, sw.js, etc.)
-    @app.get("/manifest.webmanifest")
-    async def manifest():
-        return FileResponse(FRONTEND_DIR / "manifest.webmanifest", media_type="application/manifest+json")
-    
-    @app.get("/sw.js")
-    async def service_worker():
-        return FileResponse(FRONTEND_DIR / "sw.js", media_type="application/javascript")
-    
-    @app.get("/registerSW.js")
-    async def register_service_worker():
-        return FileResponse(FRONTEND_DIR / "registerSW.js", media_type="application/javascript")
-    
-    @app.get("/workbox-{rest_of_path:path}")
-    async def workbox_files(rest_of_path: str):
-        return FileResponse(FRONTEND_DIR / f"workbox-{rest_of_path}", media_type="application/javascript")
-    
-    @app.get("/icons/{icon_path:path}")
-    async def icons(icon_path: str):
-        return FileResponse(FRONTEND_DIR / "icons" / icon_path)
-    
-    @app.get("/leaf.svg")
-    async def leaf_icon():
-        return FileResponse(FRONTEND_DIR / "leaf.svg", media_type="image/svg+xml")
+    # Index dist once: hot files in memory, precompressed variants, cache headers
+    static_assets = StaticAssets(FRONTEND_DIR)
     
-    # Catch-all route for SPA - must be last
+    # Catch-all route for static files and the SPA - must be last
     @app.get("/{full_path:path}")
-    async def serve_spa(full_path: str):
-        """Serve the SPA for all non-API routes."""
+    async def serve_spa(full_path: str, request: Request):
+        """Serve built frontend files, and the SPA for all other non-API routes."""
         # Don't serve index.html for API routes
         if full_path.startswith("api/"):
             raise HTTPException(status_code=404, detail="Not found")
         
-        # Serve index.html for all other routes (SPA routing)
-        index_path = FRONTEND_DIR / "index.html"
-        if index_path.exists():
-            return FileResponse(index_path, media_type="text/html")
-        raise HTTPException(status_code=404, detail="Frontend not found")
+        asset = static_assets.get(full_path)
+        if asset is None:
+            # Hashed bundles are never rewritten to index.html
+            if full_path.startswith("assets/"):
+                raise HTTPException(status_code=404, detail="Not found")
+            # Serve index.html for all other routes (SPA routing)
+            asset = static_assets.get("index.html")
+        if asset is None:
+            raise HTTPException(status_code=404, detail="Frontend not found")
+        return static_assets.response(asset, request)
 
 
 # ============================================
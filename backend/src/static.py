@@ -0,0 +1,203 @@
+"""
+Static frontend asset serving for Rising Fruit.
+
+Indexes the built frontend (frontend/dist) once at startup instead of
+checking the filesystem per request. Small hot files stay in memory, text
+assets are served as the brotli/gzip variants written next to them at build
+time by `scripts/precompress_assets.py` (small ones from memory, large ones
+from disk), hashed files are cached as immutable, and conditional requests
+are answered with 304. Nothing is compressed at runtime.
+"""
+
+import gzip
+import hashlib
+import mimetypes
+import os
+from dataclasses import dataclass, field
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from typing import Optional, Union
+
+from fastapi import Request
+from fastapi.responses import FileResponse, Response
+
+try:
+    import brotli
+except ImportError:  # Optional: precompress writes gzip only without it
+    brotli = None
+
+# Files served from memory regardless of size
+HOT_FILES = {"index.html", "sw.js", "registerSW.js", "manifest.webmanifest"}
+
+# Other files up to this size are also kept in memory
+MEMORY_MAX_BYTES = 256 * 1024
+
+# Files worth compressing
+COMPRESSIBLE_TYPES = (
+    "text/", "application/javascript", "application/json",
+    "application/manifest+json", "image/svg+xml",
+)
+
+# Vite content-hashes everything under assets/, and workbox runtime names are versioned
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+# Entry points must be revalidated so new deploys (and service workers) are picked up
+REVALIDATE_CACHE = "no-cache"
+DEFAULT_CACHE = "public, max-age=86400"
+
+MEDIA_TYPES = {
+    ".js": "application/javascript",
+    ".mjs": "application/javascript",
+    ".webmanifest": "application/manifest+json",
+    ".svg": "image/svg+xml",
+}
+
+
+@dataclass
+class Asset:
+    """An indexed static file and its encoded variants."""
+    path: Path
+    media_type: str
+    etag: str
+    last_modified: str
+    cache_control: str
+    body: Optional[bytes] = None
+    # encoding -> in-memory bytes or precompressed file on disk
+    variants: dict[str, Union[bytes, Path]] = field(default_factory=dict)
+
+
+def _cache_control(rel_path: str) -> str:
+    """Cache policy for a file, by its location in dist."""
+    if rel_path.startswith("assets/") or rel_path.startswith("workbox-"):
+        return IMMUTABLE_CACHE
+    if rel_path in HOT_FILES:
+        return REVALIDATE_CACHE
+    return DEFAULT_CACHE
+
+
+def _media_type(path: Path) -> str:
+    """Content type for a file (mimetypes misses a few web types)."""
+    return MEDIA_TYPES.get(path.suffix) or mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+
+
+def precompress(root: Path) -> int:
+    """
+    Write brotli (.br) and gzip (.gz) siblings of the compressible files in a
+    built frontend, keeping only variants smaller than the file. Meant for
+    build time (the Dockerfile runs it); returns the number of files written.
+    """
+    written = 0
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            path = Path(dirpath) / filename
+            if path.suffix in (".br", ".gz") or not _media_type(path).startswith(COMPRESSIBLE_TYPES):
+                continue
+            data = path.read_bytes()
+            variants = {".gz": gzip.compress(data, compresslevel=9, mtime=0)}
+            if brotli is not None:
+                variants[".br"] = brotli.compress(data, quality=11)
+            for suffix, compressed in variants.items():
+                target = path.with_name(path.name + suffix)
+                if len(compressed) < len(data):
+                    target.write_bytes(compressed)
+                    written += 1
+                elif target.exists():
+                    target.unlink()
+    return written
+
+
+class StaticAssets:
+    """In-memory index of the built frontend."""
+
+    def __init__(self, root: Path):
+        self.root = root
+        self.assets: dict[str, Asset] = {}
+        self._index()
+
+    def _index(self) -> None:
+        """Walk the dist directory once and prepare every servable file."""
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = Path(dirpath) / filename
+                # Precompressed siblings are attached to their source file below
+                if path.suffix in (".br", ".gz") and path.with_suffix("").exists():
+                    continue
+                rel_path = path.relative_to(self.root).as_posix()
+                self.assets[rel_path] = self._load(rel_path, path)
+
+    def _load(self, rel_path: str, path: Path) -> Asset:
+        """Read one file: hash it, and keep it and its variants in memory if small or hot."""
+        data = path.read_bytes()
+        stat = path.stat()
+        asset = Asset(
+            path=path,
+            media_type=_media_type(path),
+            etag=hashlib.sha1(data).hexdigest()[:20],
+            last_modified=formatdate(stat.st_mtime, usegmt=True),
+            cache_control=_cache_control(rel_path),
+        )
+        in_memory = rel_path in HOT_FILES or len(data) <= MEMORY_MAX_BYTES
+        if in_memory:
+            asset.body = data
+
+        for encoding, suffix in (("br", ".br"), ("gzip", ".gz")):
+            prebuilt = path.with_name(path.name + suffix)
+            if prebuilt.exists():
+                asset.variants[encoding] = prebuilt.read_bytes() if in_memory else prebuilt
+        return asset
+
+    def get(self, rel_path: str) -> Optional[Asset]:
+        """Look up an indexed file by its path relative to dist."""
+        return self.assets.get(rel_path)
+
+    def response(self, asset: Asset, request: Request) -> Response:
+        """Serve an asset with caching headers, content negotiation and 304 support."""
+        encoding = self._pick_encoding(asset, request.headers.get("accept-encoding", ""))
+        etag = f'"{asset.etag}-{encoding}"' if encoding else f'"{asset.etag}"'
+        headers = {
+            "ETag": etag,
+            "Last-Modified": asset.last_modified,
+            "Cache-Control": asset.cache_control,
+        }
+        if asset.variants:
+            headers["Vary"] = "Accept-Encoding"
+
+        if self._not_modified(request, etag, asset.last_modified):
+            return Response(status_code=304, headers=headers)
+
+        if encoding:
+            headers["Content-Encoding"] = encoding
+            content = asset.variants[encoding]
+        else:
+            content = asset.body if asset.body is not None else asset.path
+
+        if isinstance(content, Path):
+            return FileResponse(content, media_type=asset.media_type, headers=headers)
+        return Response(content=content, media_type=asset.media_type, headers=headers)
+
+    @staticmethod
+    def _pick_encoding(asset: Asset, accept_encoding: str) -> Optional[str]:
+        """Best available variant the client accepts (brotli over gzip)."""
+        accepted = set()
+        for part in accept_encoding.split(","):
+            name, _, params = part.strip().partition(";")
+            if params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+                accepted.add(name.strip().lower())
+        for encoding in ("br", "gzip"):
+            if encoding in asset.variants and encoding in accepted:
+                return encoding
+        return None
+
+    @staticmethod
+    def _not_modified(request: Request, etag: str, last_modified: str) -> bool:
+        """Evaluate If-None-Match, falling back to If-Modified-Since."""
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None:
+            tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+            return "*" in tags or etag in tags
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_modified_since:
+            try:
+                return parsedate_to_datetime(last_modified) <= parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError):
+                return False
+        return False
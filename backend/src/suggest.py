@@ -0,0 +1,200 @@
+"""
+Type name autocomplete for Rising Fruit.
+
+An in-memory prefix index over every type name: English and scientific names,
+their synonyms, and all localized names. Names are accent- and case-folded
+and indexed from each word start, so "apfel" finds "Äpfel" and "apple" finds
+"Crab apple". Each language is a sorted key list searched with bisect.
+Every prefix matching more than a few dozen keys gets its best results
+precomputed at startup (merged bottom-up from longer prefixes), so a lookup
+never ranks more than PRECOMPUTE_MIN_RANGE keys. Results are ranked by
+location count.
+"""
+
+import bisect
+import re
+import unicodedata
+from typing import Iterable, Optional
+
+from .database import Database, get_type_location_counts, get_type_names
+
+# Most suggestions a request may ask for
+SUGGEST_MAX_LIMIT = 50
+
+# Prefixes matching more keys than this get precomputed result lists
+PRECOMPUTE_MIN_RANGE = 16
+
+# Pseudo-languages always searched: English names and scientific names (with synonyms)
+BASE_LANGUAGES = ("en", "sci")
+
+_SEPARATORS = re.compile(r"[\W_]+")
+
+
+def fold(text: str) -> str:
+    """Normalize a name for matching: strip accents, casefold, collapse punctuation to spaces."""
+    decomposed = unicodedata.normalize("NFKD", text)
+    stripped = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return _SEPARATORS.sub(" ", stripped.casefold()).strip()
+
+
+def _split_synonyms(value: Optional[str]) -> list[str]:
+    """Synonym lists are comma (or semicolon) separated."""
+    if not value:
+        return []
+    return [name.strip() for name in re.split(r"[,;]", value) if name.strip()]
+
+
+class _LanguageIndex:
+    """Sorted prefix keys of one language, with precomputed results for wide prefixes."""
+
+    def __init__(self, entries: list[tuple[str, int, str, bool]], ranks: dict[int, tuple]):
+        # (key, type_id, name, from a later word)
+        entries.sort()
+        self.keys = [entry[0] for entry in entries]
+        self.entries = entries
+        self.ranks = ranks
+        self.top: dict[str, list[int]] = {}
+        self._build_top(0, len(entries), 0)
+
+    def _build_top(self, lo: int, hi: int, depth: int) -> list[int]:
+        """
+        Best positions for keys[lo:hi], which share their first `depth` characters.
+
+        Wide ranges are split by their next character and merged from the
+        children's best lists, and recorded in `top`.
+        """
+        if hi - lo <= PRECOMPUTE_MIN_RANGE:
+            return self.best(range(lo, hi), SUGGEST_MAX_LIMIT)
+        candidates = []
+        i = lo
+        # A key equal to the shared prefix sorts first
+        while i < hi and len(self.keys[i]) == depth:
+            candidates.append(i)
+            i += 1
+        while i < hi:
+            prefix = self.keys[i][:depth + 1]
+            j = bisect.bisect_left(self.keys, prefix[:-1] + chr(ord(prefix[-1]) + 1), i, hi)
+            candidates.extend(self._build_top(i, j, depth + 1))
+            i = j
+        top = self.best(candidates, SUGGEST_MAX_LIMIT)
+        if depth:
+            self.top[self.keys[lo][:depth]] = top
+        return top
+
+    def matches(self, prefix: str) -> list[int]:
+        """Best entry positions (one per type, best first) whose key starts with the folded prefix."""
+        top = self.top.get(prefix)
+        if top is not None:
+            return top
+        lo = bisect.bisect_left(self.keys, prefix)
+        hi = bisect.bisect_left(self.keys, prefix[:-1] + chr(ord(prefix[-1]) + 1), lo)
+        return self.best(range(lo, hi), SUGGEST_MAX_LIMIT)
+
+    def best(self, positions: Iterable[int], limit: int) -> list[int]:
+        """Best entry per type among positions, best types first."""
+        entries = self.entries
+        chosen: dict[int, tuple[bool, int, int]] = {}
+        for position in positions:
+            _, type_id, name, later_word = entries[position]
+            preference = (later_word, len(name), position)
+            current = chosen.get(type_id)
+            if current is None or preference < current:
+                chosen[type_id] = preference
+        ranks = self.ranks
+        ordered = sorted(chosen, key=ranks.__getitem__)[:limit]
+        return [chosen[type_id][2] for type_id in ordered]
+
+    def preference(self, position: int) -> tuple[bool, int]:
+        """Which of a type's matching names to show: full-name matches, then shorter names."""
+        _, _, name, later_word = self.entries[position]
+        return later_word, len(name)
+
+
+class TypeSuggester:
+    """Multilingual prefix index over type names, ranked by location count."""
+
+    def __init__(self, types: list[dict], counts: dict[int, int]):
+        self.types = {row["id"]: row for row in types}
+        self.counts = counts
+        # Most locations first, then shorter and alphabetical names
+        ranks = {
+            row["id"]: (-counts.get(row["id"], 0), len(row["en_name"] or ""), row["en_name"] or "", row["id"])
+            for row in types
+        }
+
+        entries: dict[str, list[tuple[str, int, str, bool]]] = {}
+        for row in types:
+            names = {
+                "en": [row["en_name"], *_split_synonyms(row["en_synonyms"])],
+                "sci": [row["scientific_name"], *_split_synonyms(row["scientific_synonyms"])],
+            }
+            for lang, name in row["localized_names"].items():
+                names.setdefault(lang, []).append(name)
+            for lang, lang_names in names.items():
+                for name in lang_names:
+                    if name:
+                        self._add(entries.setdefault(lang, []), row["id"], name)
+
+        self.indexes = {lang: _LanguageIndex(lang_entries, ranks) for lang, lang_entries in entries.items()}
+        self.ranks = ranks
+
+    @staticmethod
+    def _add(entries: list, type_id: int, name: str) -> None:
+        """Index a name from the start of each of its words."""
+        key = fold(name)
+        if not key:
+            return
+        entries.append((key, type_id, name, False))
+        for i, char in enumerate(key):
+            if char == " ":
+                entries.append((key[i + 1:], type_id, name, True))
+
+    @classmethod
+    async def load(cls, db: Database) -> "TypeSuggester":
+        """Build the index from the database."""
+        return cls(await get_type_names(db), await get_type_location_counts(db))
+
+    @property
+    def languages(self) -> list[str]:
+        """Languages with indexed names (besides the always-searched base languages)."""
+        return sorted(lang for lang in self.indexes if lang not in BASE_LANGUAGES)
+
+    def suggest(self, query: str, lang: Optional[str] = None, limit: int = 10) -> list[dict]:
+        """
+        Types with a name starting with `query` (at any word), best first.
+
+        With `lang`, searches English, scientific and that language's names;
+        otherwise every language.
+        """
+        prefix = fold(query)
+        if not prefix:
+            return []
+        languages = (*BASE_LANGUAGES, lang) if lang else tuple(self.indexes)
+
+        # Best matching name per type across languages
+        chosen: dict[int, tuple[tuple, str, str]] = {}
+        for language in languages:
+            index = self.indexes.get(language)
+            if index is None:
+                continue
+            for position in index.matches(prefix)[:limit]:
+                _, type_id, name, _ = index.entries[position]
+                preference = index.preference(position)
+                # The requested language wins ties over the base names
+                preference = (*preference, 0 if language == lang else 1)
+                current = chosen.get(type_id)
+                if current is None or preference < current[0]:
+                    chosen[type_id] = (preference, name, language)
+
+        ordered = sorted(chosen, key=lambda type_id: self.ranks[type_id])[:limit]
+        return [
+            {
+                "id": type_id,
+                "name": chosen[type_id][1],
+                "lang": chosen[type_id][2],
+                "en_name": self.types[type_id]["en_name"],
+                "scientific_name": self.types[type_id]["scientific_name"],
+                "location_count": self.counts.get(type_id, 0),
+            }
+            for type_id in ordered
+        ]
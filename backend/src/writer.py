@@ -0,0 +1,314 @@
+"""
+Batched write path for new location submissions.
+
+Submissions are queued to a single writer task. The writer collects whatever
+arrives within a short window and commits it as one transaction: the
+location_submissions row that the next import carries forward, the locations
+rows (the R-tree follows via the schema triggers), their location_types links,
+cold columns in compact mode, and the density_cells / density_type_cells
+counts. Submitted ids are allocated above SUBMISSION_ID_BASE, so they never
+collide with Falling Fruit ids. Readers use a separate connection and keep
+reading the last committed snapshot under WAL, so bursts of submissions never
+block map queries.
+
+Each batch opens its own connection while holding the import lock
+(`<db>.lock`) shared, and closes it before letting go. An import holds that
+lock exclusively while it replaces the database, so the writer never holds
+the file an import moves aside, and batches arriving meanwhile are turned
+away instead of going into it.
+"""
+
+import asyncio
+import fcntl
+import json
+import os
+import sqlite3
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Optional
+
+from .database import (
+    DB_PATH,
+    DENSITY_CATEGORIES,
+    DENSITY_MAX_ZOOM,
+    FACET_ZOOMS,
+    tile_for_point,
+)
+
+# Group commit: how long the writer waits for more submissions, and the largest batch
+WRITE_BATCH_WINDOW = float(os.getenv("WRITE_BATCH_WINDOW_MS", "50")) / 1000
+WRITE_BATCH_MAX = 500
+
+# Submissions allowed to wait for the writer before new ones are turned away
+WRITE_QUEUE_MAX = 10_000
+
+# Submitted locations get ids above this (must match db/import.py)
+SUBMISSION_ID_BASE = 1_000_000_000
+
+LOCATION_COLUMNS = [
+    "lat", "lng", "unverified", "description", "season_start", "season_stop",
+    "no_season", "author", "access", "created_at", "updated_at",
+]
+DETAIL_COLUMNS = ["address"]
+
+
+class WriteQueueFull(Exception):
+    """Raised when the writer is too far behind to accept a submission."""
+
+
+class InvalidSubmission(ValueError):
+    """Raised for a submission that cannot be stored (e.g. unknown type)."""
+
+
+class ImportInProgress(Exception):
+    """Raised while an import holds the database lock."""
+
+
+class LocationWriter:
+    """Single writer task that group-commits location submissions."""
+
+    def __init__(self, db_path: Path = DB_PATH):
+        self.db_path = db_path
+        self.lock_path = db_path.with_name(db_path.name + ".lock")
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=WRITE_QUEUE_MAX)
+        self._task: Optional[asyncio.Task] = None
+        self._compact = False
+        self._derived_tables: set[str] = set()
+        self.batches = 0
+        self.written = 0
+
+    async def start(self) -> None:
+        """Start the writer task."""
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Write out everything already queued, then stop."""
+        if self._task is not None:
+            await self._queue.put(None)
+            await self._task
+            self._task = None
+
+    @property
+    def stats(self) -> dict:
+        """Writer counters."""
+        return {
+            "queued": self._queue.qsize(),
+            "batches": self.batches,
+            "written": self.written,
+        }
+
+    async def submit(self, location: dict) -> int:
+        """Queue a new location and wait until it is committed; returns its id."""
+        if self._task is None:
+            raise RuntimeError("Writer not started. Call start() first.")
+        # Verification is never up to the submitter
+        location = dict(location, unverified=1)
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((location, future))
+        except asyncio.QueueFull:
+            raise WriteQueueFull("Too many pending submissions")
+        # The write happens even if this caller goes away
+        return await asyncio.shield(future)
+
+    async def _run(self) -> None:
+        """Writer loop: gather a batch within the window, commit it, resolve callers."""
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = loop.time() + WRITE_BATCH_WINDOW
+            while len(batch) < WRITE_BATCH_MAX:
+                timeout = deadline - loop.time()
+                try:
+                    if timeout > 0:
+                        item = await asyncio.wait_for(self._queue.get(), timeout)
+                    else:
+                        item = self._queue.get_nowait()
+                except (asyncio.TimeoutError, asyncio.QueueEmpty):
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            locations = [location for location, _ in batch]
+            try:
+                results = await asyncio.to_thread(self._write_locked, locations)
+            except Exception as e:
+                results = [e] * len(batch)
+            self.batches += 1
+            for (_, future), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    self.written += 1
+                    future.set_result(result)
+
+    def _write_locked(self, locations: list[dict]) -> list:
+        """
+        Write one batch on a fresh connection, holding the import lock shared
+        (runs in a worker thread). Raises ImportInProgress if an import holds it.
+        """
+        with open(self.lock_path, "a") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_SH | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise ImportInProgress("A data import is in progress")
+            # Autocommit mode: the writer manages its own transactions
+            conn = sqlite3.connect(str(self.db_path), isolation_level=None)
+            try:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+                conn.execute("PRAGMA busy_timeout=5000")
+                conn.execute("PRAGMA foreign_keys=ON")
+                # The import may have changed the layout since the last batch
+                tables = {row[0] for row in conn.execute(
+                    "SELECT name FROM sqlite_master WHERE type = 'table' AND name IN "
+                    "('location_details', 'density_cells', 'density_type_cells')"
+                )}
+                self._compact = "location_details" in tables
+                self._derived_tables = tables - {"location_details"}
+                return self._write_batch(conn, locations)
+            finally:
+                # Closed before the lock is released, so an import never moves an open file
+                conn.close()
+
+    def _write_batch(self, conn: sqlite3.Connection, locations: list[dict]) -> list:
+        """
+        Write one batch in a single transaction.
+
+        Each submission gets a savepoint, so a bad one fails alone. Returns the
+        new id or the exception for each submission, in order.
+        """
+        now = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S UTC")
+        results: list = []
+        written: list[tuple[dict, int]] = []
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for location in locations:
+                conn.execute("SAVEPOINT submission")
+                try:
+                    location_id = self._insert_location(conn, location, now)
+                except (sqlite3.Error, InvalidSubmission) as e:
+                    conn.execute("ROLLBACK TO submission")
+                    conn.execute("RELEASE submission")
+                    results.append(e)
+                    continue
+                conn.execute("RELEASE submission")
+                results.append(location_id)
+                written.append((location, location_id))
+
+            if written:
+                self._update_derived_counts(conn, written)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return results
+
+    def _insert_location(self, conn: sqlite3.Connection, location: dict, now: str) -> int:
+        """Insert one location and its type links; the R-tree is kept in sync by triggers."""
+        type_ids = sorted(set(location["type_ids"]))
+        placeholders = ",".join("?" * len(type_ids))
+        known = conn.execute(
+            f"SELECT COUNT(*) FROM types WHERE id IN ({placeholders}) AND pending = 0",
+            type_ids,
+        ).fetchone()[0]
+        if known != len(type_ids):
+            raise InvalidSubmission("Unknown type IDs")
+
+        # Allocated under the write lock, so concurrent writers never share an id
+        location_id = conn.execute(
+            "SELECT COALESCE(MAX(location_id), ?) + 1 FROM location_submissions",
+            (SUBMISSION_ID_BASE,),
+        ).fetchone()[0]
+        values = dict(location, created_at=now, updated_at=now)
+        submission_columns = [column for column in LOCATION_COLUMNS if column != "updated_at"]
+        conn.execute(
+            f"INSERT INTO location_submissions (location_id, {', '.join(submission_columns + DETAIL_COLUMNS)}, type_ids) "
+            f"VALUES (?, {', '.join('?' * len(submission_columns + DETAIL_COLUMNS))}, ?)",
+            [location_id, *(values.get(column) for column in submission_columns + DETAIL_COLUMNS), json.dumps(type_ids)],
+        )
+        columns = LOCATION_COLUMNS if self._compact else LOCATION_COLUMNS + DETAIL_COLUMNS
+        conn.execute(
+            f"INSERT INTO locations (id, {', '.join(columns)}) VALUES (?, {', '.join('?' * len(columns))})",
+            [location_id, *(values.get(column) for column in columns)],
+        )
+
+        if self._compact and any(values.get(column) for column in DETAIL_COLUMNS):
+            conn.execute(
+                f"INSERT INTO location_details (location_id, {', '.join(DETAIL_COLUMNS)}) "
+                f"VALUES (?, {', '.join('?' * len(DETAIL_COLUMNS))})",
+                [location_id, *(values.get(column) for column in DETAIL_COLUMNS)],
+            )
+        conn.executemany(
+            "INSERT INTO location_types (location_id, type_id) VALUES (?, ?)",
+            [(location_id, type_id) for type_id in type_ids],
+        )
+        return location_id
+
+    def _update_derived_counts(self, conn: sqlite3.Connection, written: list[tuple[dict, int]]) -> None:
+        """Add the batch to the density and facet tiles, one upsert per touched tile."""
+        if not self._derived_tables:
+            return
+
+        all_type_ids = sorted({type_id for location, _ in written for type_id in location["type_ids"]})
+        placeholders = ",".join("?" * len(all_type_ids))
+        category_masks = dict(conn.execute(
+            f"SELECT id, category_mask FROM types WHERE id IN ({placeholders})",
+            all_type_ids,
+        ).fetchall())
+
+        density: dict[tuple[int, int, int], list[int]] = {}
+        facets: dict[tuple[int, int, int, int], int] = {}
+        for location, _ in written:
+            type_ids = set(location["type_ids"])
+            categories = set()
+            for type_id in type_ids:
+                for name in (category_masks.get(type_id) or "").split(","):
+                    categories.add(name.strip())
+            weights = [
+                0 if location["unverified"] else 1,
+                1 if location["unverified"] else 0,
+                *(1 if name in categories else 0 for name in DENSITY_CATEGORIES),
+            ]
+
+            x, y = tile_for_point(location["lat"], location["lng"], DENSITY_MAX_ZOOM)
+            for zoom in range(DENSITY_MAX_ZOOM, -1, -1):
+                shift = DENSITY_MAX_ZOOM - zoom
+                cell = (zoom, x >> shift, y >> shift)
+                counts = density.setdefault(cell, [0] * len(weights))
+                for i, weight in enumerate(weights):
+                    counts[i] += weight
+                if zoom in FACET_ZOOMS:
+                    for type_id in type_ids:
+                        key = (*cell, type_id)
+                        facets[key] = facets.get(key, 0) + 1
+
+        if "density_cells" in self._derived_tables:
+            count_columns = ["verified", "unverified", *DENSITY_CATEGORIES]
+            conn.executemany(
+                f"""
+                INSERT INTO density_cells (z, x, y, {", ".join(count_columns)})
+                VALUES (?, ?, ?, {", ".join("?" * len(count_columns))})
+                ON CONFLICT (z, x, y) DO UPDATE SET
+                    {", ".join(f"{c} = {c} + excluded.{c}" for c in count_columns)}
+                """,
+                [(*cell, *counts) for cell, counts in density.items()],
+            )
+        if "density_type_cells" in self._derived_tables:
+            conn.executemany(
+                """
+                INSERT INTO density_type_cells (z, x, y, type_id, count)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (z, x, y, type_id) DO UPDATE SET count = count + excluded.count
+                """,
+                [(*key, count) for key, count in facets.items()],
+            )
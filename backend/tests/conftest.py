@@ -0,0 +1,86 @@
+"""
+Shared helpers for the backend tests: the import script and a small
+synthetic export to run it on.
+"""
+
+import csv
+import importlib.util
+import random
+from pathlib import Path
+from typing import Optional
+
+IMPORT_PATH = Path(__file__).parent.parent / "db" / "import.py"
+
+
+def load_import_module():
+    """db/import.py is a script (and `import` a keyword), so load it by path."""
+    spec = importlib.util.spec_from_file_location("rf_import", IMPORT_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def write_csvs(data_dir: Path, seed: int) -> None:
+    """Small synthetic export: a dense city cluster plus scattered points, some stacked."""
+    rng = random.Random(seed)
+    with open(data_dir / "types.csv", "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["id", "parent_id", "scientific_name", "en_name", "category_mask", "pending", "de_name"])
+        for i in range(1, 61):
+            writer.writerow([
+                i, (i % 10) + 1 if i > 10 else "", f"Species {i}", f"Type {i}",
+                "forager, grafter" if i % 2 else "honeybee", "1" if i == 60 else "0", f"Art {i}",
+            ])
+    with open(data_dir / "locations.csv", "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow([
+            "id", "lat", "lng", "unverified", "description", "author", "address",
+            "access", "import_link", "hidden", "created_at", "updated_at", "type_ids",
+        ])
+        for i in range(1, 5001):
+            if i % 10 == 2:
+                # Near-duplicate of the previous location, sharing its types
+                lat, lng = lat + 0.000005, lng
+            elif i % 2:
+                lat, lng = 37.7 + rng.gauss(0, 0.05), -122.4 + rng.gauss(0, 0.05)
+                type_ids = rng.sample(range(1, 60), rng.choice([1, 1, 2]))
+            else:
+                lat, lng = rng.uniform(-60, 70), rng.uniform(-180, 180)
+                type_ids = rng.sample(range(1, 60), rng.choice([1, 1, 2]))
+            writer.writerow([
+                i, f"{lat:.6f}", f"{lng:.6f}", "true" if i % 9 == 0 else "false", f"Tree {i}",
+                "someone", f"{i} Main St" if i % 3 else "", "Public", "", "true" if i % 97 == 0 else "false",
+                "2020-01-01 00:00:00 UTC", "2020-01-01 00:00:00 UTC", f"[{','.join(map(str, type_ids))}]",
+            ])
+
+
+def import_database(
+    rf_import,
+    data_dir: Path,
+    path: Path,
+    compact: bool = False,
+    columnar_dir: Optional[Path] = None,
+) -> None:
+    """
+    Import the CSVs in `data_dir` into `path` the way import.py does, diffing
+    against the previous import, plus a columnar store if `columnar_dir` is given.
+    """
+    import_lock = rf_import.lock_database(path)
+    previous_path = rf_import.stash_previous_database(path)
+    conn = rf_import.create_database(path, compact=compact)
+    rf_import.import_types(conn, data_dir)
+    locations_count = rf_import.import_locations(conn, data_dir, compact=compact)
+    locations_count += rf_import.carry_forward_submissions(conn, previous_path, compact=compact)
+    rf_import.create_indexes(conn)
+    version = rf_import.record_dataset_version(conn, previous_path, locations_count)
+    columns = rf_import.load_location_columns(conn)
+    rf_import.build_density_grids(conn, columns)
+    rf_import.build_facet_cells(conn, columns)
+    rf_import.build_duplicate_groups(conn, columns)
+    if columnar_dir is not None:
+        rf_import.write_columnar_store(columns, columnar_dir, version)
+    rf_import.optimize_database(conn)
+    conn.close()
+    if previous_path is not None:
+        previous_path.unlink()
+    import_lock.close()
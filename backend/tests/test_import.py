@@ -0,0 +1,70 @@
+"""
+Tests for the derived tables built by db/import.py.
+"""
+
+import csv
+import math
+import sqlite3
+from pathlib import Path
+
+import pytest
+
+from conftest import import_database, load_import_module
+
+METERS_PER_DEGREE = 111_195.0
+
+
+def write_row_of_trees(data_dir: Path, spacing_m: float, count: int = 200) -> None:
+    """One type planted `spacing_m` apart along a meridian, plus three copies of one tree elsewhere."""
+    with open(data_dir / "types.csv", "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["id", "parent_id", "scientific_name", "en_name", "category_mask", "pending"])
+        writer.writerow([1, "", "Prunus avium", "Cherry", "forager", "0"])
+    points = [(45.0 + i * spacing_m / METERS_PER_DEGREE, 7.0) for i in range(count)]
+    points += [(46.0, 8.0)] * 3
+    with open(data_dir / "locations.csv", "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow([
+            "id", "lat", "lng", "unverified", "description", "author", "address",
+            "access", "import_link", "hidden", "created_at", "updated_at", "type_ids",
+        ])
+        for i, (lat, lng) in enumerate(points, start=1):
+            writer.writerow([
+                i, f"{lat:.7f}", f"{lng:.7f}", "false", "", "", "", "", "", "false",
+                "2020-01-01 00:00:00 UTC", "2020-01-01 00:00:00 UTC", "[1]",
+            ])
+
+
+@pytest.mark.parametrize("spacing_m", [1.0, 3.0, 4.0, 6.0])
+def test_duplicate_groups_do_not_chain(tmp_path, spacing_m):
+    rf_import = load_import_module()
+    write_row_of_trees(tmp_path, spacing_m)
+    path = tmp_path / "risingfruit.db"
+    import_database(rf_import, tmp_path, path)
+
+    conn = sqlite3.connect(path)
+    try:
+        members = conn.execute("""
+            SELECT g.group_id, l.lat, l.lng, s.lat, s.lng
+            FROM location_groups g
+            JOIN locations l ON l.id = g.location_id
+            JOIN locations s ON s.id = g.group_id
+            WHERE l.lng = 7.0
+        """).fetchall()
+        stacked = conn.execute("SELECT location_id, group_id FROM location_groups WHERE location_id > 200").fetchall()
+    finally:
+        conn.close()
+
+    # Every member is near its representative, so groups stay small however dense the row
+    for _, lat, lng, seed_lat, seed_lng in members:
+        assert math.hypot(lat - seed_lat, lng - seed_lng) * METERS_PER_DEGREE < rf_import.DUPLICATE_CELL_M
+    sizes = {}
+    for group_id, *_ in members:
+        sizes[group_id] = sizes.get(group_id, 0) + 1
+    assert max(sizes.values(), default=0) <= math.ceil(rf_import.DUPLICATE_CELL_M / spacing_m)
+    if spacing_m < rf_import.DUPLICATE_CELL_M:
+        assert len(sizes) >= 200 * spacing_m / (2 * rf_import.DUPLICATE_CELL_M)
+    else:
+        assert not sizes
+    # Copies of one tree still form one group
+    assert stacked == [(201, 201), (202, 201), (203, 201)]
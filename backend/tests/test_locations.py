@@ -0,0 +1,164 @@
+"""
+Result tests for the bbox location helpers.
+
+Builds a small database through the import pipeline and checks what the
+helpers return, against counts taken straight from the location tables.
+"""
+
+import asyncio
+import sqlite3
+import time
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from src.columnar import sample_cells
+from src.database import (
+    Database,
+    QueryTimeout,
+    _sample_grid,
+    get_locations_count_in_bounds,
+    get_locations_in_bounds,
+    get_locations_within,
+    query_deadline,
+)
+from src.geometry import parse_shape
+
+from conftest import import_database, load_import_module, write_csvs
+
+# The dense city cluster of the generated data and its sparse outskirts
+OUTSKIRTS_BBOX = (37.2, -122.9, 38.2, -121.9)
+
+# Viewport around the dense cluster
+BBOX = (37.6, -122.5, 37.8, -122.3)
+
+
+@pytest.fixture(scope="module")
+def db_path(tmp_path_factory) -> Path:
+    """A database built the way import.py builds it, with a columnar store next to it."""
+    data_dir = tmp_path_factory.mktemp("data")
+    path = data_dir / "risingfruit.db"
+    write_csvs(data_dir, 1)
+    import_database(load_import_module(), data_dir, path, columnar_dir=columnar_path(path))
+    return path
+
+
+def columnar_path(db_path: Path) -> Path:
+    """Columnar store directory of a test database."""
+    return db_path.with_name(db_path.name + ".columns")
+
+
+def run_helper(db_path: Path, helper, *args, columnar: bool = False, deadline: float = None, **kwargs):
+    """Run an async database helper on a fresh read-only connection, optionally under a deadline."""
+    async def run():
+        db = Database(
+            db_path, columnar_dir=columnar_path(db_path) if columnar else None, readonly=True, shards_dir=None,
+        )
+        await db.connect()
+        query_deadline.set(deadline)
+        try:
+            return await helper(db, *args, **kwargs)
+        finally:
+            await db.disconnect()
+
+    return asyncio.run(run())
+
+
+def cell_counts(points: list[tuple[float, float]], grid: int, bbox: tuple) -> Counter:
+    """Points per sampling grid cell."""
+    lat = np.array([lat for lat, _ in points], dtype=np.float64)
+    lng = np.array([lng for _, lng in points], dtype=np.float64)
+    return Counter(sample_cells(lat, lng, grid, *bbox).tolist())
+
+
+def test_stratified_sample_keeps_sparse_cells(db_path):
+    limit = 200
+    rows = run_helper(db_path, get_locations_in_bounds, *OUTSKIRTS_BBOX, limit=limit, sample="stratified")
+
+    sw_lat, sw_lng, ne_lat, ne_lng = OUTSKIRTS_BBOX
+    conn = sqlite3.connect(db_path)
+    try:
+        visible = conn.execute(
+            "SELECT lat, lng FROM locations WHERE hidden = 0 AND lat BETWEEN ? AND ? AND lng BETWEEN ? AND ?",
+            (sw_lat, ne_lat, sw_lng, ne_lng),
+        ).fetchall()
+    finally:
+        conn.close()
+    grid = _sample_grid(limit)
+    expected = cell_counts(visible, grid, OUTSKIRTS_BBOX)
+    sampled = cell_counts([(row["lat"], row["lng"]) for row in rows], grid, OUTSKIRTS_BBOX)
+
+    assert len(rows) == limit
+    # Every cell gets the same share (one less where the last round ran out),
+    # and cells holding fewer locations than that keep all of them
+    share = max(sampled.values())
+    assert min(expected.values()) < share - 1 < max(expected.values())
+    for cell, count in expected.items():
+        assert min(count, share - 1) <= sampled[cell] <= min(count, share), (cell, count, sampled[cell])
+
+
+@pytest.mark.parametrize("helper, kwargs", [
+    (get_locations_in_bounds, {}),
+    (get_locations_in_bounds, {"limit": 100, "sample": "stratified"}),
+    (get_locations_count_in_bounds, {}),
+], ids=["page", "sample", "count"])
+def test_columnar_lookups_match_sqlite(db_path, helper, kwargs):
+    expected = run_helper(db_path, helper, *BBOX, type_ids=[1, 2], **kwargs)
+    assert run_helper(db_path, helper, *BBOX, type_ids=[1, 2], columnar=True, **kwargs) == expected
+
+
+@pytest.mark.parametrize("columnar", [False, True], ids=["sqlite", "columnar"])
+def test_lookups_stop_at_their_deadline(db_path, columnar):
+    expired = time.monotonic() - 1
+    route = parse_shape("LineString", [[-122.45, 37.7], [-122.4, 37.75]], buffer_m=200)
+    with pytest.raises(QueryTimeout):
+        run_helper(db_path, get_locations_in_bounds, *BBOX, columnar=columnar, deadline=expired)
+    with pytest.raises(QueryTimeout):
+        run_helper(db_path, get_locations_count_in_bounds, *BBOX, columnar=columnar, deadline=expired)
+    with pytest.raises(QueryTimeout):
+        run_helper(db_path, get_locations_within, route, columnar=columnar, deadline=expired)
+
+
+def test_collapsed_locations_count_and_page_groups(db_path):
+    located = run_helper(db_path, get_locations_count_in_bounds, *BBOX)
+    groups = run_helper(db_path, get_locations_count_in_bounds, *BBOX, collapse_duplicates=True)
+    collapsed = run_helper(db_path, get_locations_in_bounds, *BBOX, limit=located, collapse_duplicates=True)
+
+    assert groups < located
+    assert len(collapsed) == groups
+    assert sum(row["member_count"] for row in collapsed) == located
+    # Pages are slices of the same id order
+    pages = [
+        run_helper(db_path, get_locations_in_bounds, *BBOX, limit=50, offset=offset, collapse_duplicates=True)
+        for offset in (0, 50)
+    ]
+    assert [row["id"] for page in pages for row in page] == [row["id"] for row in collapsed[:100]]
+
+
+def test_collapsed_markers_sit_with_their_members(db_path):
+    duplicate_cell_m = load_import_module().DUPLICATE_CELL_M
+    collapsed = run_helper(db_path, get_locations_in_bounds, *BBOX, limit=10_000, collapse_duplicates=True)
+    sw_lat, sw_lng, ne_lat, ne_lng = BBOX
+
+    conn = sqlite3.connect(db_path)
+    try:
+        for row in collapsed:
+            if row["member_count"] == 1:
+                continue
+            members = conn.execute("""
+                SELECT l.lat, l.lng FROM location_groups g
+                JOIN locations l ON l.id = g.location_id
+                WHERE g.group_id = (SELECT group_id FROM location_groups WHERE location_id = ?)
+                  AND l.hidden = 0 AND l.lat BETWEEN ? AND ? AND l.lng BETWEEN ? AND ?
+            """, (row["id"], sw_lat, ne_lat, sw_lng, ne_lng)).fetchall()
+            assert len(members) == row["member_count"]
+            # The marker is a member, and members are within DUPLICATE_CELL_M of the group's first
+            for lat, lng in members:
+                distance = np.hypot(
+                    (lat - row["lat"]) * 111_195.0, (lng - row["lng"]) * 111_195.0 * np.cos(np.radians(lat)),
+                )
+                assert distance < 2 * duplicate_cell_m
+    finally:
+        conn.close()
@@ -0,0 +1,260 @@
+"""
+Query plan regression tests for the database helpers.
+
+Builds a small database through the import pipeline (schema, bulk load,
+indexes.sql, derived tables, ANALYZE), runs each helper with a trace callback
+on the connection, and checks the EXPLAIN QUERY PLAN of every statement it
+issued: the rows each query shape depends on must be present, and the
+location tables must never be scanned in full.
+"""
+
+import asyncio
+import re
+import sqlite3
+from pathlib import Path
+
+import pytest
+
+from src.database import (
+    Database,
+    get_all_types,
+    get_changes_since,
+    get_density_cells,
+    get_location_by_id,
+    get_location_facets,
+    get_locations_count_in_bounds,
+    get_locations_in_bounds,
+    get_locations_within,
+    get_stats,
+    get_type_by_id,
+    get_type_location_counts,
+    get_type_names,
+    run_on_connection,
+)
+from src.geometry import CORRIDOR_MAX_PROBES, parse_shape
+
+from conftest import import_database, load_import_module, write_csvs
+
+# Viewport around the dense cluster of the generated data
+BBOX = (37.6, -122.5, 37.8, -122.3)
+
+# Full scans of a location table (the R-tree scan itself is the bbox filter)
+FULL_SCAN = re.compile(r"^SCAN (l|lt|d|locations|location_types|location_details)\b")
+
+RTREE_SCAN = "SCAN r VIRTUAL TABLE INDEX 2:B0D1B2D3"
+LOCATION_BY_ID = "SEARCH l USING INTEGER PRIMARY KEY (rowid=?)"
+TYPES_OF_LOCATION = "SEARCH lt USING COVERING INDEX sqlite_autoindex_location_types_1 (location_id=?) LEFT-JOIN"
+TYPES_FILTER = "SEARCH lt USING COVERING INDEX idx_location_types_type_location (type_id=? AND location_id=?)"
+GROUP_OF_LOCATION = "SEARCH g USING PRIMARY KEY (location_id=?) LEFT-JOIN"
+SAMPLE_CELL_THRESHOLD = "SEARCH c USING AUTOMATIC COVERING INDEX (cell=?)"
+
+
+@pytest.fixture(scope="module", params=[False, True], ids=["standard", "compact"])
+def db_path(request, tmp_path_factory) -> Path:
+    """
+    A database built the way import.py builds it, in the standard or compact
+    layout. Imported twice, so the second import records a change log.
+    """
+    rf_import = load_import_module()
+    data_dir = tmp_path_factory.mktemp("data")
+    path = data_dir / "risingfruit.db"
+
+    for seed in (1, 2):
+        write_csvs(data_dir, seed)
+        import_database(rf_import, data_dir, path, compact=request.param)
+    return path
+
+
+def query_plans(db_path: Path, helper, *args, **kwargs) -> list[list[str]]:
+    """Run a helper and return the query plan of every SELECT it executed."""
+    statements: list[str] = []
+
+    async def run() -> None:
+        db = Database(db_path, columnar_dir=None, readonly=True, shards_dir=None)
+        await db.connect()
+        try:
+            await run_on_connection(db.connection, sqlite3.Connection.set_trace_callback, statements.append)
+            await helper(db, *args, **kwargs)
+        finally:
+            await db.disconnect()
+
+    asyncio.run(run())
+
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        # The trace callback reports statements with their parameters bound, including
+        # the R-tree module's own reads of its shadow tables ('main'.'...'), which are skipped
+        selects = [
+            sql for sql in statements
+            if sql.lstrip().upper().startswith("SELECT")
+            and "'main'." not in sql and "sqlite_master" not in sql
+        ]
+        assert selects, f"{helper.__name__} ran no queries"
+        return [[row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}")] for sql in selects]
+    finally:
+        conn.close()
+
+
+def assert_plans(plans: list[list[str]], *expected: list[str]) -> None:
+    """Each query's plan contains its expected rows, and no plan scans a location table."""
+    assert len(plans) == len(expected), plans
+    for plan, rows in zip(plans, expected):
+        for row in rows:
+            assert row in plan, f"expected {row!r} in {plan}"
+        scans = [row for row in plan if FULL_SCAN.match(row)]
+        assert not scans, f"full scan in {plan}"
+
+
+def test_locations_in_bounds(db_path):
+    plans = query_plans(db_path, get_locations_in_bounds, *BBOX)
+    assert_plans(plans, [RTREE_SCAN, LOCATION_BY_ID, TYPES_OF_LOCATION])
+
+
+def test_locations_in_bounds_filtered(db_path):
+    plans = query_plans(
+        db_path, get_locations_in_bounds, *BBOX,
+        type_ids=[1, 2], include_unverified=False, center_lat=37.7, center_lng=-122.4,
+    )
+    assert_plans(plans, [RTREE_SCAN, LOCATION_BY_ID, TYPES_OF_LOCATION])
+
+
+def test_locations_in_bounds_sampled(db_path):
+    plans = query_plans(db_path, get_locations_in_bounds, *BBOX, limit=100, sample="stratified")
+    # Count first, then the density tiles sizing each cell's threshold, then
+    # the rank-threshold sample straight off the R-tree, each row finding its
+    # cell's threshold by index
+    assert_plans(
+        plans,
+        [RTREE_SCAN],
+        ["SEARCH density_cells USING PRIMARY KEY (z=? AND x>? AND x<?)"],
+        [RTREE_SCAN, LOCATION_BY_ID, TYPES_OF_LOCATION, SAMPLE_CELL_THRESHOLD],
+    )
+
+
+def test_locations_in_bounds_sampled_by_type(db_path):
+    plans = query_plans(
+        db_path, get_locations_in_bounds, *BBOX, type_ids=[1, 2], limit=10, sample="stratified",
+    )
+    assert_plans(
+        plans,
+        [RTREE_SCAN, LOCATION_BY_ID, TYPES_OF_LOCATION],
+        ["SEARCH density_type_cells USING PRIMARY KEY (z=? AND x>? AND x<?)"],
+        [RTREE_SCAN, LOCATION_BY_ID, TYPES_OF_LOCATION, SAMPLE_CELL_THRESHOLD],
+    )
+
+
+def test_locations_in_bounds_collapsed(db_path):
+    plans = query_plans(
+        db_path, get_locations_in_bounds, *BBOX, type_ids=[1, 2], collapse_duplicates=True,
+    )
+    # Lean grouped query for the page, then the summaries of its representatives
+    assert_plans(
+        plans,
+        [RTREE_SCAN, LOCATION_BY_ID, TYPES_FILTER, GROUP_OF_LOCATION],
+        [LOCATION_BY_ID, TYPES_OF_LOCATION],
+    )
+
+
+def test_locations_count_in_bounds(db_path):
+    plans = query_plans(db_path, get_locations_count_in_bounds, *BBOX)
+    assert_plans(plans, [RTREE_SCAN, LOCATION_BY_ID])
+
+
+def test_locations_count_in_bounds_verified(db_path):
+    plans = query_plans(db_path, get_locations_count_in_bounds, *BBOX, include_unverified=False)
+    # The flags are checked by rowid, in the table or idx_locations_visible depending on stats
+    assert_plans(plans, [RTREE_SCAN])
+    assert any(row.startswith("SEARCH l USING") and "rowid=?" in row for row in plans[0]), plans
+
+
+def test_locations_count_in_bounds_by_type(db_path):
+    plans = query_plans(db_path, get_locations_count_in_bounds, *BBOX, type_ids=[1, 2])
+    assert_plans(plans, [RTREE_SCAN, LOCATION_BY_ID, TYPES_OF_LOCATION])
+
+
+def test_locations_count_in_bounds_collapsed(db_path):
+    plans = query_plans(db_path, get_locations_count_in_bounds, *BBOX, collapse_duplicates=True)
+    assert_plans(plans, [RTREE_SCAN, LOCATION_BY_ID, GROUP_OF_LOCATION])
+
+
+def test_location_by_id(db_path):
+    plans = query_plans(db_path, get_location_by_id, 1)
+    assert_plans(
+        plans,
+        [LOCATION_BY_ID, TYPES_OF_LOCATION],
+        ["SEARCH types USING INTEGER PRIMARY KEY (rowid=?)"],
+    )
+
+
+def test_type_by_id(db_path):
+    plans = query_plans(db_path, get_type_by_id, 2)
+    assert_plans(
+        plans,
+        ["SEARCH t USING INTEGER PRIMARY KEY (rowid=?)"],
+        ["SEARCH types USING INDEX idx_types_parent_id (parent_id=?)"],
+        ["SEARCH location_types USING COVERING INDEX idx_location_types_type_location (type_id=?)"],
+    )
+
+
+def test_all_types(db_path):
+    plans = query_plans(db_path, get_all_types, category="forager")
+    assert_plans(plans, ["SEARCH p USING INTEGER PRIMARY KEY (rowid=?) LEFT-JOIN"])
+
+
+def test_type_names(db_path):
+    plans = query_plans(db_path, get_type_names)
+    assert_plans(plans, [])
+
+
+def test_type_location_counts(db_path):
+    plans = query_plans(db_path, get_type_location_counts)
+    assert_plans(plans, ["SEARCH density_type_cells USING PRIMARY KEY (z=?)"])
+
+
+def test_stats(db_path):
+    plans = query_plans(db_path, get_stats)
+    assert_plans(
+        plans,
+        ["SEARCH locations USING COVERING INDEX idx_locations_visible (hidden=?)"],
+        [],
+        ["SEARCH locations USING COVERING INDEX idx_locations_visible (hidden=? AND unverified=?)"],
+        [],
+    )
+
+
+def test_density_cells(db_path):
+    plans = query_plans(db_path, get_density_cells, 10, *BBOX)
+    assert_plans(plans, ["SEARCH density_cells USING PRIMARY KEY (z=? AND x>? AND x<?)"])
+
+
+def test_location_facets(db_path):
+    plans = query_plans(db_path, get_location_facets, *BBOX)
+    assert_plans(
+        plans,
+        ["SEARCH density_type_cells USING PRIMARY KEY (z=? AND x>? AND x<?)"],
+        ["SEARCH density_cells USING PRIMARY KEY (z=? AND x>? AND x<?)"],
+    )
+
+
+def test_changes_since(db_path):
+    plans = query_plans(db_path, get_changes_since, 1, *BBOX)
+    assert_plans(
+        plans,
+        [],
+        [],
+        ["SEARCH location_changes USING PRIMARY KEY (version>?)"],
+    )
+
+
+def test_locations_within(db_path):
+    route = parse_shape("LineString", [[-122.45, 37.7], [-122.4, 37.75]], buffer_m=200)
+    plans = query_plans(db_path, get_locations_within, route, type_ids=[1, 2])
+    # One R-tree probe per route piece, then the summaries of the page
+    probe = [RTREE_SCAN, LOCATION_BY_ID, TYPES_FILTER]
+    assert_plans(plans, *[probe] * (len(plans) - 1), [LOCATION_BY_ID, TYPES_OF_LOCATION])
+    assert len(plans) == len(route.probe_boxes()) + 1
+
+    # Dense routes merge short segments instead of probing each one
+    steps = [i / 30000 for i in range(3000)]
+    dense = parse_shape("LineString", [[-122.45 + x, 37.7 + x / 2] for x in steps], buffer_m=50)
+    assert len(dense.probe_boxes()) <= CORRIDOR_MAX_PROBES
@@ -0,0 +1,78 @@
+"""
+Tests for the location submission writer against real imports.
+
+Submissions must survive re-imports: the writer pauses while an import
+holds the database lock and writes to the new database afterwards, and
+each import carries every submission forward.
+"""
+
+import asyncio
+import sqlite3
+from pathlib import Path
+
+import pytest
+
+from src.writer import SUBMISSION_ID_BASE, ImportInProgress, LocationWriter
+
+from conftest import import_database, load_import_module, write_csvs
+
+
+def submission(description: str) -> dict:
+    """A valid submission, as the API passes it to the writer."""
+    return {
+        "lat": 37.71, "lng": -122.41, "type_ids": [3, 4], "description": description,
+        "access": None, "season_start": None, "season_stop": None, "no_season": False,
+        "unverified": False, "author": "tester", "address": None,
+    }
+
+
+def stored_submissions(path: Path) -> dict[int, tuple]:
+    """Submitted locations in the database at `path`: id -> (description, unverified)."""
+    conn = sqlite3.connect(path)
+    try:
+        return {
+            row[0]: row[1:] for row in conn.execute(
+                "SELECT l.id, l.description, l.unverified FROM location_submissions s "
+                "JOIN locations l ON l.id = s.location_id"
+            )
+        }
+    finally:
+        conn.close()
+
+
+@pytest.mark.parametrize("compact", [False, True], ids=["standard", "compact"])
+def test_submissions_survive_imports_while_writer_runs(tmp_path, compact):
+    rf_import = load_import_module()
+    path = tmp_path / "risingfruit.db"
+    write_csvs(tmp_path, 1)
+    import_database(rf_import, tmp_path, path, compact=compact)
+
+    async def run() -> tuple[int, int]:
+        writer = LocationWriter(path)
+        await writer.start()
+        try:
+            before = await writer.submit(submission("before the import"))
+
+            # Turned away while an import holds the lock, not written to the old file
+            import_lock = rf_import.lock_database(path)
+            try:
+                with pytest.raises(ImportInProgress):
+                    await writer.submit(submission("during the import"))
+            finally:
+                import_lock.close()
+
+            write_csvs(tmp_path, 2)
+            await asyncio.to_thread(import_database, rf_import, tmp_path, path, compact)
+            after = await writer.submit(submission("after the import"))
+        finally:
+            await writer.stop()
+        return before, after
+
+    before, after = asyncio.run(run())
+    assert SUBMISSION_ID_BASE < before < after
+    # Submitted locations are never verified by their submitter
+    assert stored_submissions(path) == {before: ("before the import", 1), after: ("after the import", 1)}
+
+    # The next import keeps the submission written to the new database
+    import_database(rf_import, tmp_path, path, compact=compact)
+    assert set(stored_submissions(path)) == {before, after}